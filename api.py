@@ -0,0 +1,439 @@
+"""Headless HTTP API for the PO / TO workflow, for POS and ERP integrations.
+
+    python api.py [--host 127.0.0.1] [--port 8000]
+
+Runs the utils flow functions without Streamlit. Set INVENTORY_DB to persist
+to SQLite; the file is loaded once at start-up, so it must not be open in
+the Streamlit app (or another API process) at the same time. Set METRICS=1
+to collect the latency histograms served at /metrics.
+"""
+import argparse
+import datetime
+import json
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import utils
+from metrics import metrics
+
+STREAM_CHUNK = 500  # JSON lines per chunk of a streamed response
+BATCH_SLICE = 100  # /batch operations run per worker-thread hop
+
+
+class ApiError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+def _default(value):
+    if hasattr(value, "to_dict"):
+        # models.PurchaseOrder / TransferOrder / LineItems
+        return value.to_dict()
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+def dumps(value):
+    return json.dumps(value, default=_default)
+
+
+class JSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content).encode("utf-8")
+
+
+def _stream(rows):
+    """JSON Lines response; rows are encoded a chunk at a time."""
+    async def body():
+        chunk = []
+        for row in rows:
+            chunk.append(dumps(row))
+            if len(chunk) == STREAM_CHUNK:
+                yield "\n".join(chunk) + "\n"
+                chunk = []
+        if chunk:
+            yield "\n".join(chunk) + "\n"
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+async def _body(request):
+    if not await request.body():
+        return {}
+    try:
+        body = await request.json()
+    except ValueError:
+        raise ApiError(400, "Body is not valid JSON") from None
+    if not isinstance(body, dict):
+        raise ApiError(400, "Body must be a JSON object")
+    return body
+
+
+def _date(value, field="date"):
+    # "2024-01-05" -> date, "2024-01-05T10:30:00" -> datetime, None -> now
+    if value is None:
+        return None
+    try:
+        if len(value) == 10:
+            return datetime.date.fromisoformat(value)
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{field} is not an ISO date: {value!r}") from None
+
+
+def _day(value, field):
+    # Report ranges are whole days: "2024-01-05" only, no time of day
+    day = _date(value, field)
+    if isinstance(day, datetime.datetime):
+        raise ApiError(400, f"{field} must be a date (YYYY-MM-DD): {value!r}")
+    return day
+
+
+def _whole(value, minimum):
+    # bool is an int subclass, but true/false is not a quantity
+    return isinstance(value, int) and not isinstance(value, bool) and value >= minimum
+
+
+def _objects(body, field):
+    values = body.get(field)
+    if not isinstance(values, list) or not values:
+        raise ApiError(400, f"{field} must be a non-empty list")
+    if not all(isinstance(value, dict) for value in values):
+        raise ApiError(400, f"each entry of {field} must be an object")
+    return values
+
+
+def _sku(item):
+    sku = item.get("sku")
+    if not isinstance(sku, str) or sku not in utils.sku_list:
+        raise ApiError(400, f"Unknown SKU: {sku!r}")
+    return sku
+
+
+def _order(registry, order_id, *statuses):
+    if not isinstance(order_id, str):
+        raise ApiError(400, "id is required")
+    order = registry.get(order_id)
+    if order is None:
+        raise ApiError(404, f"{order_id} not found")
+    if statuses and order["status"] not in statuses:
+        raise ApiError(409, f"{order_id} is {order['status']}, expected {' or '.join(statuses)}")
+    return order
+
+
+def _quantities(body):
+    qty = body.get("qty")
+    if not isinstance(qty, dict) or not all(_whole(n, 0) for n in qty.values()):
+        raise ApiError(400, "qty must be an object of {sku: whole number}")
+    return qty
+
+
+def _unfulfilled(to, qty):
+    # A fulfilment may only ship SKUs on the TO, up to what is still unfulfilled
+    left = {}
+    for line in to.progress():
+        left[line["sku"]] = left.get(line["sku"], 0) + line["unfulfilled"]
+    for sku, n in qty.items():
+        if sku not in left:
+            raise ApiError(400, f"{sku} is not on {to['to_id']}")
+        if n > left[sku]:
+            raise ApiError(400, f"qty for {sku} is more than the {left[sku]} still unfulfilled")
+    return qty
+
+
+def _items(body, with_cost):
+    lines = []
+    for item in _objects(body, "items"):
+        sku, qty = _sku(item), item.get("qty")
+        if not _whole(qty, 1):
+            raise ApiError(400, f"qty for {sku} must be a whole number of at least 1")
+        line = {"sku": sku, "qty": qty}
+        if with_cost:
+            unit_cost = item.get("unit_cost", utils.item_master.get(sku, 1.00))
+            if isinstance(unit_cost, bool) or not isinstance(unit_cost, (int, float)) or unit_cost < 0:
+                raise ApiError(400, f"unit_cost for {sku} must be a number of at least 0")
+            line["unit_cost"] = float(unit_cost)
+        lines.append(line)
+    return lines
+
+
+def _outlet(body, field):
+    outlet = body.get(field)
+    if not isinstance(outlet, str) or outlet not in utils.outlet_list:
+        raise ApiError(400, f"Unknown {field}: {outlet!r}")
+    return outlet
+
+
+# Operations, shared by the single endpoints and /batch. Each takes the
+# parsed body (plus the id from the path) and runs in a worker thread,
+# since the flow functions block on locks and the store. Bodies are
+# validated before anything is allocated or changed.
+
+def create_po(body):
+    outlet, items = _outlet(body, "outlet"), _items(body, with_cost=True)
+    created_at = _date(body.get("created_at"), "created_at")
+    return utils.add_po({
+        "po_id": utils.generate_po_id(),
+        "outlet": outlet,
+        "status": "Draft",
+        "items": items,
+        "created_at": created_at,
+    })
+
+
+def submit_po(body, po_id):
+    po = _order(utils.po_list, po_id, "Draft")
+    utils.submit_po(po)
+    return po
+
+
+def approve_po(body, po_id):
+    po = _order(utils.po_list, po_id, "Requesting")
+    utils.approve_po(po)
+    return po
+
+
+def receive_po(body, po_id):
+    po = _order(utils.po_list, po_id, "Receiving")
+    utils.receive_po(po, _date(body.get("date")))
+    return po
+
+
+def receive_pos(body):
+    ids = body.get("ids", [])
+    if not isinstance(ids, list):
+        raise ApiError(400, "ids must be a list")
+    pos = [_order(utils.po_list, po_id, "Receiving") for po_id in ids]
+    if len(set(ids)) < len(ids):
+        raise ApiError(400, "ids must not repeat")
+    utils.receive_pos_bulk(pos, _date(body.get("date")))
+    return pos
+
+
+def create_to(body):
+    source, destination = _outlet(body, "source"), _outlet(body, "destination")
+    if source == destination:
+        raise ApiError(400, "Source and destination must be different")
+    items, created_at = _items(body, with_cost=False), _date(body.get("created_at"), "created_at")
+    return utils.add_to({
+        "to_id": utils.generate_to_id(),
+        "source": source,
+        "destination": destination,
+        "status": "Draft",
+        "items": items,
+        "created_at": created_at,
+    })
+
+
+def submit_to(body, to_id):
+    to = _order(utils.to_list, to_id, "Draft")
+    utils.submit_to(to)
+    return to
+
+
+def approve_to(body, to_id):
+    to = _order(utils.to_list, to_id, "Requesting")
+    utils.approve_to(to)
+    return to
+
+
+def fulfill_to(body, to_id):
+    to = _order(utils.to_list, to_id, "Processing")
+    utils.fulfill_to(to, _unfulfilled(to, _quantities(body)), _date(body.get("date")))
+    return to
+
+
+def receive_to(body, to_id):
+    to = _order(utils.to_list, to_id, "Receiving")
+    utils.receive_to(to, _quantities(body), _date(body.get("date")))
+    return to
+
+
+def receive_tos(body):
+    receipts = [(_order(utils.to_list, receipt.get("id"), "Receiving"), _quantities(receipt))
+                for receipt in _objects(body, "receipts")]
+    if len({to["to_id"] for to, _ in receipts}) < len(receipts):
+        raise ApiError(400, "each TO may only be received once")
+    utils.receive_tos_bulk(receipts, _date(body.get("date")))
+    return [to for to, _ in receipts]
+
+
+def stock_return(body):
+    outlet, warehouse = _outlet(body, "outlet"), _outlet(body, "warehouse")
+    items = _objects(body, "items")
+    for item in items:
+        _sku(item)
+        if not _whole(item.get("qty"), 1) or not isinstance(item.get("reason"), str) or not item["reason"]:
+            raise ApiError(400, "each item needs sku, a qty of at least 1 and a reason")
+    return utils.process_stock_return(outlet, warehouse, items, _date(body.get("date")))
+
+
+# Operations on one order take its id as a second argument
+ORDER_OPERATIONS = {
+    "submit_po": submit_po,
+    "approve_po": approve_po,
+    "receive_po": receive_po,
+    "submit_to": submit_to,
+    "approve_to": approve_to,
+    "fulfill_to": fulfill_to,
+    "receive_to": receive_to,
+}
+OPERATIONS = {
+    "create_po": create_po,
+    "receive_pos": receive_pos,
+    "create_to": create_to,
+    "receive_tos": receive_tos,
+    "return": stock_return,
+    **ORDER_OPERATIONS,
+}
+
+
+def _endpoint(operation, status_code=200):
+    async def endpoint(request):
+        body = await _body(request)
+        args = (body, request.path_params["order_id"]) if "order_id" in request.path_params else (body,)
+        return JSONResponse(await run_in_threadpool(operation, *args), status_code)
+    return endpoint
+
+
+def _run(op):
+    # One /batch entry
+    name = op.get("op") if isinstance(op, dict) else None
+    if name not in OPERATIONS:
+        raise ApiError(400, f"Unknown op: {name!r}")
+    if name in ORDER_OPERATIONS:
+        return ORDER_OPERATIONS[name](op, op.get("id"))
+    return OPERATIONS[name](op)
+
+
+def _run_lines(ops, start):
+    # A slice of /batch in one worker-thread hop; results are encoded here
+    # too, before another request can change the orders. Any failure is
+    # reported on the op's own line so the rest of the batch still runs.
+    lines = []
+    for index, op in enumerate(ops, start):
+        try:
+            result = dumps({"index": index, "ok": True, "result": _run(op)})
+        except ApiError as error:
+            result = dumps({"index": index, "ok": False, "status": error.status_code, "error": error.message})
+        except Exception as error:
+            result = dumps({"index": index, "ok": False, "status": 500, "error": f"{type(error).__name__}: {error}"})
+        lines.append(result)
+    return "\n".join(lines) + "\n"
+
+
+async def batch(request):
+    """Run a list of operations in order, streaming one JSON line per result.
+
+    Body: {"ops": [{"op": "approve_po", "id": "PO3"}, {"op": "receive_to",
+    "id": "TO1", "qty": {...}}, ...]}. A failed operation is reported in its
+    line and does not stop the ones after it.
+    """
+    ops = (await _body(request)).get("ops")
+    if not isinstance(ops, list):
+        raise ApiError(400, "ops must be a list")
+
+    async def results():
+        for start in range(0, len(ops), BATCH_SLICE):
+            yield await run_in_threadpool(_run_lines, ops[start:start + BATCH_SLICE], start)
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+def _listing(registry):
+    async def endpoint(request):
+        statuses = request.query_params.getlist("status")
+        return _stream(registry.with_status(*statuses) if statuses else list(registry))
+    return endpoint
+
+
+async def stock(request):
+    outlet = request.query_params.get("outlet")
+    if outlet is None:
+        rows = ({"outlet": location, "sku": sku, "qty": qty, "unit_cost": unit_cost}
+                for location, sku, qty, unit_cost in utils.inventory.rows())
+    else:
+        rows = ({"outlet": outlet, "sku": sku, **position}
+                for sku, position in sorted(utils.inventory.skus_for(outlet).items()))
+    return _stream(rows)
+
+
+async def flows(request):
+    # In / out / net per (location, sku) between two optional ISO dates;
+    # ?location= reads just that location's flows
+    params = request.query_params
+    totals = utils.cost_history.totals(_day(params.get("start"), "start"), _day(params.get("end"), "end"),
+                                       params.get("location"))
+    return _stream({"location": location, "sku": sku, "in_qty": in_qty, "in_cost": in_cost,
+                    "out_qty": out_qty, "out_cost": out_cost, "net_qty": in_qty - out_qty,
+                    "net_cost": in_cost - out_cost}
+                   for (location, sku), (in_qty, in_cost, out_qty, out_cost) in sorted(totals.items()))
+
+
+async def document(request):
+    doc = utils.document_index.get(request.path_params["doc_id"])
+    if doc is None:
+        raise ApiError(404, f"{request.path_params['doc_id']} not found")
+    return JSONResponse(doc)
+
+
+async def health(request):
+    return JSONResponse({"ok": True, "state_version": utils.state_version()})
+
+
+async def metrics_endpoint(request):
+    # Prometheus text by default, ?format=json for the summaries
+    if request.query_params.get("format") == "json":
+        return JSONResponse(metrics.snapshot())
+    return PlainTextResponse(metrics.to_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+async def api_error(request, error):
+    return JSONResponse({"error": error.message}, error.status_code)
+
+
+app = Starlette(
+    routes=[
+        Route("/health", health),
+        Route("/metrics", metrics_endpoint),
+        Route("/pos", _listing(utils.po_list)),
+        Route("/pos", _endpoint(create_po, 201), methods=["POST"]),
+        Route("/pos/receive", _endpoint(receive_pos), methods=["POST"]),
+        Route("/pos/{order_id}/submit", _endpoint(submit_po), methods=["POST"]),
+        Route("/pos/{order_id}/approve", _endpoint(approve_po), methods=["POST"]),
+        Route("/pos/{order_id}/receive", _endpoint(receive_po), methods=["POST"]),
+        Route("/tos", _listing(utils.to_list)),
+        Route("/tos", _endpoint(create_to, 201), methods=["POST"]),
+        Route("/tos/receive", _endpoint(receive_tos), methods=["POST"]),
+        Route("/tos/{order_id}/submit", _endpoint(submit_to), methods=["POST"]),
+        Route("/tos/{order_id}/approve", _endpoint(approve_to), methods=["POST"]),
+        Route("/tos/{order_id}/fulfill", _endpoint(fulfill_to), methods=["POST"]),
+        Route("/tos/{order_id}/receive", _endpoint(receive_to), methods=["POST"]),
+        Route("/returns", _endpoint(stock_return, 201), methods=["POST"]),
+        Route("/batch", batch, methods=["POST"]),
+        Route("/stock", stock),
+        Route("/flows", flows),
+        Route("/documents/{doc_id}", document),
+    ],
+    exception_handlers={ApiError: api_error},
+)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,14 @@
 import streamlit as st
 import pandas as pd
 import datetime
+import io
+import os
+import time
+from bulk_io import detect_format
+from metrics import metrics, timer
 from utils import *
 
+rerun_started = time.perf_counter()
 st.set_page_config(page_title="PO / TO Automation System", layout="wide")
 st.title("📦 PO / TO Automation System")
 
@@ -10,34 +16,36 @@ st.title("📦 PO / TO Automation System")
 st.sidebar.header("📋 PO / TO Status")
 
 def render_status_sidebar(records, label):
+    # Open orders are listed; completed ones are only counted
     st.sidebar.markdown(f"**{label}**")
-    for doc in records:
+    counts = records.counts()
+    for doc in records.with_status(*[status for status in counts if status != "Completed"]):
         doc_id = doc.get("po_id") or doc.get("to_id")
         status = doc["status"]
         outlet = doc.get("outlet", f"{doc.get('source')} ➜ {doc.get('destination')}")
         st.sidebar.markdown(f"- {doc_id} ({outlet})\n  - *{status}*")
+    if counts.get("Completed"):
+        st.sidebar.markdown(f"- *{counts['Completed']} completed*")
 
 render_status_sidebar(po_list, "📦 POs")
 render_status_sidebar(to_list, "🚚 TOs")
 
 if st.sidebar.button("🗑️ Clear All POs & TOs"):
-    po_list.clear()
-    to_list.clear()
-    cost_history.clear()
-    inventory.clear()
-    for key in documents:
-        documents[key].clear()
+    clear_all()
     st.sidebar.success("All records cleared.")
     st.rerun()
 
-tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9 = st.tabs([
+# The diagnostics tab only shows while timings are collected (METRICS=1)
+# or when the page is opened with ?diagnostics in the URL
+show_diagnostics = metrics.enabled or "diagnostics" in st.query_params
+tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9, *diagnostics_tab = st.tabs([
     "📘 FeedMe", "📙 NetSuite", "📗 POS",
     "📊 Dashboard", "📅 Cost Summary",
     "🧾 Item Master", "📦 Stock Balance", "📒 Audit Log", "📁 Documents"
-])
+] + (["🩺 Diagnostics"] if show_diagnostics else []))
 
 # ---------------------------- TAB 1: FeedMe ----------------------------
-with tab1:
+with tab1, timer("render.FeedMe"):
     st.header("📘 FeedMe: PO / TO Actions")
 
     with st.expander("Create PO"):
@@ -79,7 +87,7 @@ with tab1:
                 "items": [item.copy() for item in st.session_state.po_items],
                 "created_at": created_at
             }
-            po_list.append(po)
+            add_po(po)
             st.session_state.po_items = [{"sku": sku_list[0], "qty": 1, "unit_cost": item_master.get(sku_list[0], 1.00)}]
             st.success(f"PO {po_id} created.")
             st.rerun()
@@ -126,185 +134,182 @@ with tab1:
                 "items": [item.copy() for item in st.session_state.to_items],
                 "created_at": created_at
             }
-            to_list.append(to)
+            add_to(to)
             st.session_state.to_items = [{"sku": sku_list[0], "qty": 1}]
             st.success(f"TO {to_id} created.")
             st.rerun()
 
     st.subheader("POs in Draft")
-    for po in po_list:
-        if po["status"] == "Draft":
-            st.write(f"{po['po_id']} ({po['outlet']})")
-            if st.button(f"Submit PO {po['po_id']}", key=f"submit_po_{po['po_id']}"):
-                submit_po(po)
-                st.rerun()
+    for po in po_list.with_status("Draft"):
+        st.write(f"{po['po_id']} ({po['outlet']})")
+        if st.button(f"Submit PO {po['po_id']}", key=f"submit_po_{po['po_id']}"):
+            submit_po(po)
+            st.rerun()
 
     st.subheader("TOs in Draft")
-    for to in to_list:
-        if to["status"] == "Draft":
-            st.write(f"{to['to_id']} ({to['source']} ➜ {to['destination']})")
-            if st.button(f"Submit TO {to['to_id']}", key=f"submit_to_{to['to_id']}"):
-                submit_to(to)
-                st.rerun()
+    for to in to_list.with_status("Draft"):
+        st.write(f"{to['to_id']} ({to['source']} ➜ {to['destination']})")
+        if st.button(f"Submit TO {to['to_id']}", key=f"submit_to_{to['to_id']}"):
+            submit_to(to)
+            st.rerun()
 
 # ---------------------------- TAB 2: NetSuite ----------------------------
-with tab2:
+with tab2, timer("render.NetSuite"):
     st.header("📙 NetSuite: Approval & Fulfillment")
 
     st.subheader("POs for Approval")
-    for po in po_list:
-        if po["status"] == "Requesting":
-            approve_date = st.date_input(f"Approve Date for {po['po_id']} (Optional)", value=None, key=f"apv_po_{po['po_id']}")
-            st.write(f"{po['po_id']} - {po['outlet']}")
-            if st.button(f"Approve PO {po['po_id']}", key=f"approve_po_{po['po_id']}"):
-                po["created_at"] = datetime.datetime.combine(approve_date, datetime.datetime.min.time()) if approve_date else datetime.datetime.now()
-                approve_po(po)
-                st.rerun()
+    for po in po_list.with_status("Requesting"):
+        approve_date = st.date_input(f"Approve Date for {po['po_id']} (Optional)", value=None, key=f"apv_po_{po['po_id']}")
+        st.write(f"{po['po_id']} - {po['outlet']}")
+        if st.button(f"Approve PO {po['po_id']}", key=f"approve_po_{po['po_id']}"):
+            po["created_at"] = datetime.datetime.combine(approve_date, datetime.datetime.min.time()) if approve_date else datetime.datetime.now()
+            approve_po(po)
+            st.rerun()
 
     st.subheader("TOs for Approval")
-    for to in to_list:
-        if to["status"] == "Requesting":
-            approve_date = st.date_input(f"Approve Date for {to['to_id']} (Optional)", value=None, key=f"apv_to_{to['to_id']}")
-            st.write(f"{to['to_id']} - {to['source']} ➜ {to['destination']}")
-            if st.button(f"Approve TO {to['to_id']}", key=f"approve_to_{to['to_id']}"):
-                to["created_at"] = datetime.datetime.combine(approve_date, datetime.datetime.min.time()) if approve_date else datetime.datetime.now()
-                approve_to(to)
-                st.rerun()
-
-    for idx, to in enumerate(to_list):
-        if to["status"] == "Processing":
-            st.write(f"**{to['to_id']} - {to['source']} ➜ {to['destination']}**")
-
-            # Get fulfill_qty_dict from session state or create new
-            if f"fulfill_qty_dict_{to['to_id']}" not in st.session_state:
-                st.session_state[f"fulfill_qty_dict_{to['to_id']}"] = {item['sku']: 0 for item in to['items']}
-
-            fulfill_qty_dict = st.session_state[f"fulfill_qty_dict_{to['to_id']}"]
-
-            requested = {item["sku"]: item["qty"] for item in to["items"]}
-            fulfilled = to.get("fulfilled_qty_dict", {item["sku"]: 0 for item in to["items"]})
-            received = to.get("received_qty_dict", {item["sku"]: 0 for item in to["items"]})
-
-            # Display item-wise status
-            for item in to["items"]:
-                sku = item["sku"]
-                req = requested[sku]
-                ful = fulfilled.get(sku, 0)
-                rec = received.get(sku, 0)
-                remaining = req - rec
-                st.markdown(
-                    f"<span style='font-size: 14px;'>"
-                    f"🔢 <strong>{sku}</strong>: "
-                    f"📦 <strong>Requested:</strong> {req} | "
-                    f"✅ <strong>Fulfilled:</strong> {ful} | "
-                    f"📥 <strong>Received:</strong> {rec} | "
-                    f"🔄 <strong>Remaining:</strong> {remaining}"
-                    f"</span>",
-                    unsafe_allow_html=True
-                )
+    for to in to_list.with_status("Requesting"):
+        approve_date = st.date_input(f"Approve Date for {to['to_id']} (Optional)", value=None, key=f"apv_to_{to['to_id']}")
+        st.write(f"{to['to_id']} - {to['source']} ➜ {to['destination']}")
+        if st.button(f"Approve TO {to['to_id']}", key=f"approve_to_{to['to_id']}"):
+            to["created_at"] = datetime.datetime.combine(approve_date, datetime.datetime.min.time()) if approve_date else datetime.datetime.now()
+            approve_to(to)
+            st.rerun()
 
-                # Fulfill input for this SKU
-                max_to_fulfill = req - ful
-                fulfill_qty_dict[sku] = st.number_input(
-                    f"Enter Fulfill Qty for {sku} in {to['to_id']}",
-                    min_value=0,
-                    max_value=max_to_fulfill,
-                    value=0,
-                    key=f"fulfill_qty_{to['to_id']}_{sku}"
-                )
+    for idx, to in enumerate(to_list.with_status("Processing")):
+        st.write(f"**{to['to_id']} - {to['source']} ➜ {to['destination']}**")
+
+        # Get fulfill_qty_dict from session state or create new
+        if f"fulfill_qty_dict_{to['to_id']}" not in st.session_state:
+            st.session_state[f"fulfill_qty_dict_{to['to_id']}"] = {item['sku']: 0 for item in to['items']}
+
+        fulfill_qty_dict = st.session_state[f"fulfill_qty_dict_{to['to_id']}"]
+
+        # Display item-wise status
+        for line in to.progress():
+            sku = line["sku"]
+            req = line["requested"]
+            ful = line["fulfilled"]
+            rec = line["received"]
+            remaining = req - rec
+            st.markdown(
+                f"<span style='font-size: 14px;'>"
+                f"🔢 <strong>{sku}</strong>: "
+                f"📦 <strong>Requested:</strong> {req} | "
+                f"✅ <strong>Fulfilled:</strong> {ful} | "
+                f"📥 <strong>Received:</strong> {rec} | "
+                f"🔄 <strong>Remaining:</strong> {remaining}"
+                f"</span>",
+                unsafe_allow_html=True
+            )
 
-            fulfill_date = st.date_input(
-                f"Fulfill Date for {to['to_id']} (Optional)",
-                value=None,
-                key=f"fulfill_date_{to['to_id']}_{idx}"
+            # Fulfill input for this SKU
+            fulfill_qty_dict[sku] = st.number_input(
+                f"Enter Fulfill Qty for {sku} in {to['to_id']}",
+                min_value=0,
+                max_value=line["unfulfilled"],
+                value=0,
+                key=f"fulfill_qty_{to['to_id']}_{sku}"
             )
 
-            if st.button(f"Fulfill TO {to['to_id']}", key=f"fulfill_btn_{to['to_id']}"):
-                fulfill_to(to, fulfill_qty_dict.copy(), fulfill_date)
-                st.rerun()
+        fulfill_date = st.date_input(
+            f"Fulfill Date for {to['to_id']} (Optional)",
+            value=None,
+            key=f"fulfill_date_{to['to_id']}_{idx}"
+        )
+
+        if st.button(f"Fulfill TO {to['to_id']}", key=f"fulfill_btn_{to['to_id']}"):
+            fulfill_to(to, fulfill_qty_dict.copy(), fulfill_date)
+            st.rerun()
 
 
 
 
 # ---------------------------- TAB 3: POS ----------------------------
-with tab3:
+with tab3, timer("render.POS"):
     st.header("📗 POS System: Receiving")
 
+    selected_pos = []
+    selected_tos = []
+
     st.subheader("POs in Receiving")
-    for po in po_list:
-        if po["status"] == "Receiving":
-            st.write(f"{po['po_id']} - {po['outlet']}")
-            recv_date = st.date_input(f"Receive Date for {po['po_id']}", value=None, key=f"recv_po_date_{po['po_id']}")
-            if st.button(f"Receive PO {po['po_id']}", key=f"recv_po_{po['po_id']}"):
-                receive_po(po, recv_date)
-                st.rerun()
+    for po in po_list.with_status("Receiving"):
+        st.write(f"{po['po_id']} - {po['outlet']}")
+        if st.checkbox(f"Select {po['po_id']} for bulk receive", key=f"bulk_po_{po['po_id']}"):
+            selected_pos.append(po)
+        recv_date = st.date_input(f"Receive Date for {po['po_id']}", value=None, key=f"recv_po_date_{po['po_id']}")
+        if st.button(f"Receive PO {po['po_id']}", key=f"recv_po_{po['po_id']}"):
+            receive_po(po, recv_date)
+            st.rerun()
 
     st.subheader("TOs in Receiving")
-    for to in to_list:
-        if to["status"] == "Receiving":
-            st.write(f"{to['to_id']} - {to['destination']}")
-            fulfill_dict = to.get("fulfilled_qty_dict", {item["sku"]: 0 for item in to["items"]})
-            received_dict = to.get("received_qty_dict", {item["sku"]: 0 for item in to["items"]})
-
-            # Check if there is anything left to receive for any SKU
-            any_to_receive = False
-            receive_qty_dict = {}
-            for item in to["items"]:
-                sku = item["sku"]
-                fulfilled = fulfill_dict.get(sku, 0)
-                received = received_dict.get(sku, 0)
-                remaining = fulfilled - received
-
-                if remaining > 0:
-                    any_to_receive = True
-
-            if not any_to_receive:
-                st.success("✅ Awaiting Further Fulfillment")
-                continue
-
-            # Receive inputs per SKU
-            for item in to["items"]:
-                sku = item["sku"]
-                fulfilled = fulfill_dict.get(sku, 0)
-                received = received_dict.get(sku, 0)
-                remaining = fulfilled - received
+    for to in to_list.with_status("Receiving"):
+        st.write(f"{to['to_id']} - {to['destination']}")
+        # Nothing left to receive until the next fulfillment
+        if to.in_transit_qty <= 0:
+            st.success("✅ Awaiting Further Fulfillment")
+            continue
+
+        receive_qty_dict = {}
+        lines = to.progress()
+        if st.checkbox(f"Select {to['to_id']} for bulk receive (all outstanding)", key=f"bulk_to_{to['to_id']}"):
+            selected_tos.append((to, {line["sku"]: line["in_transit"] for line in lines if line["in_transit"] > 0}))
+
+        # Receive inputs per SKU
+        for line in lines:
+            sku = line["sku"]
+            fulfilled = line["fulfilled"]
+            received = line["received"]
+            remaining = line["in_transit"]
+
+            st.markdown(
+                f"<span style='font-size: 14px;'>"
+                f"🔢 <strong>{sku}</strong>: "
+                f"✅ <strong>Fulfilled:</strong> {fulfilled} | "
+                f"📥 <strong>Received:</strong> {received} | "
+                f"🔄 <strong>To Receive:</strong> {remaining}"
+                f"</span>",
+                unsafe_allow_html=True
+            )
 
-                st.markdown(
-                    f"<span style='font-size: 14px;'>"
-                    f"🔢 <strong>{sku}</strong>: "
-                    f"✅ <strong>Fulfilled:</strong> {fulfilled} | "
-                    f"📥 <strong>Received:</strong> {received} | "
-                    f"🔄 <strong>To Receive:</strong> {remaining}"
-                    f"</span>",
-                    unsafe_allow_html=True
+            # Only allow positive to receive
+            if remaining > 0:
+                receive_qty_dict[sku] = st.number_input(
+                    f"Qty to receive for {sku} in {to['to_id']}",
+                    min_value=0,
+                    max_value=remaining,
+                    value=0,
+                    key=f"receive_qty_{to['to_id']}_{sku}"
                 )
 
-                # Only allow positive to receive
-                if remaining > 0:
-                    receive_qty_dict[sku] = st.number_input(
-                        f"Qty to receive for {sku} in {to['to_id']}",
-                        min_value=0,
-                        max_value=remaining,
-                        value=0,
-                        key=f"receive_qty_{to['to_id']}_{sku}"
-                    )
-
-            recv_date = st.date_input(
-                f"Receive Date for {to['to_id']}",
-                value=None,
-                key=f"recv_to_date_{to['to_id']}"
-            )
-
-            if st.button(f"Receive TO {to['to_id']}", key=f"recv_to_{to['to_id']}"):
-                # Only pass SKUs with qty > 0
-                filtered_receive = {sku: qty for sku, qty in receive_qty_dict.items() if qty > 0}
-                if filtered_receive:
-                    receive_to(to, filtered_receive, recv_date)
-                    # Status update happens inside receive_to
-                    st.rerun()
-                else:
-                    st.warning("Enter at least one quantity to receive.")
+        recv_date = st.date_input(
+            f"Receive Date for {to['to_id']}",
+            value=None,
+            key=f"recv_to_date_{to['to_id']}"
+        )
+
+        if st.button(f"Receive TO {to['to_id']}", key=f"recv_to_{to['to_id']}"):
+            # Only pass SKUs with qty > 0
+            filtered_receive = {sku: qty for sku, qty in receive_qty_dict.items() if qty > 0}
+            if filtered_receive:
+                receive_to(to, filtered_receive, recv_date)
+                # Status update happens inside receive_to
+                st.rerun()
+            else:
+                st.warning("Enter at least one quantity to receive.")
                     
+    st.subheader("📥 Bulk Receive")
+    bulk_date = st.date_input("Receive Date for selected", value=None, key="bulk_recv_date")
+    if st.button(
+        f"Receive all selected ({len(selected_pos)} POs, {len(selected_tos)} TOs)",
+        key="bulk_recv_btn",
+        disabled=not (selected_pos or selected_tos)
+    ):
+        if selected_pos:
+            receive_pos_bulk(selected_pos, bulk_date)
+        if selected_tos:
+            receive_tos_bulk(selected_tos, bulk_date)
+        st.rerun()
+
     st.subheader("🔄 Outlet Stock Return to Warehouse")
 
     # Only non-warehouse outlets
@@ -314,7 +319,7 @@ with tab3:
     warehouse = WAREHOUSE_NAME  # define somewhere, match your system's warehouse name
 
     # Collect all SKUs for this outlet
-    outlet_skus = [sku for (out, sku) in inventory if out == return_outlet]
+    outlet_skus = outlet_stock_view(return_outlet)["SKU"].tolist()
     if not outlet_skus:
         st.info("No SKUs in this outlet.")
     else:
@@ -348,9 +353,21 @@ with tab3:
 
 
 # ---------------------------- TAB 4: Dashboard ----------------------------
-with tab4:
+with tab4, timer("render.Dashboard"):
     st.header("📊 PO / TO Dashboard")
 
+    network = inventory.network_totals()
+    in_transit = in_transit_by_sku()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Units on hand (all outlets)", f"{network['qty']:,}")
+    col2.metric("Stock value (all outlets)", f"RM {network['value']:,.2f}")
+    col3.metric("Units in transit", f"{in_transit['Quantity'].sum():,}")
+    with st.expander("Stock by SKU (all outlets)"):
+        st.dataframe(stock_by_sku(), hide_index=True)
+    with st.expander("In transit"):
+        st.dataframe(in_transit, hide_index=True)
+        st.dataframe(in_transit_orders(), hide_index=True)
+
     def show_status(records, label):
         with st.expander(f"{label}"):
             if not records:
@@ -378,68 +395,107 @@ with tab4:
 
                 # Show progress for TOs
                 if "to_id" in doc:
-                    fulfilled = doc.get("fulfilled_qty", 0)
-                    received = doc.get("received_qty", 0)
-                    total = doc["items"][0]["qty"]
+                    fulfilled = doc.fulfilled_qty
+                    received = doc.received_qty
+                    total = doc.requested_qty
                     st.markdown(f"- ✅ Fulfilled: {fulfilled} / {total} | 📦 Received: {received} / {total}")
 
                 st.markdown(f"- 🕒 {doc['created_at'].strftime('%b %d %H:%M')}")
 
-    show_status([p for p in po_list], "📦 All POs")
-    show_status([t for t in to_list], "🚚 All TOs")
+    all_statuses = ["Draft", "Requesting", "Processing", "Receiving", "Completed",
+                    "Error - Insufficient stock at source"]
+    shown_statuses = st.multiselect(
+        "Show orders in status",
+        all_statuses,
+        default=[status for status in all_statuses if status != "Completed"],
+        key="dashboard_statuses"
+    )
+    po_counts, to_counts = po_list.counts(), to_list.counts()
+    st.caption(
+        "POs: " + ", ".join(f"{status} {n}" for status, n in po_counts.items()) +
+        " | TOs: " + ", ".join(f"{status} {n}" for status, n in to_counts.items())
+    )
+    show_status(po_list.with_status(*shown_statuses), "📦 POs")
+    show_status(to_list.with_status(*shown_statuses), "🚚 TOs")
 
 
 # ---------------------------- TAB 5: Cost Summary ----------------------------
-with tab5:
+with tab5, timer("render.Cost Summary"):
     st.header("📅 PO / TO Cost Summary")
-    df = pd.DataFrame(cost_history)
 
-    if df.empty:
+    if not cost_history:
         st.info("No cost data yet.")
     else:
-        df["timestamp"] = pd.to_datetime(df["timestamp"])
-        min_date = df["timestamp"].min().date()
-        max_date = df["timestamp"].max().date()
+        min_date = cost_history.min_timestamp.date()
+        max_date = cost_history.max_timestamp.date()
 
         col1, col2 = st.columns(2)
         start_date = col1.date_input("Start Date", min_date)
         end_date = col2.date_input("End Date", max_date)
 
-        outlet_filter = st.multiselect("Outlet Filter", df.get("outlet", df.get("from")).unique())
-        sku_filter = st.multiselect("SKU Filter", df["sku"].unique())
+        cost_locations, cost_skus = cost_filter_options()
+        location_filter = st.multiselect("Location Filter", cost_locations)
+        sku_filter = st.multiselect("SKU Filter", cost_skus)
 
-        mask = (df["timestamp"].dt.date >= start_date) & (df["timestamp"].dt.date <= end_date)
-        if outlet_filter:
-            mask &= df["outlet"].isin(outlet_filter)
-        if sku_filter:
-            mask &= df["sku"].isin(sku_filter)
+        # Only partitions overlapping the range are read, and only the two at
+        # its edges are scanned row by row; the result is reused until the
+        # next mutation
+        grouped = cost_totals(start_date, end_date)
 
-        filtered = df[mask]
+        if location_filter:
+            grouped = grouped[grouped["location"].isin(location_filter)]
+        if sku_filter:
+            grouped = grouped[grouped["sku"].isin(sku_filter)]
 
-        if filtered.empty:
+        if grouped.empty:
             st.warning("No matching records.")
         else:
-            grouped = filtered.groupby(["outlet", "sku"]).agg({
-                "qty": "sum",
-                "total_cost": "sum"
-            }).reset_index()
-            grouped["avg_unit_cost"] = (grouped["total_cost"] / grouped["qty"]).round(2)
-
+            # In: GRN / TN receipts and returns received; out: DO and returns sent.
+            # "In transit" holds what TOs have shipped but not yet received.
             st.dataframe(grouped.rename(columns={
-                "outlet": "Outlet",
+                "location": "Location",
                 "sku": "SKU",
-                "qty": "Total Qty",
-                "total_cost": "Total Cost",
-                "avg_unit_cost": "Avg Unit Cost"
-            }))
+                "in_qty": "In Qty",
+                "in_cost": "In Cost",
+                "out_qty": "Out Qty",
+                "out_cost": "Out Cost",
+                "net_qty": "Net Qty",
+                "net_cost": "Net Cost",
+                "avg_in_cost": "Avg In Unit Cost"
+            }), hide_index=True)
 
 # ---------------------------- TAB 6: Item Master ----------------------------
-with tab6:
+with tab6, timer("render.Item Master"):
     st.header("🧾 Item Master - SKU Unit Costs")
 
     st.subheader("📌 Existing Items")
-    for sku in sku_list:
-        item_master[sku] = st.number_input(f"{sku} Unit Cost", value=item_master.get(sku, 1.00), key=f"cost_{sku}")
+    col1, col2 = st.columns([3, 1])
+    item_query = col1.text_input("Search SKU (prefix, or any 3+ characters)", key="item_query").strip()
+    item_page_size = col2.selectbox("Per page", [20, 50, 100, 200], index=1, key="item_page_size")
+    item_total, _ = sku_search.search(item_query, limit=0)
+
+    if not item_total:
+        st.info("No SKUs match.")
+    else:
+        # Only one page is rendered, however large the catalog
+        item_page_count = (item_total - 1) // item_page_size + 1
+        item_page = st.number_input(f"Page (of {item_page_count})", min_value=1, max_value=item_page_count,
+                                    value=1, step=1, key=f"item_page_{item_query}_{item_page_size}")
+        _, page_skus = sku_search.search(item_query, (item_page - 1) * item_page_size, item_page_size)
+        st.caption(f"{item_total} SKUs")
+        page_costs = pd.DataFrame({"SKU": page_skus, "Unit Cost": [item_master.get(sku, 1.00) for sku in page_skus]})
+        edited_costs = st.data_editor(
+            page_costs,
+            column_config={"Unit Cost": st.column_config.NumberColumn(min_value=0.0, step=0.01, format="%.2f")},
+            disabled=["SKU"],
+            hide_index=True,
+            use_container_width=True,
+            key=f"item_editor_{item_query}_{item_page_size}_{item_page}",
+        )
+        changed_costs = edited_costs["Unit Cost"].ne(page_costs["Unit Cost"]) & edited_costs["Unit Cost"].notna()
+        if changed_costs.any():
+            saved = set_item_costs(zip(edited_costs["SKU"][changed_costs], edited_costs["Unit Cost"][changed_costs].astype(float)))
+            st.success(f"Saved {saved} unit cost(s).")
 
     st.markdown("---")
     st.subheader("➕ Add New SKU")
@@ -458,8 +514,43 @@ with tab6:
             add_sku(new_sku.strip(), new_cost)
             st.success(f"SKU {new_sku} added with cost RM {new_cost:.2f}.")
 
+    st.markdown("---")
+    st.subheader("📥 Bulk Import / 📤 Export")
+    bulk_kinds = {
+        "Item master (sku, cost)": (import_item_master, export_item_master, "item_master"),
+        "Opening stock (outlet, sku, qty, unit_cost)": (import_opening_stock, export_stock, "stock"),
+        "Outlets (outlet)": (import_outlets, export_outlets, "outlets"),
+    }
+    bulk_kind = st.selectbox("Data", list(bulk_kinds), key="bulk_io_kind")
+    importer, exporter, file_stem = bulk_kinds[bulk_kind]
+
+    def show_import_report(report):
+        st.success(
+            f"{report['rows']} rows: {report['added']} added, {report['updated']} updated, "
+            f"{report['unchanged']} unchanged, {report['duplicates']} duplicates, {report['invalid']} invalid."
+        )
+        if report["errors"]:
+            st.dataframe(pd.DataFrame(report["errors"], columns=["Line", "Problem"]), hide_index=True)
+
+    upload = st.file_uploader("CSV, JSON Lines or JSON file", type=["csv", "jsonl", "ndjson", "json"], key="bulk_io_upload")
+    if st.button("Import file", key="bulk_io_import", disabled=upload is None):
+        show_import_report(importer(io.TextIOWrapper(upload, encoding="utf-8", newline=""), detect_format(upload.name)))
+
+    bundled = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", f"{file_stem}.json")
+    if os.path.exists(bundled) and st.button(f"Load data/{file_stem}.json", key="bulk_io_bundled"):
+        show_import_report(importer(bundled))
+
+    export_fmt = st.radio("Export format", ["csv", "jsonl"], horizontal=True, key="bulk_io_export_fmt")
+    if st.button("Prepare export", key="bulk_io_export"):
+        buffer = io.StringIO()
+        exporter(buffer, export_fmt)
+        st.session_state["bulk_io_export_data"] = (f"{file_stem}.{export_fmt}", buffer.getvalue())
+    if "bulk_io_export_data" in st.session_state:
+        export_name, export_data = st.session_state["bulk_io_export_data"]
+        st.download_button(f"⬇️ Download {export_name}", export_data, file_name=export_name, key="bulk_io_download")
+
 # ---------------------------- TAB 7: Stock Balance ----------------------------
-with tab7:
+with tab7, timer("render.Stock Balance"):
     st.subheader("🗳️ Outlet Stock Balance (Manual Adjust)")
 
     selected_outlet = st.selectbox(
@@ -468,185 +559,240 @@ with tab7:
         key="manual_adjust_outlet"
     )
 
-    # Collect all SKUs (union of all inventory for this outlet)
-    existing = [
-        (sku, values)
-        for (outlet, sku), values in inventory.items()
-        if outlet == selected_outlet
-    ]
-
-    sku_set = set([sku for sku, _ in existing] + sku_list)  # include all possible SKUs
+    # One cached view of the outlet's positions feeds both the grid and the summary
+    stock_view = outlet_stock_view(selected_outlet)
+
+    st.write("Edit stock balances and unit cost, or add a row for another SKU, then save to update "
+             "(set Quantity to 0 to clear a position):")
+    adjust_version = st.session_state.get("adjust_grid_version", 0)
+    edited_stock = st.data_editor(
+        stock_view,
+        column_config={
+            "SKU": st.column_config.TextColumn(required=True),
+            "Quantity": st.column_config.NumberColumn(min_value=0, step=1, required=True),
+            "Unit Cost": st.column_config.NumberColumn(min_value=0.0, step=0.01, format="%.2f"),
+        },
+        # Rows can be added but not deleted: a deleted row would not say
+        # what should happen to its stock
+        num_rows="add",
+        hide_index=True,
+        use_container_width=True,
+        key=f"adjust_grid_{selected_outlet}_{adjust_version}",
+    )
 
-    if not sku_set:
-        st.info("No SKUs configured for this outlet yet.")
+    # Diff against the current positions: edited rows keep their index and
+    # added rows get new ones, so only new or edited rows are looked at
+    before = stock_view.reindex(edited_stock.index)
+    edited_mask = edited_stock.ne(before).any(axis=1)
+    adjust_rows, unknown_skus = {}, []
+    for sku, qty, cost in edited_stock.loc[edited_mask, ["SKU", "Quantity", "Unit Cost"]].itertuples(index=False):
+        sku = sku.strip() if isinstance(sku, str) else ""
+        if not sku or pd.isna(qty):
+            continue
+        if sku not in sku_list:
+            unknown_skus.append(sku)
+            continue
+        if pd.isna(cost):
+            cost = item_master.get(sku, get_unit_cost((selected_outlet, sku)))
+        position = inventory.get((selected_outlet, sku))
+        if position is None or position["qty"] != int(qty) or position["unit_cost"] != float(cost):
+            adjust_rows[sku] = (sku, int(qty), float(cost))
+    if unknown_skus:
+        st.warning(f"Unknown SKU(s), add them in the Item Master first: {', '.join(sorted(set(unknown_skus)))}")
+    st.caption(f"{len(adjust_rows)} row(s) changed")
+
+    if st.button("💾 Save Adjustments", key="save_adjustment_btn", disabled=not adjust_rows):
+        changed = adjust_stock_batch(selected_outlet, adjust_rows.values())
+        st.session_state["adjust_grid_version"] = adjust_version + 1
+        st.success(f"{len(changed)} stock balance(s) for {selected_outlet} updated!")
+        st.rerun()
+
+    # Summary table of current stock for the selected outlet
+    if stock_view.empty:
+        st.info("No SKUs available for this outlet yet.")
     else:
-        st.write("Edit stock balances and unit cost, then save to update:")
-
-        adjust_data = []
-        for sku in sorted(sku_set):
-            key = (selected_outlet, sku)
-            qty = inventory.get(key, {}).get("qty", 0)
-            cost = inventory.get(key, {}).get("unit_cost", 1.00)
-            col1, col2, col3 = st.columns([1, 2, 2])
-            with col1:
-                st.markdown(f"**{sku}**")
-            with col2:
-                new_qty = st.number_input(
-                    f"Qty_{selected_outlet}_{sku}",
-                    min_value=0,
-                    value=qty,
-                    step=1,
-                    key=f"adjust_qty_{selected_outlet}_{sku}"
-                )
-            with col3:
-                new_cost = st.number_input(
-                    f"UnitCost_{selected_outlet}_{sku}",
-                    min_value=0.00,
-                    value=cost,
-                    step=0.01,
-                    format="%.2f",
-                    key=f"adjust_cost_{selected_outlet}_{sku}"
-                )
-            adjust_data.append((sku, new_qty, new_cost))
-
-        if st.button("💾 Save Adjustments", key="save_adjustment_btn"):
-            for sku, new_qty, new_cost in adjust_data:
-                key = (selected_outlet, sku)
-                inventory[key] = {"qty": new_qty, "unit_cost": new_cost}
-            st.success(f"Stock balances for {selected_outlet} updated!")
-            st.rerun()
-            
-        # Summary table of current stock for the selected outlet
-        display_data = []
-        for sku in sorted(sku_set):
-            key = (selected_outlet, sku)
-            qty = inventory.get(key, {}).get("qty", 0)
-            cost = inventory.get(key, {}).get("unit_cost", 1.00)
-            display_data.append({
-                "SKU": sku,
-                "Quantity": qty,
-                "Unit Cost": f"RM {cost:.2f}",
-                "Total Cost": f"RM {qty * cost:.2f}"
-            })
-
-        # Summary table of current stock for the selected outlet
-        display_data = []
-        for sku in sorted(sku_set):
-            key = (selected_outlet, sku)
-            qty = inventory.get(key, {}).get("qty", 0)
-            cost = inventory.get(key, {}).get("unit_cost", 1.00)
-            display_data.append({
-                "SKU": sku,
-                "Quantity": qty,
-                "Unit Cost": f"RM {cost:.2f}",
-                "Total Cost": f"RM {qty * cost:.2f}"
-            })
-
-        if display_data:
-            st.markdown("**Items:**")
-            st.table(display_data)
+        totals = inventory.outlet_totals(selected_outlet)
+        st.markdown(f"**Items:** {totals['qty']} units, RM {totals['value']:.2f} on hand")
+        st.dataframe(pd.DataFrame({
+            "SKU": stock_view["SKU"],
+            "Quantity": stock_view["Quantity"],
+            "Unit Cost": "RM " + stock_view["Unit Cost"].map("{:.2f}".format),
+            "Total Cost": "RM " + (stock_view["Quantity"] * stock_view["Unit Cost"]).map("{:.2f}".format),
+        }), hide_index=True, use_container_width=True)
+
+    # --- Show Returns Inventory Table Only for Warehouse ---
+    if selected_outlet == WAREHOUSE_NAME:
+        st.subheader("Warehouse Returns Inventory")
+        warehouse_returns = []
+        for (wh, sku), val in list(returns_inventory.items()):
+            if wh == WAREHOUSE_NAME:
+                warehouse_returns.append({
+                    "SKU": sku,
+                    "Qty": val["qty"],
+                    "Unit Cost": f"RM {val['unit_cost']:.2f}",
+                    "Total Value": f"RM {val['qty'] * val['unit_cost']:.2f}",
+                    "Reasons": ", ".join(val["reasons"])
+                })
+        if warehouse_returns:
+            st.table(warehouse_returns)
         else:
-            st.info("No SKUs available for this outlet yet.")
-
-        # --- Show Returns Inventory Table Only for Warehouse ---
-        if selected_outlet == WAREHOUSE_NAME:
-            st.subheader("Warehouse Returns Inventory")
-            warehouse_returns = []
-            for (wh, sku), val in returns_inventory.items():
-                if wh == WAREHOUSE_NAME:
-                    warehouse_returns.append({
-                        "SKU": sku,
-                        "Qty": val["qty"],
-                        "Unit Cost": f"RM {val['unit_cost']:.2f}",
-                        "Total Value": f"RM {val['qty'] * val['unit_cost']:.2f}",
-                        "Reasons": ", ".join(val["reasons"])
-                    })
-            if warehouse_returns:
-                st.table(warehouse_returns)
-            else:
-                st.info("No returned stock yet.")
+            st.info("No returned stock yet.")
+
+    # --- Balance as of a past date (backdated movements included) ---
+    st.subheader(f"📆 {selected_outlet} Stock As Of")
+    as_of_date = st.date_input("As of (end of day)", value=datetime.date.today(), key="stock_as_of_date")
+    as_of_data = []
+    for (_, sku), balance in sorted(stock_as_of(as_of_date, selected_outlet).items()):
+        qty, value = balance["qty"], balance["value"]
+        if qty == 0 and abs(value) < 0.005:
+            continue
+        as_of_data.append({
+            "SKU": sku,
+            "Quantity": qty,
+            "Avg Unit Cost": f"RM {value / qty:.2f}" if qty else "-",
+            "Total Cost": f"RM {value:.2f}"
+        })
+    if as_of_data:
+        st.table(as_of_data)
+    else:
+        st.info(f"No stock at {selected_outlet} on {as_of_date}.")
 
 
 
 
-with tab8:
+with tab8, timer("render.Audit Log"):
     st.header("📒 Detailed Cost Audit Log")
 
     if not cost_history:
         st.info("No audit data available.")
     else:
-        df = pd.DataFrame(cost_history)
-        df["timestamp"] = pd.to_datetime(df["timestamp"])
-        df = df.sort_values(by="timestamp", ascending=False)
-
-        # If you want to group by outlet (source), otherwise just show all
-        if "outlet" in df.columns:
-            outlets = df["outlet"].unique()
-            for outlet in outlets:
-                outlet_data = df[df["outlet"] == outlet]
-                with st.expander(f"{outlet}", expanded=False):
-                    # Add missing columns safely
-                    for col in ["from", "to", "reason"]:
-                        if col not in outlet_data.columns:
-                            outlet_data[col] = ""
-                    display_df = outlet_data[["timestamp", "type", "sku", "qty", "unit_cost", "total_cost", "from", "to", "reason"]].copy()
-                    display_df.columns = ["Timestamp", "Type", "SKU", "Quantity", "Unit Cost", "Total Cost", "From", "To", "Reason"]
-                    display_df["Unit Cost"] = display_df["Unit Cost"].apply(lambda x: f"RM {x:.2f}")
-                    display_df["Total Cost"] = display_df["Total Cost"].apply(lambda x: f"RM {x:.2f}")
-                    st.dataframe(display_df, use_container_width=True)
-        else:
-            # fallback if no "outlet" field
-            st.dataframe(df)
+        # Only the page on screen is read from the cost history and formatted
+        col1, col2 = st.columns(2)
+        audit_location = col1.selectbox("Location", ["All"] + cost_filter_options()[0], key="audit_location")
+        audit_page_size = col2.selectbox("Per page", [50, 100, 200, 500], key="audit_page_size")
+        audit_filter = None if audit_location == "All" else audit_location
+        audit_total, _ = audit_page(audit_filter, 1, audit_page_size)
+        audit_page_count = max((audit_total - 1) // audit_page_size + 1, 1)
+        page = st.number_input(f"Page (of {audit_page_count})", min_value=1, max_value=audit_page_count, value=1,
+                               step=1, key=f"audit_page_{audit_location}_{audit_page_size}")
+        audit_total, audit_rows = audit_page(audit_filter, page, audit_page_size)
+        st.caption(f"{audit_total} events")
+        st.dataframe(audit_rows, hide_index=True, use_container_width=True)
+
+        st.markdown("**📤 Export**")
+        col1, col2, col3 = st.columns(3)
+        audit_start = col1.date_input("From", value=None, key="audit_export_start")
+        audit_end = col2.date_input("To", value=None, key="audit_export_end")
+        audit_fmt = col3.radio("Format", ["csv", "jsonl", "parquet"], horizontal=True, key="audit_export_fmt")
+        if st.button("Prepare export", key="audit_export"):
+            buffer = io.BytesIO() if audit_fmt == "parquet" else io.StringIO()
+            export_audit_log(buffer, audit_fmt, audit_start, audit_end)
+            st.session_state["audit_export_data"] = (f"audit_log.{audit_fmt}", buffer.getvalue())
+        if "audit_export_data" in st.session_state:
+            export_name, export_data = st.session_state["audit_export_data"]
+            st.download_button(f"⬇️ Download {export_name}", export_data, file_name=export_name, key="audit_download")
 
 
 
 # ---------------------------- TAB 9: Document Viewer ----------------------------
-with tab9: 
-
-    st.header("📄 DO / GRN / TN Documents")
-
-    for doc_type in ["GRN", "DO", "TN"]:
-        st.subheader(f"{doc_type} Records")
-        for doc in documents[doc_type]:
-            with st.expander(f"{doc['doc_id']} - {doc['ref']}"):
-                st.write(f"Timestamp: {doc['timestamp']}")
-                st.write(f"Ref: {doc['ref']}")
-                st.write(f"Outlet: {doc['outlet']}")
-                st.write("Items:")
-                st.table([{
-                    "SKU": item["sku"],
-                    "Quantity": item["qty"],
-                    "Unit Cost": f"RM {item.get('unit_cost', 0):.2f}",
-                    "Total Cost": f"RM {item.get('qty', 0) * item.get('unit_cost', 0):.2f}"
-                } for item in doc.get("items", [])])
-
-                pdf_base64 = doc_storage.get(doc["doc_id"])
-                if pdf_base64:
-                    st.markdown(
-                        f'<iframe src="data:application/pdf;base64,{pdf_base64}" width="700" height="400" type="application/pdf"></iframe>',
-                        unsafe_allow_html=True
-                    )
-                    
-                    
-    for doc_type in ["GRN", "DO", "TN", "RN"]:
-        st.subheader(f"{doc_type} Records")
-        for doc in documents.get(doc_type, []):
-            with st.expander(f"{doc['doc_id']} - {doc['ref']}"):
-                st.write(f"Timestamp: {doc['timestamp']}")
-                st.write(f"Outlet: {doc.get('outlet', '')}")
-                st.write(f"Warehouse: {doc.get('warehouse', '')}")
-                st.write("Items:")
-                st.table([{
-                    "SKU": item["sku"],
-                    "Quantity": item["qty"],
-                    "Unit Cost": f"RM {item.get('unit_cost', 0):.2f}",
-                    "Reason": item.get("reason", "")
-                } for item in doc.get("items", [])])
-                pdf_base64 = doc_storage.get(doc["doc_id"])
-                if pdf_base64:
-                    st.markdown(
-                        f'<iframe src="data:application/pdf;base64,{pdf_base64}" width="700" height="400" type="application/pdf"></iframe>',
-                        unsafe_allow_html=True
-                    )
-
+with tab9, timer("render.Documents"):
+    st.header("📄 DO / GRN / TN / RN Documents")
+
+    col1, col2, col3 = st.columns(3)
+    doc_type_filter = col1.selectbox("Type", ["All", "GRN", "DO", "TN", "RN"], key="doc_type_filter")
+    doc_outlet_filter = col2.selectbox("Outlet", ["All"] + list(outlet_list), key="doc_outlet_filter")
+    doc_ref_filter = col3.text_input("Reference (exact)", key="doc_ref_filter").strip()
+    col1, col2, col3 = st.columns(3)
+    doc_start = col1.date_input("From", value=None, key="doc_start")
+    doc_end = col2.date_input("To", value=None, key="doc_end")
+    page_size = col3.selectbox("Per page", [10, 20, 50, 100], index=1, key="doc_page_size")
+
+    filters = dict(
+        doc_type=None if doc_type_filter == "All" else doc_type_filter,
+        outlet=None if doc_outlet_filter == "All" else doc_outlet_filter,
+        ref=doc_ref_filter or None,
+        start=doc_start,
+        end=doc_end,
+    )
+    total, _ = document_index.query(limit=0, **filters)
 
+    if not total:
+        st.info("No documents match.")
+    else:
+        page_count = (total - 1) // page_size + 1
+        page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1, step=1, key="doc_page")
+        _, page_docs = document_index.query(offset=(page - 1) * page_size, limit=page_size, **filters)
+        st.caption(f"{total} documents")
+        st.dataframe([{
+            "Document": doc["doc_id"],
+            "Type": doc["type"],
+            "Ref": doc["ref"],
+            "Outlet": doc.get("outlet", ""),
+            "Warehouse": doc.get("warehouse", ""),
+            "Timestamp": str(doc["timestamp"])
+        } for doc in page_docs], use_container_width=True)
+
+        # Only the selected document is expanded and has its PDF rendered
+        selected_doc_id = st.selectbox("Open document", [doc["doc_id"] for doc in page_docs], index=None, key="doc_selected")
+        doc = document_index.get(selected_doc_id)
+        if doc:
+            st.write(f"Timestamp: {doc['timestamp']}")
+            st.write(f"Ref: {doc['ref']}")
+            st.write(f"Outlet: {doc.get('outlet', '')}")
+            if doc.get("warehouse"):
+                st.write(f"Warehouse: {doc['warehouse']}")
+            st.table([{
+                "SKU": item["sku"],
+                "Quantity": item["qty"],
+                "Unit Cost": f"RM {item.get('unit_cost', 0):.2f}",
+                "Total Cost": f"RM {item.get('qty', 0) * item.get('unit_cost', 0):.2f}",
+                "Reason": item.get("reason", "")
+            } for item in doc.get("items", [])])
+
+            pdf = get_document_pdf(doc, timeout=10)
+            if pdf:
+                st.download_button("⬇️ Download PDF", pdf, file_name=f"{doc['doc_id']}.pdf", mime="application/pdf", key="doc_download")
+            elif document_status(doc) == "failed":
+                st.error("PDF generation failed.")
+            else:
+                st.info("⏳ PDF is still being generated, refresh to download it.")
+
+
+# ---------------------------- Diagnostics (hidden) ----------------------------
+metrics.observe("render.rerun", time.perf_counter() - rerun_started)
+
+if diagnostics_tab:
+    with diagnostics_tab[0]:
+        st.header("🩺 Diagnostics")
+        st.caption("Latency of every flow, its stages (locking, costing, cost-history append, "
+                   "id allocation, documents, store writes), PDF rendering and each tab's render "
+                   "time per rerun. Timings are shared by all sessions of this server.")
+
+        collecting = st.toggle("Collect timings", value=metrics.enabled)
+        if collecting != metrics.enabled:
+            metrics.enable(collecting)
+
+        snapshot = metrics.snapshot()
+        if not snapshot:
+            st.info("No timings recorded yet.")
+        for kind, label in [("flow", "Flows"), ("stage", "Stages"), ("pdf", "PDF rendering"), ("render", "Render time per rerun")]:
+            rows = [{
+                "Name": name.split(".", 1)[1],
+                "Calls": summary["count"],
+                "Mean ms": summary["mean"] * 1000,
+                "p50 ms": summary["p50"] * 1000,
+                "p99 ms": summary["p99"] * 1000,
+                "Max ms": summary["max"] * 1000,
+                "Total s": summary["sum"],
+            } for name, summary in snapshot.items() if name.startswith(kind + ".")]
+            if rows:
+                st.subheader(label)
+                st.dataframe(pd.DataFrame(rows).sort_values("Total s", ascending=False).round(3),
+                             hide_index=True, use_container_width=True)
+
+        col1, col2, col3 = st.columns(3)
+        col1.download_button("⬇️ Prometheus text", metrics.to_prometheus(), file_name="metrics.txt", key="metrics_prometheus")
+        col2.download_button("⬇️ JSON", metrics.to_json(), file_name="metrics.json", key="metrics_json")
+        if col3.button("Reset timings", key="metrics_reset"):
+            metrics.reset()
+            st.rerun()
@@ -0,0 +1,173 @@
+"""Requests per second of the HTTP API (api.py), single endpoints vs. /batch.
+
+    python benchmarks/bench_api.py [--orders 2000] [--connections 16] [--batch 50]
+
+Starts the API in a subprocess and drives it over keep-alive connections.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Connection:
+    """Minimal HTTP/1.1 keep-alive client; enough for JSON and chunked JSON Lines."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, port):
+        return cls(*await asyncio.open_connection("127.0.0.1", port))
+
+    async def request(self, method, path, body=None):
+        data = b"" if body is None else json.dumps(body).encode("utf-8")
+        self.writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n\r\n".encode("ascii") + data
+        )
+        status = int((await self.reader.readline()).split()[1])
+        length, chunked = 0, False
+        while (line := await self.reader.readline()) != b"\r\n":
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+            elif name.lower() == "transfer-encoding":
+                chunked = "chunked" in value
+        if not chunked:
+            return status, await self.reader.readexactly(length)
+        parts = []
+        while size := int(await self.reader.readline(), 16):
+            parts.append((await self.reader.readexactly(size + 2))[:-2])
+        await self.reader.readline()
+        return status, b"".join(parts)
+
+    def close(self):
+        self.writer.close()
+
+
+async def run(port, connections, jobs):
+    """Run ``jobs`` (async functions of a Connection) over a pool of connections; returns requests made."""
+    queue = list(reversed(jobs))
+    counts = []
+
+    async def worker():
+        connection = await Connection.open(port)
+        requests = 0
+        while queue:
+            requests += await queue.pop()(connection)
+        connection.close()
+        counts.append(requests)
+
+    await asyncio.gather(*(worker() for _ in range(connections)))
+    return sum(counts)
+
+
+def timed(label, port, connections, jobs, ops=None):
+    start = time.perf_counter()
+    requests = asyncio.run(run(port, connections, jobs))
+    elapsed = time.perf_counter() - start
+    line = f"{label:<30} {requests:>7} requests  {elapsed:7.3f} s  {requests / elapsed:10,.0f} req/s"
+    if ops:
+        line += f"  {ops / elapsed:10,.0f} ops/s"
+    print(line)
+
+
+def expect(status, body, wanted=(200, 201)):
+    if status not in wanted:
+        raise RuntimeError(f"HTTP {status}: {body[:200]!r}")
+    return body
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port):
+    env = dict(os.environ, PDF_WORKERS="0")
+    env.pop("INVENTORY_DB", None)
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "api.py"), "--port", str(port)], env=env, cwd=ROOT)
+    for _ in range(200):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("API did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--batch", type=int, default=50, help="operations per /batch request")
+    args = parser.parse_args()
+
+    port = free_port()
+    server = start_server(port)
+    try:
+        item = {"sku": "MILK2002", "qty": 1, "unit_cost": 2.0}
+
+        async def health(connection):
+            expect(*await connection.request("GET", "/health"))
+            return 1
+
+        timed("GET /health", port, args.connections, [health] * args.orders)
+
+        def lifecycle(outlet):
+            async def job(connection):
+                po = json.loads(expect(*await connection.request("POST", "/pos", {"outlet": outlet, "items": [item]})))
+                for step in ("submit", "approve", "receive"):
+                    expect(*await connection.request("POST", f"/pos/{po['po_id']}/{step}"))
+                return 4
+            return job
+
+        timed("PO lifecycle, one per request", port, args.connections,
+              [lifecycle(f"Outlet{'AB'[n % 2]}") for n in range(args.orders)], ops=4 * args.orders)
+
+        created = []
+
+        async def create(connection):
+            po = json.loads(expect(*await connection.request("POST", "/pos", {"outlet": "OutletA", "items": [item]})))
+            created.append(po["po_id"])
+            return 1
+
+        asyncio.run(run(port, args.connections, [create] * args.orders))
+
+        def batch(po_ids):
+            ops = [{"op": step, "id": po_id} for po_id in po_ids for step in ("submit_po", "approve_po", "receive_po")]
+
+            async def job(connection):
+                results = expect(*await connection.request("POST", "/batch", {"ops": ops})).splitlines()
+                if not all(json.loads(line)["ok"] for line in results):
+                    raise RuntimeError("batch operation failed")
+                return 1
+            return job
+
+        size = max(args.batch // 3, 1)
+        chunks = [created[i:i + size] for i in range(0, len(created), size)]
+        timed(f"PO lifecycle, /batch of {3 * size}", port, args.connections,
+              [batch(chunk) for chunk in chunks], ops=3 * len(created))
+
+        async def stock(connection):
+            expect(*await connection.request("GET", "/stock"))
+            return 1
+
+        timed("GET /stock (JSON Lines)", port, args.connections, [stock] * (args.orders // 10))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Throughput of receive_po/receive_to one by one vs. the bulk receive API.
+
+    python benchmarks/bench_bulk_receive.py [--lines 10000] [--lines-per-order 20]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils  # noqa: E402
+from models import PurchaseOrder, TransferOrder  # noqa: E402
+
+
+def make_pos(lines, lines_per_order, outlets=20, skus=500):
+    pos = []
+    for n in range(lines // lines_per_order):
+        pos.append(PurchaseOrder.from_dict({
+            "po_id": utils.generate_po_id(),
+            "outlet": f"Outlet{n % outlets}",
+            "status": "Receiving",
+            "items": [
+                {"sku": f"SKU{(n * lines_per_order + i) % skus}", "qty": 1 + i % 7, "unit_cost": 1.0 + i % 5}
+                for i in range(lines_per_order)
+            ],
+        }))
+    return pos
+
+
+def make_tos(lines, lines_per_order, outlets=20, skus=500):
+    tos = []
+    for n in range(lines // lines_per_order):
+        items = [{"sku": f"SKU{(n * lines_per_order + i) % skus}", "qty": 1} for i in range(lines_per_order)]
+        to = TransferOrder.from_dict({
+            "to_id": utils.generate_to_id(),
+            "source": f"Outlet{n % outlets}",
+            "destination": f"Outlet{(n + 1) % outlets}",
+            "status": "Receiving",
+            "items": items,
+            "fulfilled_qty_dict": {item["sku"]: 1 for item in items},
+        })
+        tos.append((to, {item["sku"]: 1 for item in items}))
+    return tos
+
+
+def timed(label, lines, func):
+    utils.clear_all()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {lines:>8} lines  {elapsed:8.3f} s  {lines / elapsed:12,.0f} lines/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=10_000)
+    parser.add_argument("--lines-per-order", type=int, default=20)
+    args = parser.parse_args()
+
+    pos = make_pos(args.lines, args.lines_per_order)
+    timed("receive_po (one by one)", args.lines, lambda: [utils.receive_po(po) for po in pos])
+    pos = make_pos(args.lines, args.lines_per_order)
+    timed("receive_pos_bulk", args.lines, lambda: utils.receive_pos_bulk(pos))
+
+    tos = make_tos(args.lines, args.lines_per_order)
+    timed("receive_to (one by one)", args.lines, lambda: [utils.receive_to(to, qty) for to, qty in tos])
+    tos = make_tos(args.lines, args.lines_per_order)
+    timed("receive_tos_bulk", args.lines, lambda: utils.receive_tos_bulk(tos))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Replay of a synthetic cost history: NumPy costing engine vs. a per-event loop.
+
+    python benchmarks/bench_costing.py [--events 1000000] [--positions 20000]
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import costing  # noqa: E402
+from cost_store import IN_TRANSIT, CostHistory  # noqa: E402
+
+
+def make_history(events, positions, seed=0):
+    rng = np.random.default_rng(seed)
+    history = CostHistory()
+    start = datetime.datetime(2024, 1, 1)
+    outlets = [f"Outlet{i}" for i in range(max(positions // 1000, 1))]
+    key_ids = rng.integers(0, positions, events)
+    qtys = rng.integers(1, 20, events)
+    costs = rng.uniform(0.5, 10.0, events).round(2)
+    issues = rng.random(events) < 0.3
+    for n in range(events):
+        outlet = outlets[key_ids[n] % len(outlets)]
+        event = {
+            "timestamp": start + datetime.timedelta(seconds=n),
+            "sku": f"SKU{key_ids[n] // len(outlets)}",
+            "qty": int(qtys[n]),
+            "unit_cost": float(costs[n]),
+            "total_cost": float(qtys[n] * costs[n]),
+        }
+        if issues[n]:
+            event.update({"type": "DO", "source": outlet, "destination": IN_TRANSIT})
+        else:
+            event.update({"type": "GRN", "destination": outlet})
+        history.append(event)
+    return history
+
+
+def replay_loop(history):
+    positions = {}
+    for event in history:
+        if event["type"] == "DO":
+            position = positions.setdefault((event["source"], event["sku"]), [0, 0.0])
+            position[0] = max(position[0] - event["qty"], 0)
+        else:
+            position = positions.setdefault((event["destination"], event["sku"]), [0, 0.0])
+            new_qty = position[0] + event["qty"]
+            position[1] = (position[0] * position[1] + event["qty"] * event["unit_cost"]) / new_qty
+            position[0] = new_qty
+    return positions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--positions", type=int, default=20_000)
+    args = parser.parse_args()
+
+    history = make_history(args.events, args.positions)
+
+    start = time.perf_counter()
+    replayed = costing.replay(history.to_frame())
+    vectorised = time.perf_counter() - start
+
+    start = time.perf_counter()
+    looped = replay_loop(history)
+    loop = time.perf_counter() - start
+
+    sample = replayed.iloc[0]
+    assert abs(looped[(sample["outlet"], sample["sku"])][1] - sample["unit_cost"]) < 1e-6
+    print(f"{args.events:,} events over {len(replayed):,} positions")
+    print(f"costing.replay  {vectorised:8.3f} s  {args.events / vectorised:12,.0f} events/s")
+    print(f"per-event loop  {loop:8.3f} s  {args.events / loop:12,.0f} events/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""End-to-end benchmark of the PO / TO / return flows on synthetic data.
+
+    python benchmarks/bench_flows.py [--outlets 20] [--skus 500] [--orders 500]
+        [--lines 10] [--history 20000] [--pdfs 50] [--seed 0] [--db path]
+        [--out results.json] [--compare baseline.json]
+
+Generates a deterministic data set, drives every order through Draft ->
+Completed with the utils flow functions (no Streamlit), opens the first
+``--pdfs`` documents through ``utils.get_document_pdf`` (cache, then the
+render queue; PDF_WORKERS as for the app, inline by default), and reports
+ops/s, p50 / p99 latency and peak traced memory per flow. ``--out`` saves the
+results as JSON; ``--compare`` prints the change against an earlier file.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("PDF_WORKERS", "0")
+
+import utils  # noqa: E402
+from data_store import SQLiteStore  # noqa: E402
+
+FLOWS = ("create_po", "submit_po", "approve_po", "receive_po",
+         "create_to", "submit_to", "approve_to", "fulfill_to", "receive_to",
+         "process_stock_return", "get_document_pdf")
+
+
+def make_scenario(outlets, warehouses, skus, orders, lines, history, seed=0):
+    """Deterministic master data, orders and history for one run."""
+    rng = random.Random(seed)
+    sku_codes = [f"BSKU{n:06d}" for n in range(skus)]
+    stores = [f"BOutlet{n}" for n in range(outlets)]
+    depots = [f"BWarehouse{n}" for n in range(warehouses)]
+
+    def order_lines(with_cost):
+        picked = rng.sample(sku_codes, min(lines, skus))
+        return [dict(sku=sku, qty=rng.randint(1, 12), **({"unit_cost": round(rng.uniform(0.5, 20), 2)} if with_cost else {}))
+                for sku in picked]
+
+    start = datetime.datetime(2024, 1, 1)
+    return {
+        "costs": [(sku, round(rng.uniform(0.5, 20), 2)) for sku in sku_codes],
+        "outlets": stores,
+        "warehouses": depots,
+        # Past receipts that give the event log and cost history some depth
+        "history": [(rng.choice(stores + depots), rng.choice(sku_codes), rng.randint(1, 50),
+                     round(rng.uniform(0.5, 20), 2), start + datetime.timedelta(minutes=n))
+                    for n in range(history)],
+        "pos": [(rng.choice(stores), order_lines(True)) for _ in range(orders)],
+        "tos": [(rng.choice(depots), rng.choice(stores), order_lines(False)) for _ in range(orders)],
+        "returns": [(rng.choice(stores), rng.choice(depots), order_lines(False)) for _ in range(orders)],
+    }
+
+
+def load_master_data(scenario):
+    utils.clear_all()
+    for sku, _ in scenario["costs"]:
+        utils.sku_list.append(sku)
+    utils.set_item_costs(scenario["costs"])
+    utils.outlet_list.extend(scenario["outlets"] + scenario["warehouses"])
+    # History goes in as received POs of 10 lines, 100 POs per backdated batch
+    history = scenario["history"]
+    for n in range(0, len(history), 1000):
+        batch = history[n:n + 1000]
+        pos = [utils.add_po({
+            "po_id": utils.generate_po_id(),
+            "outlet": batch[i][0],
+            "status": "Receiving",
+            "items": [{"sku": sku, "qty": qty, "unit_cost": cost} for _, sku, qty, cost, _ in batch[i:i + 10]],
+        }) for i in range(0, len(batch), 10)]
+        utils.receive_pos_bulk(pos, batch[0][4])
+    # Enough stock at the warehouses for every TO to be fulfilled in full
+    for warehouse in scenario["warehouses"]:
+        utils.adjust_stock_batch(warehouse, [(sku, 10_000_000, cost) for sku, cost in scenario["costs"]])
+
+
+def run_flow(name, ops, trace):
+    """Run ``ops`` (zero-argument callables) one after another; returns the flow's stats."""
+    latencies = []
+    if trace:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    for op in ops:
+        op_start = time.perf_counter()
+        op()
+        latencies.append(time.perf_counter() - op_start)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    stats = {
+        "ops": len(ops),
+        "seconds": round(elapsed, 6),
+        "ops_per_sec": round(len(ops) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 4) if latencies else None,
+        "p99_ms": round(latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] * 1000, 4) if latencies else None,
+    }
+    if trace:
+        stats["peak_mem_bytes"] = tracemalloc.get_traced_memory()[1] - baseline
+    return stats
+
+
+def run_lifecycle(scenario, pdfs, trace=False):
+    """Every flow in lifecycle order; returns {flow: stats}."""
+    load_master_data(scenario)
+    results = {}
+    pos, tos = [], []
+
+    def create_po(outlet, items):
+        pos.append(utils.add_po({"po_id": utils.generate_po_id(), "outlet": outlet, "status": "Draft", "items": items}))
+
+    def create_to(source, destination, items):
+        tos.append(utils.add_to({"to_id": utils.generate_to_id(), "source": source, "destination": destination,
+                                 "status": "Draft", "items": items}))
+
+    def flow(name, ops):
+        results[name] = run_flow(name, ops, trace)
+
+    flow("create_po", [lambda o=o, i=i: create_po(o, i) for o, i in scenario["pos"]])
+    flow("submit_po", [lambda po=po: utils.submit_po(po) for po in pos])
+    flow("approve_po", [lambda po=po: utils.approve_po(po) for po in pos])
+    flow("receive_po", [lambda po=po: utils.receive_po(po) for po in pos])
+    flow("create_to", [lambda s=s, d=d, i=i: create_to(s, d, i) for s, d, i in scenario["tos"]])
+    flow("submit_to", [lambda to=to: utils.submit_to(to) for to in tos])
+    flow("approve_to", [lambda to=to: utils.approve_to(to) for to in tos])
+    flow("fulfill_to", [lambda to=to: utils.fulfill_to(to, {item["sku"]: item["qty"] for item in to["items"]}, None)
+                        for to in tos])
+    flow("receive_to", [lambda to=to: utils.receive_to(to, {item["sku"]: item["qty"] for item in to["items"]})
+                        for to in tos])
+    flow("process_stock_return", [
+        lambda o=o, w=w, i=i: utils.process_stock_return(o, w, [dict(item, reason="Damaged") for item in i])
+        for o, w, i in scenario["returns"]])
+
+    docs = [doc for doc_type in ("GRN", "DO", "TN", "RN")
+            for doc in utils.document_index.query(doc_type=doc_type, limit=pdfs // 4 + 1)[1]][:pdfs]
+    # First view of each document: a cache miss that renders through the queue
+    utils.doc_storage.clear()
+    flow("get_document_pdf", [lambda doc=doc: utils.get_document_pdf(doc) for doc in docs])
+
+    completed = sum(1 for order in pos if order["status"] == "Completed")
+    completed += sum(1 for order in tos if order["status"] == "Completed")
+    if completed != len(pos) + len(tos):
+        raise RuntimeError(f"Only {completed} of {len(pos) + len(tos)} orders reached Completed")
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(flows, baseline=None):
+    header = f"{'flow':<22} {'ops':>6} {'ops/s':>11} {'p50 ms':>9} {'p99 ms':>9} {'peak MiB':>9}"
+    print(header + ("  vs. baseline ops/s, p99" if baseline else ""))
+    for name in FLOWS:
+        stats = flows[name]
+        peak = stats.get("peak_mem_bytes")
+        line = (f"{name:<22} {stats['ops']:>6} {stats['ops_per_sec'] or 0:>11,.0f} {stats['p50_ms'] or 0:>9.3f} "
+                f"{stats['p99_ms'] or 0:>9.3f} {'' if peak is None else f'{peak / 2**20:9.2f}':>9}")
+        old = (baseline or {}).get(name)
+        if old and old.get("ops_per_sec") and stats["ops_per_sec"] and old.get("p99_ms"):
+            line += (f"  {stats['ops_per_sec'] / old['ops_per_sec'] - 1:+7.1%}, "
+                     f"{stats['p99_ms'] / old['p99_ms'] - 1:+7.1%}")
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--outlets", type=int, default=20)
+    parser.add_argument("--warehouses", type=int, default=2)
+    parser.add_argument("--skus", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=500, help="POs, TOs and returns each")
+    parser.add_argument("--lines", type=int, default=10, help="lines per order")
+    parser.add_argument("--history", type=int, default=20_000, help="past receipts loaded before the run")
+    parser.add_argument("--pdfs", type=int, default=50, help="documents opened with get_document_pdf")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="run against this SQLite file (recreated) instead of memory")
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced pass that measures peak memory")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    config = {name: getattr(args, name) for name in
+              ("outlets", "warehouses", "skus", "orders", "lines", "history", "pdfs", "seed")}
+    scenario = make_scenario(args.outlets, args.warehouses, args.skus, args.orders, args.lines, args.history, args.seed)
+
+    def lifecycle(trace):
+        if args.db:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(args.db + suffix):
+                    os.remove(args.db + suffix)
+            utils.configure_store(SQLiteStore(args.db))
+        return run_lifecycle(scenario, args.pdfs, trace)
+
+    # Timings come from an untraced pass; tracemalloc slows Python down, so
+    # peak memory is measured by a second, identical pass
+    flows = lifecycle(trace=False)
+    if not args.no_memory:
+        tracemalloc.start()
+        for name, stats in lifecycle(trace=True).items():
+            flows[name]["peak_mem_bytes"] = stats["peak_mem_bytes"]
+        tracemalloc.stop()
+
+    results = {
+        "revision": git_revision(),
+        "recorded_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "store": "sqlite" if args.db else "memory",
+        "config": config,
+        "flows": flows,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        if previous.get("config") != config:
+            print(f"Note: {args.compare} was recorded with a different config: {previous.get('config')}")
+        print(f"Baseline: revision {previous.get('revision')} recorded {previous.get('recorded_at')}")
+        baseline = previous["flows"]
+    print_results(flows, baseline)
+
+    if args.out:
+        # Written via a temporary file so an interrupted run keeps the old results
+        directory = os.path.dirname(os.path.abspath(args.out))
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False, suffix=".json", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        os.replace(f.name, args.out)
+        print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Rows per second of the streaming item master / opening stock importers and exporters.
+
+    python benchmarks/bench_import.py [--skus 500000] [--positions 100000] [--db path]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bulk_io  # noqa: E402
+import utils  # noqa: E402
+from data_store import SQLiteStore  # noqa: E402
+
+
+def write_inputs(directory, skus, positions, outlets=50):
+    files = {}
+    for fmt in ("csv", "jsonl"):
+        path = os.path.join(directory, f"items.{fmt}")
+        bulk_io.write_rows(path, ("sku", "cost"), ((f"SKU{n:07d}", 1 + n % 97 / 10) for n in range(skus)), fmt)
+        files["items", fmt] = path
+        path = os.path.join(directory, f"stock.{fmt}")
+        bulk_io.write_rows(path, ("outlet", "sku", "qty", "unit_cost"), (
+            (f"Outlet{n % outlets}", f"SKU{n * 7919 % skus:07d}", n % 40, 1 + n % 13 / 10) for n in range(positions)), fmt)
+        files["stock", fmt] = path
+        path = os.path.join(directory, f"outlets.{fmt}")
+        bulk_io.write_rows(path, ("outlet",), ((f"Outlet{n}",) for n in range(outlets)), fmt)
+        files["outlets", fmt] = path
+    return files
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    rows = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {rows:>9} rows  {elapsed:8.3f} s  {rows / elapsed:12,.0f} rows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--skus", type=int, default=500_000)
+    parser.add_argument("--positions", type=int, default=100_000)
+    parser.add_argument("--db", help="import into this SQLite file instead of memory")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = write_inputs(directory, args.skus, args.positions)
+        for fmt in ("csv", "jsonl"):
+            utils.clear_all()
+            if args.db:
+                utils.configure_store(SQLiteStore(args.db))
+                utils.clear_all()
+            timed(f"import item master ({fmt})", lambda: utils.import_item_master(files["items", fmt])["rows"])
+            # Stock rows are only accepted for known outlets and SKUs
+            utils.import_outlets(files["outlets", fmt])
+            timed(f"import opening stock ({fmt})", lambda: utils.import_opening_stock(files["stock", fmt])["rows"])
+            out = os.path.join(directory, f"export.{fmt}")
+            timed(f"export item master ({fmt})", lambda: utils.export_item_master(out))
+            timed(f"export stock ({fmt})", lambda: utils.export_stock(out))
+
+
+if __name__ == "__main__":
+    main()
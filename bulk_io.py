@@ -0,0 +1,229 @@
+import csv
+import itertools
+import json
+import os
+from contextlib import contextmanager
+
+CHUNK_ROWS = 10_000
+MAX_ERRORS = 50  # error messages kept per import; the rest are only counted
+
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "json", ".parquet": "parquet"}
+
+
+def detect_format(source):
+    name = source if isinstance(source, (str, os.PathLike)) else getattr(source, "name", "")
+    fmt = FORMATS.get(os.path.splitext(str(name))[1].lower())
+    if fmt is None:
+        raise ValueError(f"Cannot tell the format of {name!r}; pass fmt='csv', 'jsonl' or 'json'")
+    return fmt
+
+
+@contextmanager
+def _open(target, mode):
+    # Paths are opened here; file objects (e.g. uploads) are used as given
+    if isinstance(target, (str, os.PathLike)):
+        with open(target, mode, newline="", encoding="utf-8") as f:
+            yield f
+    else:
+        yield target
+
+
+def _jsonl_rows(f):
+    for line_no, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError:
+            yield line_no, None
+
+
+def read_chunks(source, fmt=None, chunk_size=CHUNK_ROWS, flatten=None):
+    """Yield lists of (line number, row dict), at most ``chunk_size`` at a time.
+
+    CSV and JSON Lines are streamed, so memory is bounded by the chunk size.
+    A plain ``.json`` document (the old ``data/*.json`` files) is read
+    whole and turned into rows by ``flatten``. Rows that cannot be parsed
+    come through as None.
+    """
+    fmt = fmt or detect_format(source)
+    with _open(source, "r") as f:
+        if fmt == "csv":
+            rows = enumerate(csv.DictReader(f), start=2)
+        elif fmt == "jsonl":
+            rows = _jsonl_rows(f)
+        elif fmt == "json":
+            document = json.load(f)
+            rows = enumerate(flatten(document) if flatten else document, start=1)
+        else:
+            raise ValueError(f"Unknown format: {fmt}")
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def import_rows(chunks, validate, key, apply_chunk):
+    """Validate, deduplicate and apply rows chunk by chunk.
+
+    ``validate(row)`` returns a record or raises ValueError. A record whose
+    ``key(record)`` was already seen earlier in the same import is counted
+    as a duplicate and dropped. The first occurrence wins.
+    ``apply_chunk(records)`` writes a chunk and returns its
+    (added, updated, unchanged) counts. Returns a report dict.
+    """
+    report = {"rows": 0, "added": 0, "updated": 0, "unchanged": 0, "duplicates": 0, "invalid": 0, "errors": []}
+    seen = set()
+    for chunk in chunks:
+        records = []
+        for line_no, row in chunk:
+            report["rows"] += 1
+            try:
+                if not isinstance(row, dict):
+                    raise ValueError("not a valid row")
+                record = validate(row)
+            except ValueError as error:
+                report["invalid"] += 1
+                if len(report["errors"]) < MAX_ERRORS:
+                    report["errors"].append((line_no, str(error)))
+                continue
+            record_key = key(record)
+            if record_key in seen:
+                report["duplicates"] += 1
+                continue
+            seen.add(record_key)
+            records.append(record)
+        if records:
+            added, updated, unchanged = apply_chunk(records)
+            report["added"] += added
+            report["updated"] += updated
+            report["unchanged"] += unchanged
+    return report
+
+
+def write_rows(target, fields, rows, fmt=None):
+    """Stream ``rows`` (tuples in ``fields`` order) as CSV or JSON Lines; returns the row count."""
+    fmt = fmt or detect_format(target)
+    count = 0
+    with _open(target, "w") as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        elif fmt == "jsonl":
+            for row in rows:
+                f.write(json.dumps(dict(zip(fields, row))))
+                f.write("\n")
+                count += 1
+        else:
+            raise ValueError(f"Cannot export as {fmt}; use 'csv' or 'jsonl'")
+    return count
+
+
+def write_frames(target, fields, frames, fmt=None):
+    """Stream DataFrame chunks as CSV, JSON Lines or Parquet; returns the row count.
+
+    Frames are written one at a time, so only the current chunk is held in
+    memory. Parquet writes each chunk as a row group and needs pyarrow and
+    a binary target.
+    """
+    fmt = fmt or detect_format(target)
+    fields = list(fields)
+    if fmt == "parquet":
+        return _write_parquet(target, fields, frames)
+    count = 0
+    with _open(target, "w") as f:
+        if fmt == "csv":
+            csv.writer(f).writerow(fields)
+            for frame in frames:
+                frame[fields].to_csv(f, header=False, index=False, lineterminator="\r\n")
+                count += len(frame)
+        elif fmt == "jsonl":
+            for frame in frames:
+                if len(frame):
+                    lines = frame[fields].to_json(orient="records", lines=True, date_format="iso",
+                                                      date_unit="us", double_precision=15)
+                    f.write(lines if lines.endswith("\n") else lines + "\n")
+                count += len(frame)
+        else:
+            raise ValueError(f"Cannot export as {fmt}; use 'csv', 'jsonl' or 'parquet'")
+    return count
+
+
+def _write_parquet(target, fields, frames):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet export needs pyarrow; use 'csv' or 'jsonl'") from None
+    if isinstance(target, os.PathLike):
+        target = os.fspath(target)
+    writer = None
+    count = 0
+    try:
+        for frame in frames:
+            table = pa.Table.from_pandas(frame[fields], preserve_index=False)
+            if writer is None:
+                # Categorical columns get int32 codes, so chunks whose
+                # dictionaries differ in size still share one schema
+                schema = pa.schema([
+                    pa.field(field.name, pa.dictionary(pa.int32(), field.type.value_type))
+                    if pa.types.is_dictionary(field.type) else field
+                    for field in table.schema
+                ])
+                writer = pq.ParquetWriter(target, schema)
+            writer.write_table(table.cast(writer.schema))
+            count += len(frame)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+# Row validators: each returns a normalised record or raises ValueError
+
+def _text(row, field):
+    value = row.get(field)
+    value = "" if value is None else str(value).strip()
+    if not value:
+        raise ValueError(f"missing {field}")
+    return value
+
+
+def _number(row, field, kind, default=None):
+    value = row.get(field)
+    if value is None or value == "":
+        if default is not None:
+            return default
+        raise ValueError(f"missing {field}")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} is not a number: {value!r}") from None
+    if number != number or number < 0:
+        raise ValueError(f"{field} must be zero or more: {value!r}")
+    if kind is int:
+        if not number.is_integer():
+            raise ValueError(f"{field} must be a whole number: {value!r}")
+        return int(number)
+    return number
+
+
+def item_record(row):
+    # (sku, cost); "unit_cost" is accepted for files written by other tools
+    cost = row.get("cost", row.get("unit_cost"))
+    return _text(row, "sku"), _number({"cost": cost}, "cost", float)
+
+
+def stock_record(row):
+    # (outlet, sku, qty, unit_cost or None)
+    unit_cost = row.get("unit_cost")
+    return (_text(row, "outlet"), _text(row, "sku"), _number(row, "qty", int),
+            None if unit_cost in (None, "") else _number(row, "unit_cost", float))
+
+
+def outlet_record(row):
+    return _text(row, "outlet")
@@ -0,0 +1,128 @@
+import bisect
+import threading
+from array import array
+
+
+class Codes:
+    """Interns strings (SKUs, outlets) to dense integer ids 0, 1, 2, ...
+
+    Behaves like the list of values in first-seen order (iteration, ``len``,
+    ``[i]``, ``append``), except that ``in`` and ``index`` are dict lookups
+    instead of scans. Ids never change once given out, until ``clear``.
+    """
+
+    def __init__(self, values=()):
+        self._ids = {}
+        self._values = []
+        self.extend(values)
+
+    def code(self, value):
+        """Id of ``value``, interning it first if new."""
+        code = self._ids.get(value)
+        if code is None:
+            code = self._ids[value] = len(self._values)
+            self._values.append(value)
+        return code
+
+    def get(self, value, default=None):
+        return self._ids.get(value, default)
+
+    def index(self, value):
+        try:
+            return self._ids[value]
+        except KeyError:
+            raise ValueError(f"{value!r} is not in the catalog") from None
+
+    def append(self, value):
+        self.code(value)
+
+    def extend(self, values):
+        for value in values:
+            self.code(value)
+
+    def __contains__(self, value):
+        return value in self._ids
+
+    def __getitem__(self, code):
+        return self._values[code]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return f"Codes({self._values!r})"
+
+    def clear(self):
+        self._ids.clear()
+        self._values.clear()
+
+
+class SearchIndex:
+    """Case-insensitive prefix and substring search over a ``Codes``.
+
+    Keeps the values sorted for prefix lookups and a trigram -> ids
+    posting list for substring lookups, so a query only touches the
+    matches (or the rarest trigram's postings) rather than every value.
+    Values appended to the ``Codes`` are picked up on the next search.
+    Searches from several threads take turns, so only one of them indexes
+    the new values.
+    """
+
+    def __init__(self, codes):
+        self.codes = codes
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self._sorted = []  # (lowercased value, id)
+        self._trigrams = {}  # trigram -> array of ids, ascending
+        self._indexed = 0
+
+    def _sync(self):
+        codes = self.codes
+        if len(codes) < self._indexed or (self._indexed and codes[self._indexed - 1] != self._last):
+            self._clear()  # the Codes were cleared since the last search
+        start, end = self._indexed, len(codes)
+        if start == end:
+            return
+        new = [(codes[i].lower(), i) for i in range(start, end)]
+        if len(new) > 64:
+            self._sorted.extend(new)
+            self._sorted.sort()
+        else:
+            for entry in new:
+                bisect.insort(self._sorted, entry)
+        for text, i in new:
+            for gram in {text[j:j + 3] for j in range(len(text) - 2)}:
+                postings = self._trigrams.get(gram)
+                if postings is None:
+                    postings = self._trigrams[gram] = array("i")
+                postings.append(i)
+        self._indexed = end
+        self._last = codes[end - 1]
+
+    def search(self, query="", offset=0, limit=20):
+        """(total matches, one page of values) for ``query``.
+
+        An empty query lists everything in catalog order. Queries shorter
+        than three characters match by prefix, in sorted order; longer ones
+        match anywhere in the value, in catalog order.
+        """
+        query = query.strip().lower()
+        if not query:
+            total = len(self.codes)
+            return total, [self.codes[i] for i in range(offset, min(offset + limit, total))]
+        with self._lock:
+            self._sync()
+            if len(query) < 3:
+                lo = bisect.bisect_left(self._sorted, (query,))
+                hi = bisect.bisect_left(self._sorted, (query + "\uffff",))
+                page = self._sorted[lo + offset:min(lo + offset + limit, hi)]
+                return hi - lo, [self.codes[i] for _, i in page]
+            postings = [self._trigrams.get(query[j:j + 3], ()) for j in range(len(query) - 2)]
+            candidates = min(postings, key=len)
+            matches = [i for i in candidates if query in self.codes[i].lower()]
+        return len(matches), [self.codes[i] for i in matches[offset:offset + limit]]
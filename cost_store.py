@@ -0,0 +1,496 @@
+import bisect
+import datetime
+import functools
+import threading
+from array import array
+
+import numpy as np
+import pandas as pd
+
+EPOCH = datetime.datetime(1970, 1, 1)
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+# Every cost event is a stock movement of qty units of a sku from a source
+# location to a destination: GRN (supplier, so no source) -> outlet,
+# DO source -> IN_TRANSIT, TN IN_TRANSIT -> destination, RETURN outlet ->
+# warehouse. ``ref`` is the PO, TO or RN id behind it.
+STRING_COLUMNS = ("type", "sku", "source", "destination", "ref", "reason")
+COLUMNS = ("timestamp", "type", "ref", "sku", "qty", "unit_cost", "total_cost", "source", "destination", "reason")
+# Frames also carry ``entry``, the order events were recorded in; timestamps
+# can be backdated, so only ``entry`` says which came first
+FRAME_COLUMNS = COLUMNS + ("entry",)
+
+# Where a TO's stock is between its DO and its TN
+IN_TRANSIT = "In transit"
+
+
+def to_micros(value):
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time.min)
+    return (value - EPOCH) // ONE_MICROSECOND
+
+
+def from_micros(value):
+    return EPOCH + datetime.timedelta(microseconds=value)
+
+
+class _Dictionary:
+    """Dictionary encoding for a string column: values get dense int codes."""
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def encode(self, value):
+        if value is None:
+            return -1
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self._codes[value] = code
+            self.values.append(value)
+        return code
+
+    def decode(self, code):
+        return None if code < 0 else self.values[code]
+
+    def code(self, value):
+        return self._codes.get(value)
+
+
+def _dtype(name):
+    if name in ("timestamp", "qty", "entry"):
+        return np.int64
+    if name in STRING_COLUMNS:
+        return np.int32
+    return np.float64
+
+
+def _new_columns():
+    return {
+        "timestamp": array("q"),
+        "entry": array("q"),
+        "qty": array("q"),
+        "unit_cost": array("d"),
+        "total_cost": array("d"),
+        **{name: array("i") for name in STRING_COLUMNS},
+    }
+
+
+# Per-location flows: {location: {sku: [in_qty, in_cost, out_qty, out_cost]}}
+IN, OUT = 0, 2
+
+
+def _add_flow(flows, location, sku, side, qty, total_cost):
+    entry = flows.setdefault(location, {}).setdefault(sku, [0, 0.0, 0, 0.0])
+    entry[side] += qty
+    entry[side + 1] += total_cost
+
+
+class _Partition:
+    """One day or month of cost events, with its own min/max and per-location flows."""
+
+    def __init__(self, key):
+        self.key = key
+        self.columns = _new_columns()
+        self.min = None
+        self.max = None
+        self.flows = {}  # by location and sku code, see _add_flow
+        self._order = np.empty(0, dtype=np.int64)
+        self._by_location = {}  # location code -> (rows sorted, its rows in timestamp order)
+
+    def __len__(self):
+        return len(self.columns["timestamp"])
+
+    def append(self, timestamp, entry, qty, unit_cost, total_cost, codes):
+        columns = self.columns
+        columns["timestamp"].append(timestamp)
+        columns["entry"].append(entry)
+        columns["qty"].append(qty)
+        columns["unit_cost"].append(unit_cost)
+        columns["total_cost"].append(total_cost)
+        for name, code in codes.items():
+            columns[name].append(code)
+        if self.min is None or timestamp < self.min:
+            self.min = timestamp
+        if self.max is None or timestamp > self.max:
+            self.max = timestamp
+        if codes["destination"] >= 0:
+            _add_flow(self.flows, codes["destination"], codes["sku"], IN, qty, total_cost)
+        if codes["source"] >= 0:
+            _add_flow(self.flows, codes["source"], codes["sku"], OUT, qty, total_cost)
+
+    def overlaps(self, lo, hi):
+        return (lo is None or self.max >= lo) and (hi is None or self.min < hi)
+
+    def inside(self, lo, hi):
+        return (lo is None or self.min >= lo) and (hi is None or self.max < hi)
+
+    def array(self, name, dtype):
+        return np.frombuffer(self.columns[name], dtype=dtype).copy()
+
+    def take(self, name, dtype, rows=None):
+        # Only the selected rows are copied out of the column
+        values = np.frombuffer(self.columns[name], dtype=dtype)
+        return values.copy() if rows is None else values[rows]
+
+    def order(self):
+        """Row numbers in timestamp order (ties in append order).
+
+        Kept between calls and extended as rows arrive; only a row older
+        than the newest one already sorted (a backdated event) re-sorts.
+        """
+        done = len(self._order)
+        if done == len(self):
+            return self._order
+        timestamps = self.array("timestamp", np.int64)
+        new = timestamps[done:]
+        if (new[1:] >= new[:-1]).all() and (not done or new[0] >= timestamps[self._order[-1]]):
+            self._order = np.concatenate([self._order, np.arange(done, len(timestamps))])
+        else:
+            self._order = np.argsort(timestamps, kind="stable")
+        return self._order
+
+    def rows(self, location_code=None):
+        """``order()``, narrowed to the rows into or out of one location if a code is given."""
+        order = self.order()
+        if location_code is None:
+            return order
+        cached = self._by_location.get(location_code)
+        if cached is None or cached[0] != len(order):
+            touches = ((self.take("source", np.int32, order) == location_code)
+                       | (self.take("destination", np.int32, order) == location_code))
+            cached = self._by_location[location_code] = (len(order), order[touches])
+        return cached[1]
+
+    def mask(self, lo, hi):
+        timestamps = self.array("timestamp", np.int64)
+        mask = np.ones(len(timestamps), dtype=bool)
+        if lo is not None:
+            mask &= timestamps >= lo
+        if hi is not None:
+            mask &= timestamps < hi
+        return mask
+
+    def flows_between(self, lo, hi, location_code=None):
+        # Only boundary partitions get here; full ones use self.flows
+        mask = self.mask(lo, hi)
+        skus = self.array("sku", np.int32)
+        qty = self.array("qty", np.int64)
+        total_cost = self.array("total_cost", np.float64)
+        flows = {}
+        for side, column in ((IN, "destination"), (OUT, "source")):
+            locations = self.array(column, np.int32)
+            selected = mask & (locations >= 0 if location_code is None else locations == location_code)
+            rows = pd.DataFrame({
+                "location": locations[selected],
+                "sku": skus[selected],
+                "qty": qty[selected],
+                "total_cost": total_cost[selected],
+            }).groupby(["location", "sku"]).sum()
+            for (location, sku), moved, cost in zip(rows.index, rows["qty"], rows["total_cost"]):
+                _add_flow(flows, location, sku, side, moved, cost)
+        return flows
+
+
+def _locked(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class CostHistory:
+    """Append-only cost event log, stored column by column in time partitions.
+
+    Timestamps are int64 microseconds, quantities and costs typed arrays and
+    string fields dictionary-encoded int32 codes, so ``to_frame`` builds a
+    DataFrame straight from buffers. Events are split into day or month
+    partitions that each track their min/max timestamp and per-location
+    in / out flows by sku, so a date-range query only reads partitions it overlaps and only
+    scans rows in the partitions at either end of the range.
+
+    Reads hold the same lock as ``append``: numpy views of a column stop
+    it from growing, and the flow dicts must not change mid-merge.
+
+    After ``keep_in_store`` the events already in a store stay there, month
+    by month, until a read covers their month; only each month's first and
+    last timestamp and row count are held until then.
+    """
+
+    def __init__(self, granularity="month"):
+        if granularity not in ("day", "month"):
+            raise ValueError(f"Unknown partition granularity: {granularity}")
+        self.granularity = granularity
+        self._lock = threading.RLock()
+        self._dicts = {}
+        self._partitions = {}
+        self._keys = []
+        self._len = 0
+        self.clear()
+
+    def _partition_key(self, value):
+        if self.granularity == "day":
+            return value.toordinal()
+        return value.year * 12 + value.month - 1
+
+    def _month(self, key):
+        # Month key (as _partition_key gives for "month") of a partition key
+        if self.granularity == "day":
+            day = datetime.date.fromordinal(key)
+            return day.year * 12 + day.month - 1
+        return key
+
+    @_locked
+    def __len__(self):
+        return self._len + sum(rows for _, _, rows in self._stored.values())
+
+    @_locked
+    def keep_in_store(self, store):
+        """Start over from the events ``store`` holds, reading each month on first use.
+
+        ``store.cost_partitions()`` gives ("YYYY-MM", first, last, rows) per
+        month and ``store.load_cost_events(month, before)`` a month's events
+        with an entry below ``before``; events appended from now on are
+        numbered after those in the store.
+        """
+        self.clear()
+        self._store = store
+        for month, first, last, rows in store.cost_partitions():
+            key = int(month[:4]) * 12 + int(month[5:7]) - 1
+            self._stored[key] = (to_micros(first), to_micros(last), rows)
+        self._next_entry = self._stored_before = store.next_cost_entry()
+
+    def _load(self, lo=None, hi=None):
+        # Read in every stored month overlapping [lo, hi); callers hold the lock
+        for key in sorted(key for key, (first, last, _) in self._stored.items()
+                          if (lo is None or last >= lo) and (hi is None or first < hi)):
+            self._load_month(key)
+
+    def _load_month(self, key):
+        events = self._store.load_cost_events(f"{key // 12:04d}-{key % 12 + 1:02d}", self._stored_before)
+        del self._stored[key]
+        for event in events:
+            self.append(event)
+
+    def __iter__(self):
+        # Events as dicts, partition by partition, for code that still wants rows
+        with self._lock:
+            self._load()
+        for key in list(self._keys):
+            with self._lock:
+                partition = self._partitions[key]
+                events = [self._row(partition, i) for i in range(len(partition))]
+            yield from events
+
+    def _row(self, partition, i):
+        columns = partition.columns
+        event = {"timestamp": from_micros(columns["timestamp"][i])}
+        for name in FRAME_COLUMNS[1:]:
+            if name in self._dicts:
+                value = self._dicts[name].decode(columns[name][i])
+            else:
+                value = columns[name][i]
+            if value is not None:
+                event[name] = value
+        return event
+
+    @_locked
+    def append(self, event):
+        """Add an event; returns its ``entry`` number.
+
+        Events are numbered in the order they are appended unless they
+        already carry an ``entry`` (reloaded from a store).
+        """
+        entry = event.get("entry")
+        if entry is None:
+            entry = self._next_entry
+        self._next_entry = max(self._next_entry, entry + 1)
+        key = self._partition_key(event["timestamp"])
+        partition = self._partitions.get(key)
+        if partition is None:
+            partition = self._partitions[key] = _Partition(key)
+            bisect.insort(self._keys, key)
+        codes = {name: dictionary.encode(event.get(name)) for name, dictionary in self._dicts.items()}
+        partition.append(to_micros(event["timestamp"]), entry, event["qty"], event["unit_cost"], event["total_cost"],
+                         codes)
+        self._len += 1
+        return entry
+
+    def extend(self, events):
+        for event in events:
+            self.append(event)
+
+    @_locked
+    def clear(self):
+        self._dicts = {name: _Dictionary() for name in STRING_COLUMNS}
+        # Sources and destinations share one dictionary, so a location has
+        # the same code at both ends of a movement
+        self._dicts["destination"] = self._dicts["source"]
+        self._partitions.clear()
+        self._keys.clear()
+        self._len = 0
+        self._next_entry = 0
+        self._store = None
+        self._stored = {}  # month key -> (first, last, rows) of events still only in _store
+        self._stored_before = 0
+
+    @property
+    @_locked
+    def min_timestamp(self):
+        firsts = [p.min for p in self._partitions.values()] + [first for first, _, _ in self._stored.values()]
+        return from_micros(min(firsts)) if firsts else None
+
+    @property
+    @_locked
+    def max_timestamp(self):
+        lasts = [p.max for p in self._partitions.values()] + [last for _, last, _ in self._stored.values()]
+        return from_micros(max(lasts)) if lasts else None
+
+    @_locked
+    def partitions(self):
+        """[(first event, last event, rows)] per partition, oldest first."""
+        self._load()
+        return [(from_micros(p.min), from_micros(p.max), len(p))
+                for p in map(self._partitions.get, self._keys)]
+
+    def _bounds(self, start, end):
+        # Inclusive dates -> half-open microsecond range
+        lo = to_micros(start) if start else None
+        hi = to_micros(end + datetime.timedelta(days=1)) if end else None
+        return lo, hi
+
+    def _overlapping(self, lo, hi):
+        return [p for p in map(self._partitions.get, self._keys) if p.overlaps(lo, hi)]
+
+    @_locked
+    def locations(self):
+        """Every location stock has moved into or out of, IN_TRANSIT included."""
+        self._load()
+        codes = {code for p in self._partitions.values() for code in p.flows}
+        return sorted(self._dicts["source"].decode(code) for code in codes)
+
+    @_locked
+    def skus(self):
+        self._load()
+        return sorted(self._dicts["sku"].values)
+
+    @_locked
+    def totals(self, start=None, end=None, location=None):
+        """{(location, sku): (in_qty, in_cost, out_qty, out_cost)} between two inclusive dates.
+
+        Each partition keeps these flows by location, so asking for one
+        ``location`` is a dict lookup per partition rather than a scan.
+        """
+        lo, hi = self._bounds(start, end)
+        self._load(lo, hi)
+        code = None
+        if location is not None:
+            code = self._dicts["source"].code(location)
+            if code is None:
+                return {}
+        merged = {}
+        for partition in self._overlapping(lo, hi):
+            if partition.inside(lo, hi):
+                flows = partition.flows if code is None else {code: partition.flows.get(code, {})}
+            else:
+                flows = partition.flows_between(lo, hi, code)
+            for location_code, by_sku in flows.items():
+                for sku, entry in by_sku.items():
+                    for side in (IN, OUT):
+                        _add_flow(merged, location_code, sku, side, entry[side], entry[side + 1])
+        locations, skus = self._dicts["source"], self._dicts["sku"]
+        return {(locations.decode(location_code), skus.decode(sku)): tuple(entry)
+                for location_code, by_sku in merged.items() for sku, entry in by_sku.items()}
+
+    def totals_frame(self, start=None, end=None, location=None):
+        return pd.DataFrame(
+            [key + entry for key, entry in self.totals(start, end, location).items()],
+            columns=["location", "sku", "in_qty", "in_cost", "out_qty", "out_cost"],
+        )
+
+    @_locked
+    def to_frame(self, start=None, end=None):
+        """Events between two inclusive dates as a DataFrame (all by default)."""
+        lo, hi = self._bounds(start, end)
+        self._load(lo, hi)
+        return self._frame([(partition, None if partition.inside(lo, hi) else partition.mask(lo, hi))
+                            for partition in self._overlapping(lo, hi)])
+
+    def iter_frames(self, start=None, end=None, chunk_rows=10_000):
+        """Events between two inclusive dates as DataFrames of up to ``chunk_rows`` rows, oldest first.
+
+        Only the current chunk is copied out of the columns, so exporting a
+        large log keeps memory flat. An empty range yields one empty frame.
+        """
+        lo, hi = self._bounds(start, end)
+        empty = True
+        with self._lock:
+            self._load(lo, hi)
+            partitions = self._overlapping(lo, hi)
+        for partition in partitions:
+            with self._lock:
+                rows = partition.order()
+                if not partition.inside(lo, hi):
+                    timestamps = partition.take("timestamp", np.int64, rows)
+                    first = 0 if lo is None else np.searchsorted(timestamps, lo)
+                    last = len(rows) if hi is None else np.searchsorted(timestamps, hi)
+                    rows = rows[first:last]
+            for offset in range(0, len(rows), chunk_rows):
+                empty = False
+                # Locked per chunk, so a long export does not hold up appends
+                with self._lock:
+                    frame = self._frame([(partition, rows[offset:offset + chunk_rows])])
+                yield frame
+        if empty:
+            yield self._frame([])
+
+    @_locked
+    def page(self, offset=0, limit=50, location=None):
+        """(total, DataFrame) for one page of events, newest first.
+
+        ``location`` narrows it to the movements into or out of one
+        location. Partitions are walked newest first using their sorted row
+        order, so only the rows on the page are read. Without ``location``
+        only the stored months down to the page are loaded.
+        """
+        code = None
+        if location is not None:
+            self._load()
+            code = self._dicts["source"].code(location)
+            if code is None:
+                return 0, self._frame([])
+        else:
+            for month in sorted(self._stored, reverse=True):
+                if sum(len(p) for key, p in self._partitions.items() if self._month(key) > month) >= offset + limit:
+                    break
+                self._load_month(month)
+        selected = [(partition, partition.rows(code)) for partition in map(self._partitions.get, reversed(self._keys))]
+        total = sum(len(rows) for _, rows in selected) + sum(rows for _, _, rows in self._stored.values())
+        pieces = []
+        for partition, rows in selected:
+            if limit <= 0:
+                break
+            if offset >= len(rows):
+                offset -= len(rows)
+                continue
+            newest = rows[::-1][offset:offset + limit]
+            pieces.append((partition, newest))
+            limit -= len(newest)
+            offset = 0
+        return total, self._frame(pieces)
+
+    def _frame(self, pieces):
+        # DataFrame of (partition, rows) pieces; rows may be indices, a mask or None for all
+        data = {}
+        for name in FRAME_COLUMNS:
+            parts = [partition.take(name, _dtype(name), rows) for partition, rows in pieces]
+            values = np.concatenate(parts) if parts else np.array([], dtype=_dtype(name))
+            if name == "timestamp":
+                data[name] = pd.to_datetime(values, unit="us")
+            elif name in self._dicts:
+                data[name] = pd.Categorical.from_codes(values, categories=list(self._dicts[name].values))
+            else:
+                data[name] = values
+        return pd.DataFrame(data)
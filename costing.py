@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+
+# How each cost event type moves stock at its location
+RECEIPT_TYPES = ("GRN", "TN")  # qty in at the event's unit cost
+ISSUE_TYPES = ("DO", "RETURN")  # qty out at the current average cost
+ADJUST_TYPES = ("ADJUST",)  # qty moved in or out, cost overwritten
+
+RECEIPT, ISSUE, ADJUST = 0, 1, 2
+
+
+def apply_receipts(key_codes, qty, cost, prev_qty, prev_cost):
+    """Weighted-average cost update for many receipts at once.
+
+    ``key_codes[i]`` says which position receipt ``i`` goes to and indexes
+    ``prev_qty``/``prev_cost``. Receipts for the same position are summed
+    first, so the result equals applying them one by one.
+    Returns (new_qty, new_cost) lists, one entry per position.
+    """
+    key_codes = np.asarray(key_codes, dtype=np.int64)
+    qty = np.asarray(qty)
+    prev_qty = np.asarray(prev_qty)
+    prev_cost = np.asarray(prev_cost, dtype=np.float64)
+
+    qty_sum = np.zeros(len(prev_qty), dtype=np.result_type(qty, prev_qty))
+    np.add.at(qty_sum, key_codes, qty)
+    value_sum = np.bincount(key_codes, weights=qty * np.asarray(cost, dtype=np.float64), minlength=len(prev_qty))
+
+    new_qty = prev_qty + qty_sum
+    with np.errstate(divide="ignore", invalid="ignore"):
+        new_cost = np.where(new_qty != 0, (prev_qty * prev_cost + value_sum) / new_qty, prev_cost)
+    return new_qty.tolist(), new_cost.tolist()
+
+
+def replay(frame):
+    """Rebuild stock positions from scratch by replaying cost events.
+
+    ``frame`` is ``CostHistory.to_frame()``. Events are applied in the order
+    they were recorded (``entry``), as the ledger applied them, not by their
+    possibly backdated timestamp. All positions advance together:
+    step ``r`` applies every position's ``r``-th event as one vector update,
+    so the Python loop runs once per event of the busiest position rather
+    than once per event. Returns a DataFrame of outlet, sku, qty, unit_cost.
+    """
+    columns = ["outlet", "sku", "qty", "unit_cost"]
+    if frame.empty:
+        return pd.DataFrame(columns=columns)
+
+    frame = frame.sort_values("entry", kind="stable")
+    types = frame["type"].astype(object).to_numpy()
+    kind = np.full(len(frame), ADJUST, dtype=np.int8)
+    kind[np.isin(types, RECEIPT_TYPES)] = RECEIPT
+    kind[np.isin(types, ISSUE_TYPES)] = ISSUE
+    # Issues happen at their source and receipts at their destination; an
+    # adjustment down has no destination and happens at its source
+    destination = frame["destination"].astype(object).to_numpy()
+    outflow = (kind == ISSUE) | ((kind == ADJUST) & pd.isna(destination))
+    location = np.where(outflow, frame["source"].astype(object).to_numpy(), destination)
+    located = pd.notna(location)
+    kind = kind[located]
+    location_codes, locations = pd.factorize(location[located])
+    sku_codes, skus = pd.factorize(frame["sku"].astype(object).to_numpy()[located])
+    keys, codes = np.unique(location_codes * len(skus) + sku_codes, return_inverse=True)
+    qty = frame["qty"].to_numpy()[located]
+    # Adjustments carry the change in qty, signed here by direction
+    qty = np.where((kind == ADJUST) & outflow[located], -qty, qty)
+    cost = frame["unit_cost"].to_numpy(dtype=np.float64)[located]
+
+    # Position of each event within its key's own sequence
+    order = np.argsort(codes, kind="stable")
+    group_start = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+    rank = np.empty(len(codes), dtype=np.int64)
+    rank[order] = np.arange(len(codes)) - np.repeat(group_start, np.diff(np.r_[group_start, len(codes)]))
+    by_rank = np.argsort(rank, kind="stable")
+
+    qty_state = np.zeros(len(keys), dtype=qty.dtype)
+    cost_state = np.zeros(len(keys), dtype=np.float64)
+    offset = 0
+    for count in np.bincount(rank):
+        idx = by_rank[offset:offset + count]
+        offset += count
+        k, step_kind, q, c = codes[idx], kind[idx], qty[idx], cost[idx]
+        prev_q, prev_c = qty_state[k], cost_state[k]
+
+        received = prev_q + q
+        with np.errstate(divide="ignore", invalid="ignore"):
+            received_cost = np.where(received != 0, (prev_q * prev_c + q * c) / received, c)
+        is_receipt, is_issue = step_kind == RECEIPT, step_kind == ISSUE
+        qty_state[k] = np.select([is_receipt, is_issue], [received, np.maximum(prev_q - q, 0)], prev_q + q)
+        cost_state[k] = np.select([is_receipt, is_issue], [received_cost, prev_c], c)
+
+    return pd.DataFrame({
+        "outlet": locations[keys // len(skus)],
+        "sku": skus[keys % len(skus)],
+        "qty": qty_state,
+        "unit_cost": cost_state,
+    })
@@ -1,17 +1,430 @@
+import datetime
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager, nullcontext
+
 from models import PurchaseOrder, TransferOrder
 
 # Simulate in-memory storage
 POs = {}
 TOs = {}
+# {status: {order_id: order}}, kept in step by create_* and set_*_status
+_pos_by_status = {}
+_tos_by_status = {}
+
+def _move(buckets, order, order_id, status):
+    buckets.get(order.status, {}).pop(order_id, None)
+    order.status = status
+    buckets.setdefault(status, {})[order_id] = order
 
 def create_po(po_id, outlet, items):
     POs[po_id] = PurchaseOrder(po_id, outlet, items)
+    _pos_by_status.setdefault(POs[po_id].status, {})[po_id] = POs[po_id]
 
 def create_to(to_id, source, dest, items):
     TOs[to_id] = TransferOrder(to_id, source, dest, items)
+    _tos_by_status.setdefault(TOs[to_id].status, {})[to_id] = TOs[to_id]
+
+def set_po_status(po_id, status):
+    _move(_pos_by_status, POs[po_id], po_id, status)
+
+def set_to_status(to_id, status):
+    _move(_tos_by_status, TOs[to_id], to_id, status)
 
 def get_pos_by_status(status):
-    return [po for po in POs.values() if po.status == status]
+    return list(_pos_by_status.get(status, {}).values())
 
 def get_tos_by_status(status):
-    return [to for to in TOs.values() if to.status == status]
+    return list(_tos_by_status.get(status, {}).values())
+
+
+# ---------------------------- Persistence backends ----------------------------
+# utils keeps working state in module-level objects and writes every change
+# through one of these stores. MemoryStore persists nothing; SQLiteStore keeps
+# the same state in a WAL-mode database so it survives restarts. The file is
+# loaded once per process, so only one process may use it at a time.
+
+def _encode(value):
+    if hasattr(value, "to_dict"):
+        # models.PurchaseOrder / TransferOrder / LineItems
+        return value.to_dict()
+    if isinstance(value, datetime.datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+def _decode(obj):
+    if "$datetime" in obj:
+        return datetime.datetime.fromisoformat(obj["$datetime"])
+    if "$date" in obj:
+        return datetime.date.fromisoformat(obj["$date"])
+    return obj
+
+
+def dumps(value):
+    return json.dumps(value, default=_encode)
+
+
+def loads(text):
+    return json.loads(text, object_hook=_decode)
+
+
+_NO_TRANSACTION = nullcontext()
+
+
+class MemoryStore:
+    """Default backend: state only lives in the utils module objects."""
+
+    def load(self):
+        return None
+
+    def transaction(self):
+        # Nothing to commit; a shared no-op context keeps hot paths cheap
+        return _NO_TRANSACTION
+
+    def save_order(self, kind, order):
+        pass
+
+    def append_event(self, event):
+        # Events are numbered by the in-memory log
+        return None
+
+    def save_snapshot(self, seq, state):
+        pass
+
+    def load_state_at(self, seq):
+        return None
+
+    def seq_at(self, recorded_at):
+        return None
+
+    def load_events(self, after_seq, upto_seq=None):
+        return []
+
+    def append_cost_event(self, event):
+        pass
+
+    def save_document(self, doc):
+        pass
+
+    def next_counter(self, name, value):
+        return value
+
+    def save_item(self, sku, cost):
+        pass
+
+    def save_items(self, items):
+        pass
+
+    def save_outlets(self, outlets):
+        pass
+
+    def clear(self):
+        pass
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    order_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_kind_status ON orders (kind, status);
+
+-- Every stock mutation, with the position it left behind
+CREATE TABLE IF NOT EXISTS stock_events (
+    seq INTEGER PRIMARY KEY,
+    recorded_at TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    type TEXT NOT NULL,
+    outlet TEXT NOT NULL,
+    sku TEXT NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stock_events_recorded_at ON stock_events (recorded_at);
+
+-- Full stock state as of an event seq, taken every few hundred events
+CREATE TABLE IF NOT EXISTS stock_snapshots (
+    seq INTEGER PRIMARY KEY,
+    body TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS cost_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    type TEXT NOT NULL,
+    sku TEXT NOT NULL,
+    source TEXT,
+    destination TEXT,
+    body TEXT NOT NULL,
+    month TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cost_events_timestamp ON cost_events (timestamp);
+CREATE INDEX IF NOT EXISTS cost_events_by_month ON cost_events (month);
+CREATE INDEX IF NOT EXISTS cost_events_source ON cost_events (source, sku);
+CREATE INDEX IF NOT EXISTS cost_events_destination ON cost_events (destination, sku);
+
+-- One row per month of cost events, so a month is only read once a query covers it
+CREATE TABLE IF NOT EXISTS cost_partitions (
+    month TEXT PRIMARY KEY,
+    min_timestamp TEXT NOT NULL,
+    max_timestamp TEXT NOT NULL,
+    rows INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY,
+    doc_type TEXT NOT NULL,
+    ref TEXT NOT NULL,
+    outlet TEXT,
+    timestamp TEXT NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_type ON documents (doc_type);
+CREATE INDEX IF NOT EXISTS documents_ref ON documents (ref);
+
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS item_master (
+    sku TEXT PRIMARY KEY,
+    cost REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS outlets (
+    outlet TEXT PRIMARY KEY
+);
+"""
+
+
+class SQLiteStore:
+    """SQLite backend in WAL mode, so readers never block the writer."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.RLock()
+        self._depth = 0
+        # Completed orders, document contents and cost events are left in the
+        # file until first use; those reads go through their own connection,
+        # so they never wait on a write transaction
+        self._reader = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._read_lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self):
+        # Nested calls join the outermost transaction
+        with self._lock:
+            if self._depth == 0:
+                self._conn.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._conn.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._conn.execute("COMMIT")
+
+    def _execute(self, sql, params=()):
+        with self.transaction():
+            self._conn.execute(sql, params)
+
+    def load(self):
+        # Orders, documents and cost events are read by their containers
+        # (see utils.configure_store), mostly on first use
+        with self._lock:
+            conn = self._conn
+            return {
+                "stock": self._load_stock(),
+                "doc_counters": dict(conn.execute("SELECT name, value FROM counters")),
+                "item_master": dict(conn.execute("SELECT sku, cost FROM item_master ORDER BY rowid")),
+                "outlets": [outlet for (outlet,) in conn.execute("SELECT outlet FROM outlets ORDER BY rowid")],
+            }
+
+    def save_order(self, kind, order):
+        order_id = order["po_id"] if kind == "PO" else order["to_id"]
+        self._execute(
+            "INSERT INTO orders (order_id, kind, status, body) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (order_id) DO UPDATE SET status = excluded.status, body = excluded.body",
+            (order_id, kind, order["status"], dumps(order)),
+        )
+
+    def load_orders(self, kind, completed=False, order_id=None):
+        """Open (or Completed) orders of one kind, in creation order; only ``order_id`` if given."""
+        sql = "SELECT body FROM orders WHERE kind = ? AND status " + ("= ?" if completed else "!= ?")
+        params = [kind, "Completed"]
+        if order_id is not None:
+            sql += " AND order_id = ?"
+            params.append(order_id)
+        with self._read_lock:
+            return [loads(body) for (body,) in self._reader.execute(sql + " ORDER BY rowid", params)]
+
+    def order_ids(self, kind, status=None):
+        sql, params = "SELECT order_id FROM orders WHERE kind = ?", [kind]
+        if status is not None:
+            sql += " AND status = ?"
+            params.append(status)
+        with self._read_lock:
+            return [order_id for (order_id,) in self._reader.execute(sql + " ORDER BY rowid", params)]
+
+    def _load_stock(self):
+        # Latest snapshot plus the events after it; (seq, state, events)
+        row = self._conn.execute("SELECT seq, body FROM stock_snapshots ORDER BY seq DESC LIMIT 1").fetchone()
+        seq, state = (row[0], loads(row[1])) if row else (0, {"inventory": [], "returns": []})
+        return seq, state, self.load_events(seq)
+
+    def load_events(self, after_seq, upto_seq=None):
+        """Stock events with after_seq < seq <= upto_seq, in seq order."""
+        sql, params = "SELECT seq, body FROM stock_events WHERE seq > ?", [after_seq]
+        if upto_seq is not None:
+            sql += " AND seq <= ?"
+            params.append(upto_seq)
+        with self._lock:
+            return [dict(loads(body), seq=seq) for seq, body in self._conn.execute(sql + " ORDER BY seq", params)]
+
+    def append_event(self, event):
+        """Persist a stock event and return the seq the database gave it.
+
+        seq is the table's rowid, so it keeps counting across restarts.
+        """
+        with self.transaction():
+            return self._conn.execute(
+                "INSERT INTO stock_events (recorded_at, timestamp, type, outlet, sku, body) "
+                "VALUES (?, ?, ?, ?, ?, ?) RETURNING seq",
+                (str(event["recorded_at"]), str(event["timestamp"]), event["type"],
+                 event["outlet"], event["sku"], dumps({k: v for k, v in event.items() if k != "seq"})),
+            ).fetchall()[0][0]
+
+    def save_snapshot(self, seq, state):
+        self._execute("INSERT OR REPLACE INTO stock_snapshots (seq, body) VALUES (?, ?)", (seq, dumps(state)))
+
+    def load_state_at(self, seq):
+        """(snapshot state, events) needed to rebuild stock as of event ``seq``."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT seq, body FROM stock_snapshots WHERE seq <= ? ORDER BY seq DESC LIMIT 1", (seq,)
+            ).fetchone()
+            snapshot_seq, state = (row[0], loads(row[1])) if row else (0, {"inventory": [], "returns": []})
+            return state, self.load_events(snapshot_seq, seq)
+
+    def seq_at(self, recorded_at):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT max(seq) FROM stock_events WHERE recorded_at <= ?", (str(recorded_at),)
+            ).fetchone()
+            return row[0] or 0
+
+    def append_cost_event(self, event):
+        timestamp = str(event["timestamp"])
+        month = timestamp[:7]
+        with self.transaction():
+            # The row id is the event's entry number, so reloads keep the recorded order
+            self._conn.execute(
+                "INSERT INTO cost_events (id, timestamp, type, sku, source, destination, body, month) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (event.get("entry"), timestamp, event["type"], event["sku"], event.get("source"),
+                 event.get("destination"), dumps(event), month),
+            )
+            self._conn.execute(
+                "INSERT INTO cost_partitions (month, min_timestamp, max_timestamp, rows) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (month) DO UPDATE SET "
+                "min_timestamp = min(min_timestamp, excluded.min_timestamp), "
+                "max_timestamp = max(max_timestamp, excluded.max_timestamp), "
+                "rows = rows + 1",
+                (month, timestamp, timestamp),
+            )
+
+    def cost_partitions(self):
+        """[("YYYY-MM", first timestamp, last timestamp, rows)] per month of cost events."""
+        with self._read_lock:
+            return [(month, datetime.datetime.fromisoformat(first), datetime.datetime.fromisoformat(last), rows)
+                    for month, first, last, rows in self._reader.execute(
+                        "SELECT month, min_timestamp, max_timestamp, rows FROM cost_partitions ORDER BY month")]
+
+    def next_cost_entry(self):
+        with self._read_lock:
+            return self._reader.execute("SELECT coalesce(max(id) + 1, 0) FROM cost_events").fetchone()[0]
+
+    def load_cost_events(self, month, before):
+        """One month's cost events with an entry below ``before``, in entry order."""
+        with self._read_lock:
+            return [dict(loads(body), entry=row_id) for row_id, body in self._reader.execute(
+                "SELECT id, body FROM cost_events WHERE month = ? AND id < ? ORDER BY id", (month, before))]
+
+    def document_entries(self):
+        """(doc_id, type, ref, {outlet, warehouse}, timestamp) per document, without reading the items."""
+        with self._read_lock:
+            return [(doc_id, doc_type, ref, {outlet, warehouse} - {None}, datetime.datetime.fromisoformat(timestamp))
+                    for doc_id, doc_type, ref, outlet, warehouse, timestamp in self._reader.execute(
+                        "SELECT doc_id, doc_type, ref, outlet, json_extract(body, '$.warehouse'), timestamp "
+                        "FROM documents ORDER BY rowid")]
+
+    def load_documents(self, doc_ids):
+        """{doc_id: document} for the given ids."""
+        with self._read_lock:
+            return {doc_id: loads(body) for doc_id, body in self._reader.execute(
+                f"SELECT doc_id, body FROM documents WHERE doc_id IN ({', '.join('?' * len(doc_ids))})", doc_ids)}
+
+    def save_document(self, doc):
+        self._execute(
+            "INSERT OR REPLACE INTO documents (doc_id, doc_type, ref, outlet, timestamp, body) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (doc["doc_id"], doc["type"], doc["ref"], doc.get("outlet"), str(doc["timestamp"]), dumps(doc)),
+        )
+
+    def next_counter(self, name, value):
+        """Allocate the next value of a counter, ``value`` at least.
+
+        The increment happens in the database, so a value is never handed
+        out twice, even after a restart.
+        """
+        with self.transaction():
+            return self._conn.execute(
+                "INSERT INTO counters (name, value) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = max(value + 1, excluded.value) RETURNING value",
+                (name, value),
+            ).fetchall()[0][0]
+
+    def save_item(self, sku, cost):
+        self._execute(
+            "INSERT INTO item_master (sku, cost) VALUES (?, ?) "
+            "ON CONFLICT (sku) DO UPDATE SET cost = excluded.cost",
+            (sku, cost),
+        )
+
+    def save_items(self, items):
+        # Bulk upsert of (sku, cost) pairs in one transaction
+        with self.transaction():
+            self._conn.executemany(
+                "INSERT INTO item_master (sku, cost) VALUES (?, ?) "
+                "ON CONFLICT (sku) DO UPDATE SET cost = excluded.cost",
+                items,
+            )
+
+    def save_outlets(self, outlets):
+        with self.transaction():
+            self._conn.executemany("INSERT OR IGNORE INTO outlets (outlet) VALUES (?)", [(o,) for o in outlets])
+
+    def clear(self):
+        with self.transaction():
+            for table in ("orders", "stock_events", "stock_snapshots", "cost_events", "cost_partitions",
+                          "documents"):
+                self._conn.execute(f"DELETE FROM {table}")
+
+    def close(self):
+        with self._lock, self._read_lock:
+            self._conn.close()
+            self._reader.close()
@@ -0,0 +1,155 @@
+import bisect
+import datetime
+
+from cost_store import to_micros
+
+EMPTY_STATE = {"inventory": [], "returns": []}
+
+
+def replay(state, events):
+    """Apply events on top of a snapshot state.
+
+    Returns (inventory, returns) dicts keyed by (location, sku). Every event
+    carries the balance it left behind, so replay only copies post-images
+    and never has to redo costing.
+    """
+    inventory = {(outlet, sku): {"qty": qty, "unit_cost": unit_cost}
+                 for outlet, sku, qty, unit_cost in state["inventory"]}
+    returns = {(warehouse, sku): {"qty": qty, "unit_cost": unit_cost, "reasons": list(reasons)}
+               for warehouse, sku, qty, unit_cost, reasons in state["returns"]}
+    for event in events:
+        key = (event["outlet"], event["sku"])
+        if event["bucket"] == "returns":
+            entry = returns.setdefault(key, {"qty": 0, "unit_cost": 0, "reasons": []})
+            entry["reasons"].append(event.get("reason"))
+        else:
+            entry = inventory.setdefault(key, {"qty": 0, "unit_cost": 0})
+        entry["qty"] = event["balance_qty"]
+        entry["unit_cost"] = event["balance_cost"]
+    return inventory, returns
+
+
+class EventLog:
+    """Append-only log of every stock mutation, with periodic snapshots.
+
+    Events are numbered by ``seq``, which the store allocates when it
+    persists one. Each records the movement (type, signed qty, unit cost)
+    and the position it left behind; every ``snapshot_every`` events (or every N events once the state holds more
+    than N positions) a full copy of the stock state is kept, so rebuilding
+    any state costs one snapshot plus a bounded tail, however long the
+    history.
+
+    A log loaded from a store only holds the latest snapshot and the events
+    after it (``base_seq`` onwards); older states are read from the store.
+    """
+
+    def __init__(self, snapshot_every=1000):
+        self.snapshot_every = snapshot_every
+        self.clear()
+
+    def __len__(self):
+        return len(self.events)
+
+    def clear(self):
+        self.events = []
+        self.snapshots = [(0, EMPTY_STATE)]
+        self.base_seq = 0
+        self.last_seq = 0
+
+    def load(self, snapshot_seq, state, events):
+        self.events = list(events)
+        self.snapshots = [(snapshot_seq, state)]
+        self.base_seq = snapshot_seq
+        self.last_seq = self.events[-1]["seq"] if self.events else snapshot_seq
+
+    def append(self, event, seq=None):
+        # ``seq`` comes from the store when it numbers events itself
+        self.last_seq = self.last_seq + 1 if seq is None else seq
+        event["seq"] = self.last_seq
+        event.setdefault("recorded_at", datetime.datetime.now())
+        self.events.append(event)
+        return event
+
+    def snapshot_due(self, state_size=0):
+        # A snapshot costs O(state), so space them at least that many events
+        # apart: bulk loads then pay O(1) per event for snapshots
+        return self.last_seq - self.snapshots[-1][0] >= max(self.snapshot_every, state_size)
+
+    def add_snapshot(self, seq, state):
+        self.snapshots.append((seq, state))
+
+    def seq_at(self, recorded_at):
+        """Last seq recorded at or before a wall-clock time, if held in memory."""
+        index = bisect.bisect_right(self.events, recorded_at, key=lambda event: event["recorded_at"])
+        if index:
+            return self.events[index - 1]["seq"]
+        return 0 if self.base_seq == 0 else None
+
+    def state_at(self, seq):
+        """(inventory, returns) right after event ``seq``; None if not in memory."""
+        if seq < self.base_seq:
+            return None
+        seq = min(seq, self.last_seq)
+        snapshot_index = bisect.bisect_right(self.snapshots, seq, key=lambda snapshot: snapshot[0]) - 1
+        snapshot_seq, state = self.snapshots[snapshot_index]
+        seq_of = lambda event: event["seq"]  # noqa: E731
+        tail = self.events[bisect.bisect_right(self.events, snapshot_seq, key=seq_of):
+                           bisect.bisect_right(self.events, seq, key=seq_of)]
+        return replay(state, tail)
+
+
+class BalanceIndex:
+    """Running stock balance of each (outlet, sku), ordered by business time.
+
+    Events are added in seq order; each one's qty and value change is taken
+    from the difference between its post-image and the previous one for the
+    same position, then placed at its (possibly backdated) timestamp. ``at``
+    bisects a position's timestamps, so an as-of lookup is O(log n) in that
+    position's history instead of a replay.
+    """
+
+    def __init__(self, opening=()):
+        self._history = {}  # key -> ([(micros, seq)], [running qty], [running value])
+        self._latest = {}  # key -> (qty, value) after its highest seq
+        self._by_outlet = {}
+        for outlet, sku, qty, unit_cost in opening:
+            # Balances that predate the event log count from the beginning of time
+            self._insert((outlet, sku), (to_micros(datetime.datetime.min), 0), qty, qty * unit_cost)
+
+    def add(self, event):
+        key = (event["outlet"], event["sku"])
+        qty = event["balance_qty"]
+        value = qty * event["balance_cost"]
+        prev_qty, prev_value = self._latest.get(key, (0, 0))
+        self._insert(key, (to_micros(event["timestamp"]), event["seq"]), qty - prev_qty, value - prev_value)
+
+    def _insert(self, key, point, qty, value):
+        history = self._history.get(key)
+        if history is None:
+            history = self._history[key] = ([], [], [])
+            self._by_outlet.setdefault(key[0], set()).add(key[1])
+        points, qtys, values = history
+        i = bisect.bisect_right(points, point)
+        points.insert(i, point)
+        qtys.insert(i, (qtys[i - 1] if i else 0) + qty)
+        values.insert(i, (values[i - 1] if i else 0) + value)
+        # Only backdated events have anything after them to shift
+        for j in range(i + 1, len(points)):
+            qtys[j] += qty
+            values[j] += value
+        latest_qty, latest_value = self._latest.get(key, (0, 0))
+        self._latest[key] = (latest_qty + qty, latest_value + value)
+
+    def at(self, key, when):
+        """(qty, value) of one position after every event up to ``when``."""
+        history = self._history.get(key)
+        if history is None:
+            return 0, 0
+        points, qtys, values = history
+        i = bisect.bisect_right(points, (to_micros(when), float("inf")))
+        return (qtys[i - 1], values[i - 1]) if i else (0, 0)
+
+    def keys(self, outlet=None):
+        if outlet is None:
+            return list(self._history)
+        return [(outlet, sku) for sku in self._by_outlet.get(outlet, ())]
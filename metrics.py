@@ -0,0 +1,145 @@
+import bisect
+import functools
+import json
+import threading
+import time
+from contextlib import nullcontext
+
+# Upper bounds in seconds, Prometheus-style; anything slower lands in +Inf
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NO_TIMER = nullcontext()
+
+
+class Histogram:
+    """Latency histogram over BUCKETS, plus count, sum and max."""
+
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        # Interpolated within the bucket holding the q-th observation, as
+        # Prometheus' histogram_quantile does; capped at the observed max
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+            "buckets": dict(zip([*map(str, BUCKETS), "+Inf"], self.counts)),
+        }
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class Metrics:
+    """Named latency histograms, off until ``enable()`` is called.
+
+    ``timer(name)`` (a context manager) and ``timed(name)`` (a decorator)
+    record how long a block or call took. While disabled they cost one
+    attribute check, so they can stay on the hot paths. Names are dotted
+    by kind, e.g. "flow.receive_po", "stage.costing", "render.Dashboard".
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def timer(self, name):
+        return _Timer(self, name) if self.enabled else _NO_TIMER
+
+    def timed(self, name):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def snapshot(self):
+        """{name: summary dict} of every histogram, sorted by name."""
+        with self._lock:
+            return {name: self._histograms[name].summary() for name in sorted(self._histograms)}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, metric="inventory_latency_seconds"):
+        """Prometheus text exposition format, one histogram series per name."""
+        lines = [f"# HELP {metric} Latency of flows, stages and renders.", f"# TYPE {metric} histogram"]
+        for name, summary in self.snapshot().items():
+            cumulative = 0
+            for bound, count in summary["buckets"].items():
+                cumulative += count
+                lines.append(f'{metric}_bucket{{name="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{name="{name}"}} {summary["sum"]:.9f}')
+            lines.append(f'{metric}_count{{name="{name}"}} {summary["count"]}')
+        return "\n".join(lines) + "\n"
+
+
+# Shared by utils, pdf_jobs, api.py and app.py; utils enables it when METRICS is set
+metrics = Metrics()
+timer = metrics.timer
+timed = metrics.timed
@@ -1,21 +1,241 @@
-from datetime import datetime, timedelta
+from array import array
+from datetime import datetime
 
-class PurchaseOrder:
-    def __init__(self, po_id, outlet, items):
+from catalog import Codes
+
+NAN = float("nan")
+
+# SKU codes shared by the line items of every order
+_skus = Codes()
+intern_sku = _skus.code
+
+
+def sku_name(code):
+    return _skus[code]
+
+
+class LineItems:
+    """Order lines as parallel typed arrays: SKU code, qty and unit cost.
+
+    Reads like the old list of ``{"sku", "qty", "unit_cost"}`` dicts, but
+    each line is built as a fresh dict when accessed, so changing that dict
+    does not change the order. Lines without a cost (TO lines) store NaN
+    and come back without a ``unit_cost`` key.
+    """
+
+    __slots__ = ("sku_codes", "qty", "unit_cost")
+
+    def __init__(self, items=()):
+        self.sku_codes = array("i")
+        self.qty = array("q")
+        self.unit_cost = array("d")
+        for item in items:
+            self.append(item)
+
+    def append(self, item):
+        self.sku_codes.append(intern_sku(item["sku"]))
+        self.qty.append(item["qty"])
+        self.unit_cost.append(item.get("unit_cost", NAN))
+
+    def __len__(self):
+        return len(self.sku_codes)
+
+    def _line(self, i):
+        line = {"sku": _skus[self.sku_codes[i]], "qty": self.qty[i]}
+        cost = self.unit_cost[i]
+        if cost == cost:
+            line["unit_cost"] = cost
+        return line
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._line(j) for j in range(len(self))[i]]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("line index out of range")
+        return self._line(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._line(i)
+
+    def skus(self):
+        return [_skus[code] for code in self.sku_codes]
+
+    def to_dict(self):
+        return list(self)
+
+
+class _Order:
+    """Dict-style access (``order["status"]``, ``get``, ``in``) to a slotted order.
+
+    Only the keys in ``FIELDS`` exist; fields that are still None read as
+    missing, the way an absent dict key did.
+    """
+
+    __slots__ = ()
+    FIELDS = ()
+
+    def __getitem__(self, key):
+        value = getattr(self, key) if key in self.FIELDS else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.FIELDS and getattr(self, key) is not None
+
+    def get(self, key, default=None):
+        value = getattr(self, key) if key in self.FIELDS else None
+        return default if value is None else value
+
+    def keys(self):
+        return [key for key in self.FIELDS if getattr(self, key) is not None]
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.keys()}
+
+    @property
+    def items(self):
+        return self._items
+
+    @items.setter
+    def items(self, items):
+        self._items = items if isinstance(items, LineItems) else LineItems(items)
+
+
+class PurchaseOrder(_Order):
+    __slots__ = ("po_id", "outlet", "_items", "status", "created_at", "updated_at")
+    FIELDS = ("po_id", "outlet", "items", "status", "created_at", "updated_at")
+
+    def __init__(self, po_id, outlet, items, status="Draft", created_at=None):
         self.po_id = po_id
         self.outlet = outlet
-        self.items = items  # list of {"sku": ..., "qty": ...}
-        self.status = "Draft"
-        self.created_at = datetime.now()
+        self.items = items  # list of {"sku": ..., "qty": ..., "unit_cost": ...}
+        self.status = status
+        self.created_at = created_at or datetime.now()
         self.updated_at = datetime.now()
 
-class TransferOrder:
-    def __init__(self, to_id, source, destination, items):
+    @classmethod
+    def from_dict(cls, data):
+        po = cls(data["po_id"], data["outlet"], data["items"], data.get("status", "Draft"), data.get("created_at"))
+        po.updated_at = data.get("updated_at", po.updated_at)
+        return po
+
+
+class TransferOrder(_Order):
+    """A transfer, with requested, fulfilled and received qty kept per line.
+
+    Every SKU is tracked on its first line (a SKU listed twice has its qty
+    summed there). Order totals (``requested_qty``, ``fulfilled_qty``,
+    ``received_qty``) and the number of lines still short of their
+    requested qty are updated as movements are recorded with
+    ``add_fulfilled``/``add_received``, so ``fully_received`` and
+    ``in_transit_qty`` never rescan the lines.
+    ``fulfilled_qty_dict``/``received_qty_dict`` are read-only {sku: qty}
+    views.
+    """
+
+    __slots__ = ("to_id", "source", "destination", "_items", "status", "created_at", "updated_at",
+                 "requested_qty", "fulfilled_qty", "received_qty", "requested_lines", "fulfilled_lines",
+                 "received_lines", "_line_of", "_unfulfilled", "_unreceived")
+    FIELDS = ("to_id", "source", "destination", "items", "status", "created_at", "updated_at",
+              "requested_qty", "fulfilled_qty", "received_qty", "fulfilled_qty_dict", "received_qty_dict")
+
+    def __init__(self, to_id, source, destination, items, status="Draft", created_at=None):
         self.to_id = to_id
         self.source = source
         self.destination = destination
         self.items = items
-        self.status = "Draft"
-        self.created_at = datetime.now()
+        self.status = status
+        self.created_at = created_at or datetime.now()
         self.updated_at = datetime.now()
-        self.received = []
+        self._line_of = {}
+        self.requested_lines = array("q", bytes(8 * len(self.items)))
+        for i, (code, qty) in enumerate(zip(self.items.sku_codes, self.items.qty)):
+            self.requested_lines[self._line_of.setdefault(code, i)] += qty
+        self.fulfilled_lines = array("q", bytes(8 * len(self.items)))
+        self.received_lines = array("q", bytes(8 * len(self.items)))
+        self.requested_qty = sum(self.requested_lines)
+        self.fulfilled_qty = 0
+        self.received_qty = 0
+        self._unfulfilled = self._unreceived = sum(1 for qty in self.requested_lines if qty > 0)
+
+    @classmethod
+    def from_dict(cls, data):
+        # fulfilled_qty / received_qty in older data were not kept up to
+        # date; the totals are rebuilt from the per-SKU dicts
+        to = cls(data["to_id"], data["source"], data["destination"], data["items"],
+                 data.get("status", "Draft"), data.get("created_at"))
+        to.updated_at = data.get("updated_at", to.updated_at)
+        for sku, qty in data.get("fulfilled_qty_dict", {}).items():
+            to.add_fulfilled(sku, qty)
+        for sku, qty in data.get("received_qty_dict", {}).items():
+            to.add_received(sku, qty)
+        return to
+
+    def _line_index(self, sku):
+        try:
+            return self._line_of[intern_sku(sku)]
+        except KeyError:
+            raise ValueError(f"{sku} is not on {self.to_id}") from None
+
+    def add_fulfilled(self, sku, qty):
+        i = self._line_index(sku)
+        before, requested = self.fulfilled_lines[i], self.requested_lines[i]
+        self.fulfilled_lines[i] = before + qty
+        self.fulfilled_qty += qty
+        self._unfulfilled += (before + qty < requested) - (before < requested)
+
+    def add_received(self, sku, qty):
+        i = self._line_index(sku)
+        before, requested = self.received_lines[i], self.requested_lines[i]
+        self.received_lines[i] = before + qty
+        self.received_qty += qty
+        self._unreceived += (before + qty < requested) - (before < requested)
+
+    @property
+    def fully_fulfilled(self):
+        return self._unfulfilled == 0
+
+    @property
+    def fully_received(self):
+        return self._unreceived == 0
+
+    @property
+    def in_transit_qty(self):
+        """Units fulfilled (shipped on a DO) and not yet received."""
+        return self.fulfilled_qty - self.received_qty
+
+    def progress(self):
+        """Per-SKU counters, in line order: sku, requested, fulfilled, received,
+        in_transit (fulfilled - received) and unfulfilled (requested - fulfilled)."""
+        return [{
+            "sku": _skus[self.items.sku_codes[i]],
+            "requested": self.requested_lines[i],
+            "fulfilled": self.fulfilled_lines[i],
+            "received": self.received_lines[i],
+            "in_transit": self.fulfilled_lines[i] - self.received_lines[i],
+            "unfulfilled": self.requested_lines[i] - self.fulfilled_lines[i],
+        } for i in self._line_of.values()]
+
+    def _by_sku(self, lines):
+        totals = {}
+        for code, qty in zip(self.items.sku_codes, lines):
+            sku = _skus[code]
+            totals[sku] = totals.get(sku, 0) + qty
+        return totals
+
+    @property
+    def fulfilled_qty_dict(self):
+        return self._by_sku(self.fulfilled_lines)
+
+    @property
+    def received_qty_dict(self):
+        return self._by_sku(self.received_lines)
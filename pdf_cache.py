@@ -0,0 +1,80 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class PdfCache:
+    """LRU cache of rendered PDF bytes, bounded by total size.
+
+    Keys are content digests of the document being rendered, so an entry can
+    never go stale. When ``spill_dir`` is set, PDFs evicted from memory are
+    written there under their digest and read back on a later miss instead of
+    being rendered again.
+    """
+
+    def __init__(self, max_bytes, spill_dir=None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, key[:2], f"{key}.pdf")
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._entries:
+                return True
+        return self.spill_dir is not None and os.path.exists(self._spill_path(key))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            pdf = self._entries.get(key)
+            if pdf is not None:
+                self._entries.move_to_end(key)
+                return pdf
+        if self.spill_dir is None:
+            return default
+        try:
+            with open(self._spill_path(key), "rb") as f:
+                pdf = f.read()
+        except FileNotFoundError:
+            return default
+        self.put(key, pdf)
+        return pdf
+
+    def put(self, key, pdf):
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= len(self._entries.pop(key))
+            self._entries[key] = pdf
+            self.nbytes += len(pdf)
+            evicted = []
+            while self.nbytes > self.max_bytes and self._entries:
+                old_key, old_pdf = self._entries.popitem(last=False)
+                self.nbytes -= len(old_pdf)
+                evicted.append((old_key, old_pdf))
+        for old_key, old_pdf in evicted:
+            self._spill(old_key, old_pdf)
+
+    def _spill(self, key, pdf):
+        if self.spill_dir is None:
+            return
+        path = self._spill_path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(pdf)
+        os.replace(tmp_path, path)
+
+    def clear(self):
+        # Spilled files are content-addressed and stay valid, so only memory is dropped
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
@@ -0,0 +1,97 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import metrics
+from pdf_render import render_pdf
+
+
+class PdfJobQueue:
+    """Renders document PDFs in a worker process pool, off the request path.
+
+    ``submit`` returns a future as soon as the job is queued and
+    ``on_ready(key, pdf)`` is called from the pool's result thread once the
+    PDF bytes are rendered. With ``max_workers=0`` rendering happens inline
+    instead, which keeps scripts and benchmarks deterministic. Each job's
+    time from submit to ready (queueing included) is recorded as "pdf.render";
+    "pdf.render_pdf" times the drawing itself, but only for inline renders,
+    since pool workers keep their own metrics.
+    """
+
+    def __init__(self, max_workers=None, on_ready=None):
+        self.max_workers = max_workers
+        self.on_ready = on_ready
+        self._executor = None
+        self._pending = {}
+        self._failed = {}
+        self._lock = threading.Condition()
+
+    def _get_executor(self):
+        # Started lazily so importing utils never spawns processes
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def submit(self, key, doc_id, ref, outlet, items, doc_type):
+        started = time.perf_counter()
+        if self.max_workers == 0:
+            future = Future()
+            try:
+                future.set_result(render_pdf(doc_id, ref, outlet, items, doc_type))
+            except Exception as error:
+                future.set_exception(error)
+            self._finish(key, started, future)
+            return future
+
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            self._failed.pop(key, None)
+            try:
+                future = self._get_executor().submit(render_pdf, doc_id, ref, outlet, items, doc_type)
+            except BrokenProcessPool:
+                # A worker died; start a fresh pool rather than failing every later job
+                self._executor = None
+                future = self._get_executor().submit(render_pdf, doc_id, ref, outlet, items, doc_type)
+            self._pending[key] = future
+        future.add_done_callback(lambda done: self._finish(key, started, done))
+        return future
+
+    def _finish(self, key, started, future):
+        metrics.observe("pdf.render", time.perf_counter() - started)
+        error = future.exception()
+        if error is None:
+            self.on_ready(key, future.result())
+        with self._lock:
+            if error is not None:
+                self._failed[key] = error
+            # Only drop the job once on_ready has stored the PDF, so callers
+            # never see a document that is neither pending nor ready
+            self._pending.pop(key, None)
+            self._lock.notify_all()
+
+    def status(self, key):
+        with self._lock:
+            if key in self._pending:
+                return "pending"
+            if key in self._failed:
+                return "failed"
+        return None
+
+    def error(self, key):
+        return self._failed.get(key)
+
+    def wait(self, timeout=None):
+        # Block until every queued job has finished; False on timeout
+        with self._lock:
+            return self._lock.wait_for(lambda: not self._pending, timeout)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
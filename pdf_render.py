@@ -0,0 +1,46 @@
+from io import BytesIO
+from reportlab.pdfgen import canvas
+
+from metrics import timed
+
+
+@timed("pdf.render_pdf")
+def render_pdf(doc_id, ref, outlet, items, doc_type):
+    buffer = BytesIO()
+    p = canvas.Canvas(buffer)
+    p.setFont("Helvetica-Bold", 14)
+    p.drawString(100, 800, f"{doc_type} DOCUMENT")
+    p.setFont("Helvetica", 12)
+    p.drawString(100, 780, f"Document ID: {doc_id}")
+    p.drawString(100, 765, f"Reference: {ref}")
+    p.drawString(100, 750, f"Outlet: {outlet}")
+
+    y = 720
+    p.setFont("Helvetica-Bold", 11)
+    p.drawString(100, y, "SKU")
+    p.drawString(220, y, "Qty")
+    p.drawString(300, y, "Unit Cost")
+    p.drawString(400, y, "Total Cost")
+    y -= 18
+    p.setFont("Helvetica", 11)
+
+    for item in items:
+        sku = item['sku']
+        qty = item['qty']
+        unit_cost = item.get('unit_cost', 0)
+        total_cost = qty * unit_cost
+        p.drawString(100, y, str(sku))
+        p.drawString(220, y, str(qty))
+        p.drawString(300, y, f"RM {unit_cost:.2f}")
+        p.drawString(400, y, f"RM {total_cost:.2f}")
+        if item.get("reason"):
+            p.drawString(500, y, f"{item['reason']}")
+        y -= 16
+        if y < 50:  # Start new page if needed
+            p.showPage()
+            y = 800
+    p.showPage()
+    p.save()
+    pdf = buffer.getvalue()
+    buffer.close()
+    return pdf
@@ -0,0 +1,62 @@
+"""Manual adjustments and backdated receipts replay to the same positions as the ledger."""
+import datetime
+import io
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("PDF_WORKERS", "0")
+
+import utils  # noqa: E402
+
+
+def test_adjustments_reconcile():
+    utils.clear_all()
+    utils.adjust_stock("OutletA", "MILK2002", 5, 2.0)
+    assert utils.reconcile_inventory().empty
+
+    po = utils.add_po({"po_id": utils.generate_po_id(), "outlet": "Warehouse1", "status": "Receiving",
+                       "items": [{"sku": "MILK2002", "qty": 10, "unit_cost": 3.0}]})
+    utils.receive_po(po)
+    utils.adjust_stock("Warehouse1", "MILK2002", 4, 2.5)  # down, and revalued
+    utils.adjust_stock_batch("OutletA", [("MILK2002", 2, 2.0), ("BREAD1001", 3, 1.0)])
+    utils.import_opening_stock(io.StringIO("outlet,sku,qty,unit_cost\nOutletB,MILK2002,8,1.5\n"), "csv")
+
+    assert utils.reconcile_inventory().empty
+    replayed = utils.replay_inventory().set_index(["outlet", "sku"])
+    assert replayed.loc[("Warehouse1", "MILK2002"), "qty"] == 4
+    assert replayed.loc[("Warehouse1", "MILK2002"), "unit_cost"] == 2.5
+
+
+def _receive(outlet, qty, unit_cost, when):
+    po = utils.add_po({"po_id": utils.generate_po_id(), "outlet": outlet, "status": "Receiving",
+                       "items": [{"sku": "MILK2002", "qty": qty, "unit_cost": unit_cost}]})
+    utils.receive_po(po, date_override=when)
+
+
+def test_adjustment_before_receipt_dated_today():
+    # The receipt's midnight timestamp sorts before the adjustment made just now
+    utils.clear_all()
+    utils.adjust_stock("OutletA", "MILK2002", 5, 2.0)
+    _receive("OutletA", 10, 3.0, datetime.date.today())
+
+    assert utils.reconcile_inventory().empty
+    replayed = utils.replay_inventory().set_index(["outlet", "sku"])
+    assert replayed.loc[("OutletA", "MILK2002"), "qty"] == 15
+    assert abs(replayed.loc[("OutletA", "MILK2002"), "unit_cost"] - 40 / 15) < 1e-9
+
+
+def test_backdated_receipt_after_issue():
+    utils.clear_all()
+    today = datetime.datetime.now()
+    _receive("Warehouse1", 10, 3.0, today)
+    to = utils.add_to({"to_id": utils.generate_to_id(), "source": "Warehouse1", "destination": "OutletA",
+                       "status": "Processing", "items": [{"sku": "MILK2002", "qty": 5}]})
+    utils.fulfill_to(to, {"MILK2002": 5}, today)
+    _receive("Warehouse1", 10, 4.0, today - datetime.timedelta(days=1))
+
+    assert utils.reconcile_inventory().empty
+    replayed = utils.replay_inventory().set_index(["outlet", "sku"])
+    assert replayed.loc[("Warehouse1", "MILK2002"), "qty"] == 15
+    assert abs(replayed.loc[("Warehouse1", "MILK2002"), "unit_cost"] - 55 / 15) < 1e-9
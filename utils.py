@@ -1,113 +1,952 @@
+import bisect
 import datetime
-import base64
-from io import BytesIO
-from reportlab.pdfgen import canvas
+import functools
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+import bulk_io
+import costing
+from catalog import Codes, SearchIndex
+from cost_store import COLUMNS as COST_COLUMNS, IN_TRANSIT, CostHistory
+from data_store import MemoryStore, SQLiteStore, dumps
+from events import BalanceIndex, EventLog, replay as replay_events
+from locks import KeyLocks
+from metrics import metrics, timed
+from models import PurchaseOrder, TransferOrder
+from pdf_cache import PdfCache
+from pdf_jobs import PdfJobQueue
+
+
+# Inventory ledger
+class InventoryLedger:
+    """Stock positions as a sparse (COO) qty / unit-cost matrix.
+
+    Outlets and SKUs are interned to row and column ids (``outlets``,
+    ``skus``). Each position owns one slot in parallel numpy arrays of row
+    id, column id, qty and unit cost, so totals per outlet, per SKU or
+    network-wide are array reductions, and memory follows the number of
+    positions rather than outlets x SKUs. Reads behave like the old
+    ``inventory`` dict (``get``, ``in``, ``items``, ``[key]``) but return
+    position dicts built from the arrays; writes must go through ``set``,
+    which is safe to call from several threads. Iteration works on a copy
+    of the keys taken under the same lock, so it never sees a half-added
+    position.
+    """
+
+    def __init__(self):
+        self.outlets = Codes()
+        self.skus = Codes()
+        self._lock = threading.Lock()
+        self.clear()
+
+    def _position(self, slot):
+        return {"qty": int(self.qty[slot]), "unit_cost": float(self.unit_cost[slot])}
+
+    def _positions(self, slots, codes, names):
+        # {name: position} for a list of slots, read in bulk
+        slots = np.asarray(slots, dtype=np.int64)
+        return {names[code]: {"qty": qty, "unit_cost": unit_cost} for code, qty, unit_cost in zip(
+            codes[slots].tolist(), self.qty[slots].tolist(), self.unit_cost[slots].tolist())}
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def __getitem__(self, key):
+        return self._position(self._slots[key])
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._slots))
+
+    def __len__(self):
+        return len(self._slots)
+
+    def get(self, key, default=None):
+        slot = self._slots.get(key)
+        return default if slot is None else self._position(slot)
+
+    def items(self):
+        with self._lock:
+            slots = list(self._slots.items())
+        for key, slot in slots:
+            yield key, self._position(slot)
+
+    def rows(self):
+        """[outlet, sku, qty, unit_cost] for every position, read in bulk from the arrays."""
+        with self._lock:
+            # Slots are handed out in insertion order, matching the dict's key order
+            keys = list(self._slots)
+            qty, unit_cost = self.qty[:len(keys)].tolist(), self.unit_cost[:len(keys)].tolist()
+        return [[outlet, sku, q, c] for (outlet, sku), q, c in zip(keys, qty, unit_cost)]
+
+    def set(self, key, qty, unit_cost):
+        # Held briefly so a new slot or a growing array never loses a write
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = len(self._slots)
+                if slot == len(self.qty):
+                    for name in ("row", "col", "qty", "unit_cost"):
+                        old = getattr(self, name)
+                        setattr(self, name, np.concatenate([old, np.zeros_like(old)]))
+                row, col = self.outlets.code(key[0]), self.skus.code(key[1])
+                self.row[slot] = row
+                self.col[slot] = col
+                self._slots[key] = slot
+                self._by_outlet.setdefault(row, []).append(slot)
+                self._by_sku.setdefault(col, []).append(slot)
+            self.qty[slot] = qty
+            self.unit_cost[slot] = unit_cost
+            return self._position(slot)
+
+    def skus_for(self, outlet):
+        # {sku: position} for one outlet
+        with self._lock:
+            slots = list(self._by_outlet.get(self.outlets.get(outlet), ()))
+        return self._positions(slots, self.col, self.skus) if slots else {}
+
+    def outlets_for(self, sku):
+        # {outlet: position} for one SKU
+        with self._lock:
+            slots = list(self._by_sku.get(self.skus.get(sku), ()))
+        return self._positions(slots, self.row, self.outlets) if slots else {}
+
+    def outlet_totals(self, outlet):
+        with self._lock:
+            slots = np.array(self._by_outlet.get(self.outlets.get(outlet), ()), dtype=np.int64)
+        qty = self.qty[slots]
+        return {"qty": int(qty.sum()), "value": float(qty @ self.unit_cost[slots])}
+
+    def network_totals(self):
+        """Units and value on hand across every outlet."""
+        n = len(self._slots)
+        qty = self.qty[:n]
+        return {"qty": int(qty.sum()), "value": float(qty @ self.unit_cost[:n])}
+
+    def sku_totals(self):
+        """DataFrame of network-wide qty and value per SKU."""
+        n = len(self._slots)
+        col, qty = self.col[:n], self.qty[:n]
+        return pd.DataFrame({
+            "sku": list(self.skus),
+            "qty": np.bincount(col, weights=qty, minlength=len(self.skus)).astype(np.int64),
+            "value": np.bincount(col, weights=qty * self.unit_cost[:n], minlength=len(self.skus)),
+        })
+
+    def clear(self):
+        self.outlets.clear()
+        self.skus.clear()
+        self._slots = {}  # (outlet, sku) -> slot
+        self._by_outlet = {}  # row id -> [slot]
+        self._by_sku = {}  # column id -> [slot]
+        self.row = np.zeros(1024, dtype=np.int32)
+        self.col = np.zeros(1024, dtype=np.int32)
+        self.qty = np.zeros(1024, dtype=np.int64)
+        self.unit_cost = np.zeros(1024, dtype=np.float64)
+
+
+def _as_datetime(value):
+    # Flow dates come from st.date_input (date) or now() (datetime)
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.combine(value, datetime.time.min)
+
+
+# Document index
+class DocumentIndex:
+    """Documents indexed by id, type, outlet, ref and timestamp.
+
+    ``query`` pages through matches newest first. Every type, outlet and
+    (type, outlet) pair keeps its own sorted timeline, so without a ref
+    filter a page costs O(page size) however many documents exist; a ref
+    only has a handful of documents and those are sorted per query.
+    ``add`` and ``query`` hold the index lock, so a query never sees a
+    document in one timeline and not yet in another.
+
+    After ``keep_in_store`` documents already in the store are indexed but
+    their contents stay there until ``get`` or a query page returns them.
+    """
+
+    def __init__(self):
+        self._by_id = {}  # doc_id -> document, None while it is only in _store
+        self._info = {}  # doc_id -> (doc type, outlets)
+        self._store = None
+        self._by_type = {}  # doc type -> timeline
+        self._by_outlet = {}  # outlet or warehouse -> timeline
+        self._by_type_outlet = {}  # (doc type, outlet) -> timeline
+        self._by_ref = {}  # ref -> {doc_id}
+        self._entries = {}
+        self._timeline = []  # sorted (timestamp, seq, doc_id)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def get(self, doc_id):
+        return self._docs([doc_id])[0] if doc_id in self._by_id else None
+
+    def add(self, doc):
+        with self._lock:
+            self._index(doc["doc_id"], doc["type"], doc["ref"], {doc.get("outlet"), doc.get("warehouse")} - {None},
+                        doc["timestamp"], doc)
+
+    def keep_in_store(self, store):
+        """Start over from the documents in ``store``, indexing them without reading their contents."""
+        self.clear()
+        with self._lock:
+            self._store = store
+            for doc_id, doc_type, ref, outlets, timestamp in store.document_entries():
+                self._index(doc_id, doc_type, ref, outlets, timestamp, None)
+
+    def _index(self, doc_id, doc_type, ref, outlets, timestamp, doc):
+        self._by_id[doc_id] = doc
+        self._info[doc_id] = (doc_type, outlets)
+        entry = (_as_datetime(timestamp), len(self._by_id), doc_id)
+        self._entries[doc_id] = entry
+        bisect.insort(self._timeline, entry)
+        bisect.insort(self._by_type.setdefault(doc_type, []), entry)
+        for outlet in outlets:
+            bisect.insort(self._by_outlet.setdefault(outlet, []), entry)
+            bisect.insort(self._by_type_outlet.setdefault((doc_type, outlet), []), entry)
+        self._by_ref.setdefault(ref, set()).add(doc_id)
+
+    def _docs(self, doc_ids):
+        # The documents, reading any that are still only in the store
+        missing = [doc_id for doc_id in doc_ids if self._by_id.get(doc_id) is None]
+        if missing:
+            loaded = self._store.load_documents(missing)
+            with self._lock:
+                for doc_id, doc in loaded.items():
+                    if doc_id in self._by_id and self._by_id[doc_id] is None:
+                        self._by_id[doc_id] = doc
+        return [self._by_id.get(doc_id) for doc_id in doc_ids]
+
+    def _matches(self, doc_id, doc_type, outlet):
+        kind, outlets = self._info[doc_id]
+        return (not doc_type or kind == doc_type) and (not outlet or outlet in outlets)
+
+    def query(self, doc_type=None, outlet=None, ref=None, start=None, end=None, offset=0, limit=20):
+        """(total matches, one page of documents) for the given filters.
+
+        ``start`` and ``end`` are inclusive dates.
+        """
+        start = _as_datetime(start) if start else None
+        end = _as_datetime(end + datetime.timedelta(days=1)) if end else None
+
+        with self._lock:
+            if ref:
+                timeline = sorted(map(self._entries.get, self._by_ref.get(ref, ())))
+            elif doc_type and outlet:
+                timeline = self._by_type_outlet.get((doc_type, outlet), [])
+            elif doc_type:
+                timeline = self._by_type.get(doc_type, [])
+            elif outlet:
+                timeline = self._by_outlet.get(outlet, [])
+            else:
+                timeline = self._timeline
+            lo = bisect.bisect_left(timeline, (start,)) if start else 0
+            hi = bisect.bisect_left(timeline, (end,)) if end else len(timeline)
+
+            if not ref:
+                total = max(hi - lo, 0)
+                newest = timeline[max(hi - offset - limit, lo):max(hi - offset, lo)]
+                page = [doc_id for _, _, doc_id in reversed(newest)]
+            else:
+                matches = [doc_id for _, _, doc_id in timeline[lo:hi] if self._matches(doc_id, doc_type, outlet)]
+                total, page = len(matches), matches[::-1][offset:offset + limit]
+        return total, self._docs(page)
+
+    def clear(self):
+        with self._lock:
+            self._by_id.clear()
+            self._info.clear()
+            self._store = None
+            self._by_type.clear()
+            self._by_outlet.clear()
+            self._by_type_outlet.clear()
+            self._by_ref.clear()
+            self._entries.clear()
+            self._timeline.clear()
+
+
+# Order registry
+class OrderRegistry:
+    """Orders of one kind, by id and bucketed by status.
+
+    Iterates in creation order like the old ``po_list``/``to_list`` lists;
+    ``with_status`` only touches the orders in the requested states. Status
+    changes must go through ``set_status`` so the buckets stay in step.
+    Orders given as dicts are converted to ``model`` on the way in.
+
+    After ``keep_in_store`` only open orders are held; Completed ones are
+    counted and read from the store when looked up or listed.
+    """
+
+    def __init__(self, id_field, model):
+        self.id_field = id_field
+        self.model = model
+        self._by_id = {}
+        self._by_status = {}  # status -> {order_id: order}
+        self._lock = threading.Lock()
+        self._store = None
+        self._kind = None
+        self._stored = 0  # Completed orders still only in _store
+
+    def __contains__(self, order_id):
+        return self.get(order_id) is not None
+
+    def __iter__(self):
+        # Over a copy, so orders added meanwhile cannot break the loop
+        self._load_stored()
+        with self._lock:
+            return iter(list(self._by_id.values()))
+
+    def __len__(self):
+        return len(self._by_id) + self._stored
+
+    def get(self, order_id, default=None):
+        order = self._by_id.get(order_id)
+        if order is None and self._stored:
+            for stored in self._store.load_orders(self._kind, completed=True, order_id=order_id):
+                with self._lock:
+                    order = self._by_id.get(order_id)
+                    if order is None and self._stored:
+                        order = self._by_id[order_id] = self.model.from_dict(stored)
+                        self._by_status.setdefault(order["status"], {})[order_id] = order
+                        self._stored -= 1
+        return default if order is None else order
+
+    def keep_in_store(self, store, kind):
+        """Start over from the ``kind`` ("PO" or "TO") orders in ``store``, leaving Completed ones there."""
+        self.clear()
+        for order in store.load_orders(kind):
+            self.add(order)
+        with self._lock:
+            self._store, self._kind = store, kind
+            self._stored = len(store.order_ids(kind, "Completed"))
+
+    def _load_stored(self):
+        # Read every Completed order still in the store, then put all orders
+        # back in creation (store) order
+        if not self._stored:
+            return
+        stored = self._store.load_orders(self._kind, completed=True)
+        rank = {order_id: i for i, order_id in enumerate(self._store.order_ids(self._kind))}
+        with self._lock:
+            if not self._stored:
+                return
+            for order in stored:
+                self._by_id.setdefault(order[self.id_field], self.model.from_dict(order))
+            self._by_id = dict(sorted(self._by_id.items(), key=lambda item: rank.get(item[0], len(rank))))
+            self._by_status = {}
+            for order_id, order in self._by_id.items():
+                self._by_status.setdefault(order["status"], {})[order_id] = order
+            self._stored = 0
+
+    def add(self, order):
+        """Register an order (a model or a dict); returns the model."""
+        if isinstance(order, dict):
+            order = self.model.from_dict(order)
+        order_id = order[self.id_field]
+        with self._lock:
+            self._by_id[order_id] = order
+            self._by_status.setdefault(order["status"], {})[order_id] = order
+        return order
+
+    append = add
+
+    def set_status(self, order, status):
+        order_id = order[self.id_field]
+        with self._lock:
+            bucket = self._by_status.get(order["status"])
+            if bucket is not None:
+                bucket.pop(order_id, None)
+                if not bucket:
+                    del self._by_status[order["status"]]
+            order["status"] = status
+            self._by_status.setdefault(status, {})[order_id] = order
+
+    def with_status(self, *statuses):
+        if "Completed" in statuses:
+            self._load_stored()
+        with self._lock:
+            return [order for status in statuses for order in self._by_status.get(status, {}).values()]
+
+    def counts(self):
+        with self._lock:
+            counts = {status: len(bucket) for status, bucket in self._by_status.items()}
+            if self._stored:
+                counts["Completed"] = counts.get("Completed", 0) + self._stored
+            return counts
+
+    def clear(self):
+        with self._lock:
+            self._by_id.clear()
+            self._by_status.clear()
+            self._store = None
+            self._kind = None
+            self._stored = 0
+
 
 # Data stores
-po_list = []
-to_list = []
-cost_history = []
-inventory = {}
+po_list = OrderRegistry("po_id", PurchaseOrder)
+to_list = OrderRegistry("to_id", TransferOrder)
+cost_history = CostHistory(os.environ.get("COST_PARTITION", "month"))  # "day" or "month"
+inventory = InventoryLedger()
 item_master = {}
-sku_list = ["MILK2002", "BREAD1001"]
-outlet_list = ["OutletA", "OutletB", "Warehouse1", "Warehouse2"]
+sku_list = Codes(["MILK2002", "BREAD1001"])  # list-like, O(1) ``in``
+sku_search = SearchIndex(sku_list)
+outlet_list = Codes(["OutletA", "OutletB", "Warehouse1", "Warehouse2"])
 
 # Set your warehouse name as per your outlet_list
 WAREHOUSE_NAME = "Warehouse1"  # Use the exact warehouse name from your system
 returns_inventory = {}  # key: (warehouse, sku), value: {qty, unit_cost, reasons: [str]}
 
-
-
+# Every change to inventory and returns_inventory, snapshotted every
+# SNAPSHOT_EVERY events so any state can be rebuilt from a bounded tail
+event_log = EventLog(snapshot_every=int(os.environ.get("SNAPSHOT_EVERY", 1000)))
+_balances = None  # BalanceIndex over event_log, built on the first as-of query
 
 # Document stores
 doc_counters = {"PO": 0, "TO": 0, "DO": 0, "GRN": 0, "TN": 0, "RN": 0}
-documents = {"DO": [], "GRN": [], "TN": [], "RN": []}
+document_index = DocumentIndex()
+
+# Rendered PDFs, keyed by document content digest. Bounded by PDF_CACHE_BYTES;
+# PDF_CACHE_DIR lets evicted PDFs spill to disk instead of being re-rendered.
+doc_storage = PdfCache(
+    max_bytes=int(os.environ.get("PDF_CACHE_BYTES", 64 * 1024 * 1024)),
+    spill_dir=os.environ.get("PDF_CACHE_DIR") or None,
+)
+
+# Persistence backend, see configure_store
+_store = MemoryStore()
+
+# Concurrency: Streamlit runs every session in its own thread against these
+# module-level objects. Flows lock the positions and orders they touch
+# (_locks, always first), then open a store transaction, then take
+# _state_lock only for the moment they append to the shared logs and
+# counters. Flows on different positions run side by side.
+_locks = KeyLocks()
+_state_lock = threading.RLock()
+
+# Bumped by every mutation; derived views are memoized per version
+_state_version = 0
+_views = {}  # (view name, *args) -> value computed at the current version
+
+# Latency histograms of the flows and their stages; off unless METRICS is set
+# (or switched on from the diagnostics tab)
+if os.environ.get("METRICS"):
+    metrics.enable()
+
+
+def get_store():
+    return _store
+
+
+def configure_store(store):
+    """Switch the persistence backend and load any state it already holds.
+
+    The module-level containers are refilled in place because ``app.py``
+    binds them once via ``from utils import *``.
+    """
+    global _store, _balances
+    _store = store
+    _balances = None
+    _bump_version()
+    state = store.load()
+    if not state:
+        return
+
+    # Completed orders, document contents and cost events stay in the store
+    # until something reads them
+    po_list.keep_in_store(store, "PO")
+    to_list.keep_in_store(store, "TO")
+    document_index.keep_in_store(store)
+    cost_history.keep_in_store(store)
+    snapshot_seq, snapshot, tail = state["stock"]
+    positions, returns = replay_events(snapshot, tail)
+    inventory.clear()
+    for key, position in positions.items():
+        inventory.set(key, position["qty"], position["unit_cost"])
+    returns_inventory.clear()
+    returns_inventory.update(returns)
+    event_log.load(snapshot_seq, snapshot, tail)
+    doc_counters.update(state["doc_counters"])
+    item_master.update(state["item_master"])
+    sku_list.extend(state["item_master"])
+    outlet_list.extend(state["outlets"])
+    _bump_version()
+
+
+def state_version():
+    """Counter that changes whenever any order, stock, cost or master data changes."""
+    return _state_version
+
+
+def _bump_version():
+    global _state_version
+    with _state_lock:
+        _state_version += 1
+        _views.clear()
+
+
+def _view(func):
+    # Memoize a derived view until the next mutation. Results are shared
+    # between callers and reruns, so they must be treated as read-only.
+    @functools.wraps(func)
+    def wrapper(*args):
+        key = (func.__name__,) + args
+        try:
+            return _views[key]
+        except KeyError:
+            pass
+        version = _state_version
+        value = func(*args)
+        # Mutations bump the version once their change is made, so a value
+        # computed across one is never stored
+        with _state_lock:
+            if version == _state_version:
+                _views[key] = value
+        return value
+    return wrapper
+
+
+@contextmanager
+def _unit_of_work(keys):
+    """Lock ``keys`` ((outlet, sku) positions, ("order", id)), then open a store transaction."""
+    started = time.perf_counter()
+    with _locks.hold(keys):
+        metrics.observe("stage.lock_wait", time.perf_counter() - started)
+        with _store.transaction():
+            yield
+
+
+def _in_transaction(keys_of):
+    # Run a flow function as one unit of work; ``keys_of(*args)`` names
+    # every position and order it will read or write
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _unit_of_work(keys_of(*args, **kwargs)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _stock_state():
+    return {
+        "inventory": inventory.rows(),
+        "returns": [[warehouse, sku, entry["qty"], entry["unit_cost"], list(entry["reasons"])]
+                    for (warehouse, sku), entry in returns_inventory.items()],
+    }
+
 
-doc_storage = {}
+@timed("stage.event_append")
+def _record_event(event, apply):
+    # The store numbers and keeps the event first; ``apply`` then makes the
+    # change in memory, so a failed insert leaves memory untouched
+    with _store.transaction(), _state_lock:
+        event["recorded_at"] = datetime.datetime.now()
+        seq = _store.append_event(event)
+        apply()
+        _bump_version()
+        event_log.append(event, seq)
+        if _balances is not None and event["bucket"] == "stock":
+            _balances.add(event)
+        if event_log.snapshot_due(len(inventory) + len(returns_inventory)):
+            state = _stock_state()
+            event_log.add_snapshot(event_log.last_seq, state)
+            _store.save_snapshot(event_log.last_seq, state)
+
+
+def _set_position(key, qty, unit_cost, event):
+    # The only write path for inventory: ``event`` describes the movement
+    # (type, timestamp, signed qty, unit_cost) and gets the new balance added
+    _record_event(dict(event, bucket="stock", outlet=key[0], sku=key[1], balance_qty=qty, balance_cost=unit_cost),
+                  lambda: inventory.set(key, qty, unit_cost))
+
+
+def _add_return(key, qty, unit_cost, event):
+    entry = returns_inventory.get(key)
+    balance = (entry["qty"] if entry else 0) + qty
+
+    def apply():
+        entry = returns_inventory.setdefault(key, {"qty": 0, "unit_cost": unit_cost, "reasons": []})
+        entry["qty"] = balance
+        entry["unit_cost"] = unit_cost  # keep last known cost
+        entry["reasons"].append(event.get("reason"))
+
+    _record_event(dict(event, bucket="returns", outlet=key[0], sku=key[1],
+                       balance_qty=balance, balance_cost=unit_cost), apply)
+
+
+@timed("stage.cost_append")
+def _record_cost(event):
+    with _store.transaction(), _state_lock:
+        event["entry"] = cost_history.append(event)
+        _store.append_cost_event(event)
+        _bump_version()
+
+
+def _render_args(doc):
+    # RN documents are printed against the receiving warehouse
+    return doc["doc_id"], doc["ref"], doc.get("warehouse", doc["outlet"]), doc["items"], doc["type"]
+
+
+def _pdf_key(doc):
+    return hashlib.sha256(dumps(_render_args(doc)).encode("utf-8")).hexdigest()
+
+
+# PDFs render in the background; PDF_WORKERS=0 renders inline instead
+_pdf_jobs = PdfJobQueue(
+    max_workers=int(os.environ["PDF_WORKERS"]) if os.environ.get("PDF_WORKERS") else None,
+    on_ready=doc_storage.put,
+)
+
+
+@timed("stage.document")
+def _record_document(doc):
+    # Only the document data is kept; its PDF is rendered when first viewed
+    with _store.transaction(), _state_lock:
+        document_index.add(doc)
+        _store.save_document(doc)
+        _bump_version()
+
+
+@timed("stage.save_order")
+def _save_order(kind, order):
+    with _store.transaction(), _state_lock:
+        _store.save_order(kind, order)
+        _bump_version()
+
+
+@timed("pdf.get_document_pdf")
+def get_document_pdf(doc, timeout=None):
+    """PDF bytes for a document, rendered on first request.
+
+    Returns None if the render is still running after ``timeout`` seconds
+    or has failed (see ``document_status``).
+    """
+    key = _pdf_key(doc)
+    pdf = doc_storage.get(key)
+    if pdf is not None:
+        return pdf
+    future = _pdf_jobs.submit(key, *_render_args(doc))
+    try:
+        return future.result(timeout)
+    except Exception:
+        return None
+
+
+def document_status(doc):
+    """"ready", "pending", "failed" or None if the PDF was never requested."""
+    key = _pdf_key(doc)
+    if key in doc_storage:
+        return "ready"
+    return _pdf_jobs.status(key)
+
+
+def wait_for_documents(timeout=None):
+    return _pdf_jobs.wait(timeout)
+
+
+def clear_all():
+    global _balances
+    _balances = None
+    po_list.clear()
+    to_list.clear()
+    cost_history.clear()
+    inventory.clear()
+    returns_inventory.clear()
+    event_log.clear()
+    document_index.clear()
+    _store.clear()
+    _bump_version()
 
 # ID generators
+@timed("stage.next_id")
+def _next_counter(name):
+    # Allocated by the store, so an id is never reused after a restart
+    with _store.transaction(), _state_lock:
+        doc_counters[name] = _store.next_counter(name, doc_counters[name] + 1)
+        return doc_counters[name]
+
 def generate_po_id():
-    doc_counters["PO"] += 1
-    return f"PO{doc_counters['PO']}"
+    return f"PO{_next_counter('PO')}"
 
 def generate_to_id():
-    doc_counters["TO"] += 1
-    return f"TO{doc_counters['TO']}"
+    return f"TO{_next_counter('TO')}"
 
 def generate_doc_id(doc_type):
-    doc_counters[doc_type] += 1
-    return f"{doc_type}{doc_counters[doc_type]}"
+    return f"{doc_type}{_next_counter(doc_type)}"
 
 # SKU management
 def add_sku(sku, cost):
     sku_list.append(sku)
+    set_item_cost(sku, cost)
+
+def set_item_cost(sku, cost):
     item_master[sku] = cost
+    _store.save_item(sku, cost)
+    _bump_version()
+
+def set_item_costs(costs):
+    """Save many (sku, cost) pairs at once; only changed costs are written."""
+    changed = [(sku, cost) for sku, cost in costs if item_master.get(sku) != cost]
+    item_master.update(changed)
+    _store.save_items(changed)
+    _bump_version()
+    return len(changed)
+
+
+# Bulk import / export (CSV, JSON Lines, or the old data/*.json files)
+def _apply_items(records):
+    added = updated = unchanged = 0
+    changed = []
+    for sku, cost in records:
+        if sku not in sku_list:
+            sku_list.append(sku)
+            added += 1
+        elif item_master.get(sku) == cost:
+            unchanged += 1
+            continue
+        else:
+            updated += 1
+        item_master[sku] = cost
+        changed.append((sku, cost))
+    _store.save_items(changed)
+    _bump_version()
+    return added, updated, unchanged
+
+
+def _apply_opening_stock(records):
+    added = updated = unchanged = 0
+    with _unit_of_work([(outlet, sku) for outlet, sku, _, _ in records]):
+        for outlet, sku, qty, unit_cost in records:
+            if unit_cost is None:
+                unit_cost = item_master.get(sku, get_unit_cost((outlet, sku)))
+            position = inventory.get((outlet, sku))
+            if position is None:
+                added += 1
+            elif position["qty"] == qty and position["unit_cost"] == unit_cost:
+                unchanged += 1
+                continue
+            else:
+                updated += 1
+            adjust_stock(outlet, sku, qty, unit_cost)
+    return added, updated, unchanged
+
+
+def _apply_outlets(records):
+    new = [outlet for outlet in records if outlet not in outlet_list]
+    outlet_list.extend(new)
+    _store.save_outlets(new)
+    _bump_version()
+    return len(new), 0, len(records) - len(new)
+
+
+@timed("flow.import_item_master")
+def import_item_master(source, fmt=None, chunk_size=bulk_io.CHUNK_ROWS):
+    """Upsert SKU costs from a file (rows of sku, cost); returns an import report."""
+    chunks = bulk_io.read_chunks(source, fmt, chunk_size, flatten=lambda doc: (
+        {"sku": sku, **(fields if isinstance(fields, dict) else {"cost": fields})} for sku, fields in doc.items()))
+    return bulk_io.import_rows(chunks, bulk_io.item_record, lambda record: record[0], _apply_items)
+
+
+@timed("flow.import_opening_stock")
+def import_opening_stock(source, fmt=None, chunk_size=bulk_io.CHUNK_ROWS):
+    """Set stock positions from a file (rows of outlet, sku, qty, optional unit_cost).
+
+    Each changed position is an ADJUST event; rows without a cost use the
+    item master cost. Rows for outlets or SKUs that are not set up yet are
+    counted as invalid. Returns an import report.
+    """
+    chunks = bulk_io.read_chunks(source, fmt, chunk_size, flatten=lambda doc: (
+        {"outlet": outlet, "sku": sku, "qty": qty} for outlet, skus in doc.items() for sku, qty in skus.items()))
+    return bulk_io.import_rows(chunks, _known_stock_record, lambda record: record[:2], _apply_opening_stock)
+
+
+def _known_stock_record(row):
+    record = bulk_io.stock_record(row)
+    if record[0] not in outlet_list:
+        raise ValueError(f"unknown outlet {record[0]}; import it in the outlet list first")
+    if record[1] not in sku_list:
+        raise ValueError(f"unknown SKU {record[1]}; add it in the Item Master first")
+    return record
+
+
+@timed("flow.import_outlets")
+def import_outlets(source, fmt=None, chunk_size=bulk_io.CHUNK_ROWS):
+    chunks = bulk_io.read_chunks(source, fmt, chunk_size, flatten=lambda doc: (
+        outlet if isinstance(outlet, dict) else {"outlet": outlet} for outlet in doc))
+    return bulk_io.import_rows(chunks, bulk_io.outlet_record, lambda record: record, _apply_outlets)
+
+
+def export_item_master(target, fmt=None):
+    return bulk_io.write_rows(target, ("sku", "cost"), ((sku, item_master.get(sku)) for sku in sku_list), fmt)
+
+
+def export_stock(target, fmt=None):
+    return bulk_io.write_rows(target, ("outlet", "sku", "qty", "unit_cost"), (
+        (outlet, sku, position["qty"], position["unit_cost"]) for (outlet, sku), position in inventory.items()), fmt)
+
+
+def export_outlets(target, fmt=None):
+    return bulk_io.write_rows(target, ("outlet",), ((outlet,) for outlet in outlet_list), fmt)
+
+
+def export_audit_log(target, fmt=None, start=None, end=None):
+    """Stream the cost events between two inclusive dates, oldest first, as CSV, JSON Lines or Parquet."""
+    return bulk_io.write_frames(target, COST_COLUMNS, cost_history.iter_frames(start, end, bulk_io.CHUNK_ROWS), fmt)
 
 # PO flow
+@timed("flow.add_po")
+def add_po(po):
+    """Register a new PO, given as a PurchaseOrder or a dict; returns the PurchaseOrder."""
+    po = po_list.add(po)
+    _save_order("PO", po)
+    return po
+
+def _order_key(order):
+    return "order", order.get("po_id") or order.get("to_id")
+
+def _first_of_each(orders, key=_order_key):
+    # An order listed twice in a batch is only received once, as first listed
+    unique = {}
+    for order in orders:
+        unique.setdefault(key(order), order)
+    return list(unique.values())
+
+@timed("flow.submit_po")
 def submit_po(po):
-    po["status"] = "Requesting"
+    with _unit_of_work([_order_key(po)]):
+        po_list.set_status(po, "Requesting")
+        _save_order("PO", po)
 
+@timed("flow.approve_po")
 def approve_po(po):
-    po["status"] = "Receiving"
+    with _unit_of_work([_order_key(po)]):
+        po_list.set_status(po, "Receiving")
+        _save_order("PO", po)
+
+@timed("stage.costing")
+def _apply_receipts(receipts, event_type, timestamp):
+    # Moving-average cost update for many (key, qty, unit_cost) receipts,
+    # each (outlet, sku) position written and logged once
+    if not receipts:
+        return
+    codes = {}
+    key_codes = [codes.setdefault(key, len(codes)) for key, _, _ in receipts]
+    positions = [inventory.get(key, {"qty": 0, "unit_cost": 0}) for key in codes]
+    new_qty, new_cost = costing.apply_receipts(
+        key_codes,
+        [qty for _, qty, _ in receipts],
+        [cost for _, _, cost in receipts],
+        [position["qty"] for position in positions],
+        [position["unit_cost"] for position in positions],
+    )
+    for key, position, qty, cost in zip(codes, positions, new_qty, new_cost):
+        moved = qty - position["qty"]
+        value = qty * cost - position["qty"] * position["unit_cost"]
+        _set_position(key, qty, cost, {
+            "type": event_type,
+            "timestamp": timestamp,
+            "qty": moved,
+            "unit_cost": value / moved if moved else cost,
+        })
+
 
+@timed("flow.receive_po")
 def receive_po(po, date_override=None):
-    for item in po["items"]:
-        sku = item["sku"]
-        qty = item["qty"]
-        cost = item["unit_cost"]
+    receive_pos_bulk([po], date_override)
+
+
+@timed("flow.receive_pos_bulk")
+@_in_transaction(lambda pos, *_, **__: [_order_key(po) for po in pos] +
+                  [(po["outlet"], sku) for po in pos for sku in po["items"].skus()])
+def receive_pos_bulk(pos, date_override=None):
+    """Receive many POs in one transaction and one costing pass.
+
+    Each PO still gets its own GRN document. POs that are already Completed
+    (e.g. received by another user a moment earlier) and repeats of a PO
+    earlier in the list are skipped.
+    """
+    timestamp = date_override or datetime.datetime.now()
+    pos = [po for po in _first_of_each(pos) if po["status"] != "Completed"]
+    receipts = []
+    for po in pos:
         outlet = po["outlet"]
-        key = (outlet, sku)
+        for item in po["items"]:
+            sku = item["sku"]
+            qty = item["qty"]
+            cost = item["unit_cost"]
+            receipts.append(((outlet, sku), qty, cost))
 
-        if key not in inventory:
-            inventory[key] = {"qty": 0, "unit_cost": 0}
+            _record_cost({
+                "timestamp": timestamp,
+                "type": "GRN",
+                "ref": po["po_id"],
+                "sku": sku,
+                "qty": qty,
+                "unit_cost": cost,
+                "total_cost": qty * cost,
+                "destination": outlet
+            })
 
-        prev_qty = inventory[key]["qty"]
-        prev_cost = inventory[key]["unit_cost"]
-        new_qty = prev_qty + qty
-        new_cost = ((prev_qty * prev_cost) + (qty * cost)) / new_qty if new_qty else cost
-        inventory[key]["qty"] = new_qty
-        inventory[key]["unit_cost"] = new_cost
+    _apply_receipts(receipts, "GRN", timestamp)
 
-        cost_history.append({
-            "timestamp": date_override or datetime.datetime.now(),
+    # Create one GRN doc per PO, with all items
+    for po in pos:
+        doc_id = generate_doc_id("GRN")
+        _record_document({
+            "timestamp": timestamp,
+            "doc_id": doc_id,
+            "ref": po["po_id"],
             "type": "GRN",
-            "sku": sku,
-            "qty": qty,
-            "unit_cost": cost,
-            "total_cost": qty * cost,
-            "outlet": outlet
+            "outlet": po["outlet"],
+            "items": list(po["items"])
         })
 
-    # Create one GRN doc per PO, with all items
-    doc_id = generate_doc_id("GRN")
-    documents["GRN"].append({
-        "timestamp": date_override or datetime.datetime.now(),
-        "doc_id": doc_id,
-        "ref": po["po_id"],
-        "type": "GRN",
-        "outlet": po["outlet"],
-        "items": po["items"]
-    })
-    doc_storage[doc_id] = generate_pdf(doc_id, po["po_id"], po["outlet"], po["items"], "GRN")
-
-    po["status"] = "Completed"
+        po_list.set_status(po, "Completed")
+        _save_order("PO", po)
 
 
 # TO flow
+@timed("flow.add_to")
+def add_to(to):
+    """Register a new TO, given as a TransferOrder or a dict; returns the TransferOrder."""
+    to = to_list.add(to)
+    _save_order("TO", to)
+    return to
+
+@timed("flow.submit_to")
 def submit_to(to):
-    to["status"] = "Requesting"
+    with _unit_of_work([_order_key(to)]):
+        to_list.set_status(to, "Requesting")
+        _save_order("TO", to)
 
+@timed("flow.approve_to")
 def approve_to(to):
-    to["status"] = "Processing"
-    to["fulfilled_qty"] = 0
-    to["received_qty"] = 0
+    with _unit_of_work([_order_key(to)]):
+        to_list.set_status(to, "Processing")
+        _save_order("TO", to)
 
+@timed("flow.fulfill_to")
+@_in_transaction(lambda to, *_, **__: [_order_key(to)] + [(to["source"], sku) for sku in to["items"].skus()])
 def fulfill_to(to, fulfill_qty_dict, fulfill_date):
+    # Another user may have fulfilled this TO while the form was open
+    if to["status"] != "Processing":
+        return
     do_items = []
 
-    for item in to["items"]:
-        sku = item["sku"]
-        requested_qty = item["qty"]
+    for line in to.progress():
+        sku = line["sku"]
         fulfill_qty = fulfill_qty_dict.get(sku, 0)
         source = to["source"]
         key = (source, sku)
@@ -116,16 +955,32 @@ def fulfill_to(to, fulfill_qty_dict, fulfill_date):
             continue
 
         if key not in inventory or inventory[key]["qty"] < fulfill_qty:
-            to["status"] = "Error - Insufficient stock at source"
+            to_list.set_status(to, "Error - Insufficient stock at source")
             continue
 
         # Deduct from source
-        inventory[key]["qty"] -= fulfill_qty
-        to["fulfilled_qty_dict"] = to.get("fulfilled_qty_dict", {})
-        to["fulfilled_qty_dict"][sku] = to["fulfilled_qty_dict"].get(sku, 0) + fulfill_qty
+        _set_position(key, inventory[key]["qty"] - fulfill_qty, inventory[key]["unit_cost"], {
+            "type": "DO",
+            "timestamp": fulfill_date or datetime.datetime.now(),
+            "qty": -fulfill_qty,
+            "unit_cost": inventory[key]["unit_cost"],
+        })
+        to.add_fulfilled(sku, fulfill_qty)
 
         unit_cost = inventory[key]["unit_cost"]
 
+        _record_cost({
+            "timestamp": fulfill_date or datetime.datetime.now(),
+            "type": "DO",
+            "ref": to["to_id"],
+            "sku": sku,
+            "qty": fulfill_qty,
+            "unit_cost": unit_cost,
+            "total_cost": fulfill_qty * unit_cost,
+            "source": source,
+            "destination": IN_TRANSIT
+        })
+
         do_items.append({
             "sku": sku,
             "qty": fulfill_qty,
@@ -136,7 +991,7 @@ def fulfill_to(to, fulfill_qty_dict, fulfill_date):
     # Create one DO doc per TO fulfillment event, with all items
     if do_items:
         doc_id = generate_doc_id("DO")
-        documents["DO"].append({
+        _record_document({
             "timestamp": fulfill_date or datetime.datetime.now(),
             "doc_id": doc_id,
             "ref": to["to_id"],
@@ -144,131 +999,237 @@ def fulfill_to(to, fulfill_qty_dict, fulfill_date):
             "outlet": to["source"],
             "items": do_items
         })
-        doc_storage[doc_id] = generate_pdf(doc_id, to["to_id"], to["source"], do_items, "DO")
-
-    to["status"] = "Receiving"
 
+    to_list.set_status(to, "Receiving")
+    _save_order("TO", to)
 
 
+@timed("flow.receive_to")
 def receive_to(to, receive_qty_dict, date_override=None):
-    tn_items = []
+    receive_tos_bulk([(to, receive_qty_dict)], date_override)
 
-    for item in to["items"]:
-        sku = item["sku"]
-        requested_qty = item["qty"]
-        receive_qty = receive_qty_dict.get(sku, 0)
-        key = (to["destination"], sku)
 
-        if receive_qty <= 0:
+@timed("flow.receive_tos_bulk")
+@_in_transaction(lambda receipts, *_, **__: [_order_key(to) for to, _ in receipts] + [
+    (outlet, sku) for to, _ in receipts for outlet in (to["source"], to["destination"]) for sku in to["items"].skus()])
+def receive_tos_bulk(receipts, date_override=None):
+    """Receive many TOs, given as (to, receive_qty_dict) pairs, in one pass.
+
+    Transfer costs are read from the source positions before any line of the
+    batch is applied. Each TO still gets its own TN document. Quantities are
+    capped at what is still in transit, so two users receiving the same TO
+    cannot book it twice; a TO listed twice only gets its first entry.
+    """
+    timestamp = date_override or datetime.datetime.now()
+    lines = []
+    tn_docs = []
+    for to, receive_qty_dict in _first_of_each(receipts, lambda receipt: _order_key(receipt[0])):
+        if to["status"] == "Completed":
             continue
+        tn_items = []
+        for line in to.progress():
+            sku = line["sku"]
+            receive_qty = min(receive_qty_dict.get(sku, 0), line["in_transit"])
+            key = (to["destination"], sku)
 
-        if key not in inventory:
-            inventory[key] = {"qty": 0, "unit_cost": 0}
+            if receive_qty <= 0:
+                continue
 
-        unit_cost = get_unit_cost((to["source"], sku))
+            unit_cost = get_unit_cost((to["source"], sku))
+            lines.append((key, receive_qty, unit_cost))
 
-        prev_qty = inventory[key]["qty"]
-        prev_cost = inventory[key]["unit_cost"]
-        new_qty = prev_qty + receive_qty
-        new_cost = ((prev_qty * prev_cost) + (receive_qty * unit_cost)) / new_qty if new_qty else unit_cost
-        inventory[key]["qty"] = new_qty
-        inventory[key]["unit_cost"] = new_cost
+            _record_cost({
+                "timestamp": timestamp,
+                "type": "TN",
+                "ref": to["to_id"],
+                "sku": sku,
+                "qty": receive_qty,
+                "unit_cost": unit_cost,
+                "total_cost": receive_qty * unit_cost,
+                "source": IN_TRANSIT,
+                "destination": to["destination"]
+            })
 
-        cost_history.append({
-            "timestamp": date_override or datetime.datetime.now(),
-            "type": "TN",
-            "sku": sku,
-            "qty": receive_qty,
-            "unit_cost": unit_cost,
-            "total_cost": receive_qty * unit_cost,
-            "outlet": to["destination"]
-        })
+            to.add_received(sku, receive_qty)
 
-        to["received_qty_dict"] = to.get("received_qty_dict", {})
-        to["received_qty_dict"][sku] = to["received_qty_dict"].get(sku, 0) + receive_qty
+            tn_items.append({
+                "sku": sku,
+                "qty": receive_qty,
+                "unit_cost": unit_cost,
+                "total_cost": receive_qty * unit_cost
+            })
+        tn_docs.append((to, tn_items))
 
-        tn_items.append({
-            "sku": sku,
-            "qty": receive_qty,
-            "unit_cost": unit_cost,
-            "total_cost": receive_qty * unit_cost
-        })
+    _apply_receipts(lines, "TN", timestamp)
 
-    # Create one TN doc per TO receive event, with all items
-    if tn_items:
-        doc_id = generate_doc_id("TN")
-        documents["TN"].append({
-            "timestamp": date_override or datetime.datetime.now(),
-            "doc_id": doc_id,
-            "ref": to["to_id"],
-            "type": "TN",
-            "outlet": to["destination"],
-            "items": tn_items
-        })
-        doc_storage[doc_id] = generate_pdf(doc_id, to["to_id"], to["destination"], tn_items, "TN")
+    for to, tn_items in tn_docs:
+        # Create one TN doc per TO receive event, with all items
+        if tn_items:
+            doc_id = generate_doc_id("TN")
+            _record_document({
+                "timestamp": timestamp,
+                "doc_id": doc_id,
+                "ref": to["to_id"],
+                "type": "TN",
+                "outlet": to["destination"],
+                "items": tn_items
+            })
 
-    # After loop, check if all items are received
-    all_received = True
-    for item in to["items"]:
-        sku = item["sku"]
-        requested = item["qty"]
-        received = to.get("received_qty_dict", {}).get(sku, 0)
-        if received < requested:
-            all_received = False
-            break
+        to_list.set_status(to, "Completed" if to.fully_received else "Processing")
+        _save_order("TO", to)
 
-    to["status"] = "Completed" if all_received else "Processing"
 
+# Manual stock adjustment
+@timed("flow.adjust_stock")
+@_in_transaction(lambda outlet, sku, *_, **__: [(outlet, sku)])
+def adjust_stock(outlet, sku, qty, unit_cost, date_override=None):
+    key = (outlet, sku)
+    position = inventory.get(key)
+    prev_qty = position["qty"] if position else 0
+    if position is not None and prev_qty == qty and position["unit_cost"] == unit_cost:
+        return
+    timestamp = date_override or datetime.datetime.now()
+    _set_position(key, qty, unit_cost, {
+        "type": "ADJUST",
+        "timestamp": timestamp,
+        "qty": qty - prev_qty,
+        "unit_cost": unit_cost,
+    })
+    # In the cost history an adjustment moves the difference into the
+    # outlet (from nowhere) or out of it, and revalues it at unit_cost
+    moved = abs(qty - prev_qty)
+    _record_cost({
+        "timestamp": timestamp,
+        "type": "ADJUST",
+        "sku": sku,
+        "qty": moved,
+        "unit_cost": unit_cost,
+        "total_cost": moved * unit_cost,
+        "source": outlet if qty < prev_qty else None,
+        "destination": None if qty < prev_qty else outlet,
+    })
+
+
+@timed("flow.adjust_stock_batch")
+def adjust_stock_batch(outlet, rows, date_override=None):
+    """Set many (sku, qty, unit_cost) balances at one outlet in one transaction.
+
+    Only rows that differ from the current position are written, each as an
+    ADJUST event with a shared timestamp. Returns the SKUs that changed.
+    """
+    timestamp = date_override or datetime.datetime.now()
+    rows = list(rows)
+    changed = []
+    with _unit_of_work([(outlet, sku) for sku, _, _ in rows]):
+        current = inventory.skus_for(outlet)
+        for sku, qty, unit_cost in rows:
+            position = current.get(sku)
+            if position is not None and position["qty"] == qty and position["unit_cost"] == unit_cost:
+                continue
+            adjust_stock(outlet, sku, qty, unit_cost, timestamp)
+            changed.append(sku)
+    return changed
 
 
 # Cost helper
 def get_unit_cost(key):
     return inventory.get(key, {}).get("unit_cost", 1.0)
 
-# PDF generation
-def generate_pdf(doc_id, ref, outlet, items, doc_type):
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer)
-    p.setFont("Helvetica-Bold", 14)
-    p.drawString(100, 800, f"{doc_type} DOCUMENT")
-    p.setFont("Helvetica", 12)
-    p.drawString(100, 780, f"Document ID: {doc_id}")
-    p.drawString(100, 765, f"Reference: {ref}")
-    p.drawString(100, 750, f"Outlet: {outlet}")
-
-    y = 720
-    p.setFont("Helvetica-Bold", 11)
-    p.drawString(100, y, "SKU")
-    p.drawString(220, y, "Qty")
-    p.drawString(300, y, "Unit Cost")
-    p.drawString(400, y, "Total Cost")
-    y -= 18
-    p.setFont("Helvetica", 11)
-
-    for item in items:
-        sku = item['sku']
-        qty = item['qty']
-        unit_cost = item.get('unit_cost', 0)
-        total_cost = qty * unit_cost
-        p.drawString(100, y, str(sku))
-        p.drawString(220, y, str(qty))
-        p.drawString(300, y, f"RM {unit_cost:.2f}")
-        p.drawString(400, y, f"RM {total_cost:.2f}")
-        if item.get("reason"):
-            p.drawString(500, y, f"{item['reason']}")
-        y -= 16
-        if y < 50:  # Start new page if needed
-            p.showPage()
-            y = 800
-    p.showPage()
-    p.save()
-    pdf = buffer.getvalue()
-    buffer.close()
-    return base64.b64encode(pdf).decode("utf-8")
 
+# Revaluation and reconciliation
+def replay_inventory():
+    """Positions rebuilt from scratch by replaying cost_history in recorded order."""
+    return costing.replay(cost_history.to_frame())
+
+
+def reconcile_inventory(tolerance=1e-6):
+    """Positions where the live ledger and the replayed history disagree."""
+    replayed = replay_inventory().set_index(["outlet", "sku"])
+    live = pd.DataFrame(
+        [(outlet, sku, position["qty"], position["unit_cost"]) for (outlet, sku), position in inventory.items()],
+        columns=["outlet", "sku", "qty", "unit_cost"],
+    ).set_index(["outlet", "sku"])
+    merged = live.join(replayed, how="outer", lsuffix="_live", rsuffix="_replayed").fillna(0)
+    differs = ((merged["qty_live"] - merged["qty_replayed"]).abs() > tolerance) | (
+        (merged["unit_cost_live"] - merged["unit_cost_replayed"]).abs() > tolerance)
+    return merged[differs].reset_index()
+
+
+def stock_at(seq=None, recorded_at=None):
+    """(inventory, returns_inventory) as plain dicts as they stood after
+    stock event ``seq``, or at wall-clock time ``recorded_at``.
+
+    Starts from the nearest snapshot and replays only the events after it;
+    states older than what is held in memory are read from the store.
+    """
+    if recorded_at is not None:
+        seq = event_log.seq_at(recorded_at)
+        if seq is None:
+            seq = _store.seq_at(recorded_at) or 0
+    if seq is None:
+        seq = event_log.last_seq
+    state = event_log.state_at(seq)
+    if state is None:
+        state = replay_events(*_store.load_state_at(seq))
+    return state
+
+
+def _balance_index():
+    global _balances
+    with _store.transaction(), _state_lock:
+        if _balances is None:
+            _balances = _build_balance_index()
+    return _balances
+
+
+def _build_balance_index():
+    if event_log.base_seq == 0:
+        opening, history = event_log.snapshots[0][1], event_log.events
+    else:
+        # Only the tail is in memory; the index needs the whole log once
+        opening, _ = _store.load_state_at(0)
+        history = _store.load_events(0)
+    balances = BalanceIndex(opening["inventory"])
+    for event in history:
+        if event["bucket"] == "stock":
+            balances.add(event)
+    return balances
 
+
+def balance_as_of(outlet, sku, when):
+    """(qty, value) of one position as of ``when``, by business timestamp.
+
+    A date includes the whole day. Backdated movements count from the date
+    they were booked for, not from when they were entered.
+    """
+    return _balance_index().at((outlet, sku), _end_of(when))
+
+
+def _end_of(when):
+    # A date means the end of that day
+    if not isinstance(when, datetime.datetime):
+        when = datetime.datetime.combine(when, datetime.time.max)
+    return when
+
+
+@_view
+def stock_as_of(when, outlet=None):
+    """{(outlet, sku): {"qty", "value"}} as of ``when``, see ``balance_as_of``."""
+    index, when = _balance_index(), _end_of(when)
+    balances = {}
+    for key in index.keys(outlet):
+        qty, value = index.at(key, when)
+        balances[key] = {"qty": qty, "value": value}
+    return balances
+
+
+@timed("flow.process_stock_return")
+@_in_transaction(lambda outlet, warehouse, return_items, *_, **__: [
+    (location, item["sku"]) for item in return_items for location in (outlet, warehouse)])
 def process_stock_return(outlet, warehouse, return_items, date_override=None):
     rn_items = []
+    timestamp = date_override or datetime.datetime.now()
+    doc_id = generate_doc_id("RN")
     for item in return_items:
         sku = item["sku"]
         qty = item["qty"]
@@ -281,27 +1242,36 @@ def process_stock_return(outlet, warehouse, return_items, date_override=None):
             prev_qty = inventory[key_outlet]["qty"]
             prev_cost = inventory[key_outlet]["unit_cost"]
             new_qty = max(prev_qty - qty, 0)
-            inventory[key_outlet]["qty"] = new_qty
+            _set_position(key_outlet, new_qty, prev_cost, {
+                "type": "RETURN",
+                "timestamp": timestamp,
+                "qty": new_qty - prev_qty,
+                "unit_cost": prev_cost,
+                "reason": reason,
+            })
         else:
             prev_cost = 1.0  # fallback if missing
 
         # Add to returns bucket in warehouse
-        if key_warehouse not in returns_inventory:
-            returns_inventory[key_warehouse] = {"qty": 0, "unit_cost": prev_cost, "reasons": []}
-        returns_inventory[key_warehouse]["qty"] += qty
-        returns_inventory[key_warehouse]["unit_cost"] = prev_cost  # keep last known cost
-        returns_inventory[key_warehouse]["reasons"].append(reason)
+        _add_return(key_warehouse, qty, prev_cost, {
+            "type": "RETURN",
+            "timestamp": timestamp,
+            "qty": qty,
+            "unit_cost": prev_cost,
+            "reason": reason,
+        })
 
         # --- AUDIT LOG ENTRY (add here) ---
-        cost_history.append({
-            "timestamp": date_override or datetime.datetime.now(),
+        _record_cost({
+            "timestamp": timestamp,
             "type": "RETURN",
+            "ref": doc_id,
             "sku": sku,
             "qty": qty,
             "unit_cost": prev_cost,
             "total_cost": qty * prev_cost,
-            "from": outlet,
-            "to": warehouse,
+            "source": outlet,
+            "destination": warehouse,
             "reason": reason
         })
         # --- END AUDIT LOG ENTRY ---
@@ -314,16 +1284,90 @@ def process_stock_return(outlet, warehouse, return_items, date_override=None):
         })
 
     # Generate one RN document for this return
-    doc_id = generate_doc_id("RN")
-    documents["RN"].append({
-        "timestamp": date_override or datetime.datetime.now(),
+    doc = {
+        "timestamp": timestamp,
         "doc_id": doc_id,
         "ref": f"{outlet}_to_{warehouse}",
         "type": "RN",
         "outlet": outlet,
         "warehouse": warehouse,
         "items": rn_items
+    }
+    _record_document(doc)
+    return doc
+
+
+# Derived views for the UI, memoized until the next mutation (see _view)
+@_view
+def stock_by_sku():
+    """Network-wide qty and value of every SKU with stock."""
+    by_sku = inventory.sku_totals()
+    return by_sku[by_sku["qty"] != 0]
+
+
+@_view
+def outlet_stock_view(outlet):
+    """SKU / Quantity / Unit Cost frame of one outlet's positions, sorted by SKU."""
+    return pd.DataFrame(
+        sorted((sku, position["qty"], position["unit_cost"]) for sku, position in inventory.skus_for(outlet).items()),
+        columns=["SKU", "Quantity", "Unit Cost"],
+    )
+
+
+@_view
+def cost_filter_options():
+    """(locations, skus) that appear in the cost history."""
+    return cost_history.locations(), cost_history.skus()
+
+
+@_view
+def cost_totals(start, end):
+    """In / out / net qty and cost per (location, sku) between two inclusive dates."""
+    totals = cost_history.totals_frame(start, end)
+    totals["net_qty"] = totals["in_qty"] - totals["out_qty"]
+    totals["net_cost"] = totals["in_cost"] - totals["out_cost"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        totals["avg_in_cost"] = (totals["in_cost"] / totals["in_qty"]).round(2)
+    return totals
+
+
+@_view
+def in_transit_by_sku():
+    """SKU / Quantity / Value shipped on DOs and not yet received, network-wide."""
+    rows = [(sku, in_qty - out_qty, in_cost - out_cost)
+            for (_, sku), (in_qty, in_cost, out_qty, out_cost) in cost_history.totals(location=IN_TRANSIT).items()
+            if in_qty != out_qty]
+    return pd.DataFrame(sorted(rows), columns=["SKU", "Quantity", "Value"])
+
+
+@_view
+def in_transit_orders():
+    """TO ID / From / To / Requested / Fulfilled / Received / In Transit of every open TO."""
+    return pd.DataFrame(
+        [(to["to_id"], to["source"], to["destination"], to.requested_qty, to.fulfilled_qty, to.received_qty,
+          to.in_transit_qty) for to in to_list.with_status("Processing", "Receiving")],
+        columns=["TO ID", "From", "To", "Requested", "Fulfilled", "Received", "In Transit"],
+    )
+
+
+@_view
+def audit_page(location, page, page_size):
+    """(total events, one page of them formatted for display), newest first; location None for all."""
+    total, df = cost_history.page((page - 1) * page_size, page_size, location)
+    return total, pd.DataFrame({
+        "Timestamp": df["timestamp"],
+        "Type": df["type"],
+        "Ref": df["ref"],
+        "SKU": df["sku"],
+        "Quantity": df["qty"],
+        "Unit Cost": "RM " + df["unit_cost"].map("{:.2f}".format),
+        "Total Cost": "RM " + df["total_cost"].map("{:.2f}".format),
+        "From": df["source"],
+        "To": df["destination"],
+        "Reason": df["reason"],
     })
-    doc_storage[doc_id] = generate_pdf(doc_id, f"{outlet}_to_{warehouse}", warehouse, rn_items, "RN")
 
 
+# Use the shared SQLite store when one is configured for this deployment
+if os.environ.get("INVENTORY_DB"):
+    configure_store(SQLiteStore(os.environ["INVENTORY_DB"]))